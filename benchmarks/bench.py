@@ -0,0 +1,407 @@
+"""
+Times and memory-profiles the zone handling paths of cotendo.
+
+    python benchmarks/bench.py --sizes 1000,10000,100000 -o results.json
+
+Every benchmark runs in a forked process, so the memory it reports is its
+own: peak_rss_kb is the growth of the peak resident size during the timed
+runs (exact on Linux, where the peak is reset first), rss_delta_kb the
+memory still held after them. The results are written as JSON:
+
+    {"python": ..., "platform": ..., "seed": ..., "created": ...,
+     "results": [{"benchmark": "config", "records": 10000, "ops": 1,
+                  "repeat": 5, "min": ..., "median": ..., "per_op": ...,
+                  "peak_rss_kb": ..., "rss_delta_kb": ...}, ...]}
+
+Times are in seconds, per_op is min / ops.
+"""
+import gc
+import json
+import optparse
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from suds.client import Client, SoapClient
+from suds.plugin import PluginContainer
+
+from cotendo import CotendoPlugin, bundled_wsdl
+from cotendo.cotendohelper import CotendoObject, CotendoDNS, dns_tag_lookup
+from cotendo.testing import StandInServer
+from cotendo.transport import PooledTransport
+from zonegen import generate_config
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+default_sizes = (1000, 10000, 100000)
+# Number of lookups/inserts/deletes timed by the record benchmarks
+record_ops = 1000
+
+def _proc_status(field):
+    """A kB value of /proc/self/status, None without /proc"""
+    try:
+        f = open('/proc/self/status')
+    except IOError:
+        return None
+    try:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    finally:
+        f.close()
+
+def _reset_peak():
+    """Reset the peak resident size of the process, Linux only"""
+    try:
+        f = open('/proc/self/clear_refs', 'w')
+    except IOError:
+        return False
+    try:
+        f.write('5')
+    finally:
+        f.close()
+    return True
+
+def _peak_rss():
+    peak = _proc_status('VmHWM')
+    if peak is None and resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            peak //= 1024
+    return peak
+
+class Zone(object):
+    """Lazily built fixtures of a zone size"""
+    def __init__(self, size, seed):
+        self.size = size
+        self.seed = seed
+        self._config = None
+        self._dns = None
+
+    @property
+    def config(self):
+        if self._config is None:
+            self._config = generate_config(self.size, self.seed)
+        return self._config
+
+    @property
+    def dns(self):
+        if self._dns is None:
+            self._dns = CotendoDNS(('token', self.config), stream=True)
+        return self._dns
+
+    def keys(self, n):
+        rng = random.Random(self.seed)
+        keys = [(r._record_type, r.host) for r in self.dns._store]
+        return [rng.choice(keys) for i in xrange(n)]
+
+    def new_records(self, n):
+        rng = random.Random(self.seed + 1)
+        records = []
+        for i in xrange(n):
+            record_type = rng.choice(('a', 'cname', 'txt'))
+            result = {'a': ('10.9.8.7',), 'cname': ('bench.example.com.',),
+                      'txt': ('bench',)}[record_type]
+            records.append(dns_tag_lookup[record_type].from_params(
+                record_type, 'bench%d' % i, [result]))
+        return records
+
+# Benchmarks take a Zone and return (setup, run, ops): setup is called
+# before every timed run and its return value is given to run
+
+def bench_add_config_soup(zone):
+    config = zone.config
+    def setup():
+        return CotendoObject.__new__(CotendoObject)
+    def run(obj):
+        obj._add_config(config, stream=False)
+    return setup, run, 1
+
+def bench_add_config_stream(zone):
+    config = zone.config
+    def setup():
+        return CotendoObject.__new__(CotendoObject)
+    def run(obj):
+        obj._add_config(config, stream=True)
+    return setup, run, 1
+
+def bench_get_entries(zone):
+    obj = CotendoObject.__new__(CotendoObject)
+    obj._add_config(zone.config, stream=False)
+    data = obj._data
+    def setup():
+        dns = CotendoDNS.__new__(CotendoDNS)
+        dns._data = data
+        return dns
+    def run(dns):
+        dns._get_entries()
+    return setup, run, 1
+
+def bench_get_record(zone):
+    dns = zone.dns
+    keys = zone.keys(record_ops)
+    def setup():
+        return keys
+    def run(keys):
+        get_record = dns.get_record
+        for record_type, host in keys:
+            get_record(record_type, host)
+    return setup, run, len(keys)
+
+def bench_add_record(zone):
+    dns = zone.dns
+    records = zone.new_records(record_ops)
+    def setup():
+        for record in records:
+            dns.del_record(record._record_type, record.host)
+        return records
+    def run(records):
+        add_record = dns.add_record
+        for record in records:
+            add_record(record)
+    return setup, run, len(records)
+
+def bench_del_record(zone):
+    dns = zone.dns
+    records = zone.new_records(record_ops)
+    def setup():
+        for record in records:
+            dns.add_record(record)
+        return [(r._record_type, r.host) for r in records]
+    def run(keys):
+        del_record = dns.del_record
+        for record_type, host in keys:
+            del_record(record_type, host)
+    return setup, run, len(records)
+
+def bench_sort(zone):
+    dns = zone.dns
+    def setup():
+        return dns
+    def run(dns):
+        dns.sort()
+    return setup, run, 1
+
+def bench_config_cold(zone):
+    dns = zone.dns
+    def setup():
+        for record in dns._store:
+            record._xml = None
+        dns._config = None
+        return dns
+    def run(dns):
+        dns.config
+    return setup, run, 1
+
+def bench_config_warm(zone):
+    dns = zone.dns
+    dns.config
+    keys = zone.keys(1)
+    def setup():
+        # One record changed since the last serialization
+        record = dns.get_record(*keys[0])
+        record.host = record.host
+        return dns
+    def run(dns):
+        dns.config
+    return setup, run, 1
+
+def bench_marshalled(zone):
+    client = Client(bundled_wsdl, plugins=[CotendoPlugin()])
+    method = client.service.dns_set_conf.method
+    soap = SoapClient(client, method)
+    plugins = PluginContainer(soap.options.plugins)
+    args = ('example.com', zone.dns.config, '0', 'token')
+    def setup():
+        return method.binding.input.get_message(method, args, {})
+    def run(soapenv):
+        plugins.message.marshalled(envelope=soapenv.root())
+    return setup, run, 1
+
+def _stand_in_client(zone, compress=None):
+    server = StandInServer({
+        'dns_get_conf': lambda name, env: ('token', zone.config)},
+        compress=compress).start()
+    client = server.client(stream=True, transport=PooledTransport())
+    # Load the service definition and open the connection
+    client.dns_publish_conf('example.com')
+    return client
+
+def bench_get_conf_buffered(zone):
+    client = _stand_in_client(zone)
+    def setup():
+        return client
+    def run(client):
+        CotendoDNS(client._invoke('dns_get_conf', 'example.com', 0), True)
+    return setup, run, 1
+
+def bench_get_conf_streamed(zone):
+    client = _stand_in_client(zone)
+    def setup():
+        return client
+    def run(client):
+        client.dns_get_conf('example.com', 0)
+    return setup, run, 1
+
+def bench_get_conf_gzip(zone):
+    client = _stand_in_client(zone, 'gzip')
+    def setup():
+        return client
+    def run(client):
+        client.dns_get_conf('example.com', 0)
+    return setup, run, 1
+
+benchmarks = [
+    ('add_config_soup', bench_add_config_soup),
+    ('add_config_stream', bench_add_config_stream),
+    ('get_entries', bench_get_entries),
+    ('get_record', bench_get_record),
+    ('add_record', bench_add_record),
+    ('del_record', bench_del_record),
+    ('sort', bench_sort),
+    ('config_cold', bench_config_cold),
+    ('config_warm', bench_config_warm),
+    ('marshalled', bench_marshalled),
+    ('get_conf_buffered', bench_get_conf_buffered),
+    ('get_conf_streamed', bench_get_conf_streamed),
+    ('get_conf_gzip', bench_get_conf_gzip),
+    ]
+
+def measure(name, factory, size, seed, repeat):
+    """Run a benchmark in the current process, returns its result dict"""
+    zone = Zone(size, seed)
+    setup, run, ops = factory(zone)
+    gc.collect()
+    rss_before = _proc_status('VmRSS')
+    if _reset_peak():
+        peak_before = rss_before
+    else:
+        peak_before = _peak_rss()
+    times = []
+    for i in xrange(repeat):
+        arg = setup()
+        start = time.time()
+        run(arg)
+        times.append(time.time() - start)
+        del arg
+    rss_after = _proc_status('VmRSS')
+    peak_after = _peak_rss()
+    times.sort()
+    result = {
+        'benchmark': name,
+        'records': size,
+        'ops': ops,
+        'repeat': repeat,
+        'min': times[0],
+        'median': times[len(times) // 2],
+        'per_op': times[0] / ops,
+        'peak_rss_kb': None,
+        'rss_delta_kb': None,
+        }
+    if peak_before is not None:
+        result['peak_rss_kb'] = peak_after - peak_before
+    if rss_before is not None:
+        result['rss_delta_kb'] = rss_after - rss_before
+    return result
+
+def measure_isolated(name, factory, size, seed, repeat):
+    """Run a benchmark in a forked process, when fork is available"""
+    if not hasattr(os, 'fork'):
+        return measure(name, factory, size, seed, repeat)
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            try:
+                result = measure(name, factory, size, seed, repeat)
+            except Exception, e:
+                result = {'benchmark': name, 'records': size,
+                          'error': "%s: %s" % (e.__class__.__name__, e)}
+            os.write(write_fd, json.dumps(result))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    data = []
+    while True:
+        chunk = os.read(read_fd, 65536)
+        if not chunk:
+            break
+        data.append(chunk)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    if not data:
+        return {'benchmark': name, 'records': size,
+                'error': "benchmark process died"}
+    return json.loads("".join(data))
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-s", "--sizes", default=",".join(map(str, default_sizes)),
+                      help="comma separated zone sizes [%default]")
+    parser.add_option("-b", "--benchmarks", default=None,
+                      help="comma separated benchmarks to run [all]")
+    parser.add_option("-r", "--repeat", type="int", default=5,
+                      help="timed runs of every benchmark [%default]")
+    parser.add_option("--seed", type="int", default=0,
+                      help="zone generator seed [%default]")
+    parser.add_option("-o", "--output", default=None,
+                      help="file to write the JSON results to [stdout]")
+    parser.add_option("-l", "--list", action="store_true",
+                      help="list the benchmarks and exit")
+    options, args = parser.parse_args(argv)
+
+    if options.list:
+        for name, factory in benchmarks:
+            print name
+        return 0
+
+    sizes = [int(size) for size in options.sizes.split(",")]
+    selected = benchmarks
+    if options.benchmarks:
+        names = options.benchmarks.split(",")
+        selected = [b for b in benchmarks if b[0] in names]
+        unknown = set(names) - set(b[0] for b in selected)
+        if unknown:
+            parser.error("unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+
+    results = []
+    for size in sizes:
+        for name, factory in selected:
+            result = measure_isolated(
+                name, factory, size, options.seed, options.repeat)
+            results.append(result)
+            if 'error' in result:
+                print >>sys.stderr, "%-18s %8d  %s" % (
+                    name, size, result['error'])
+            else:
+                print >>sys.stderr, "%-18s %8d  %10.6fs  %8s kB" % (
+                    name, size, result['min'], result['peak_rss_kb'])
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': options.seed,
+        'created': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'results': results,
+        }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        f = open(options.output, 'w')
+        try:
+            f.write(output + "\n")
+        finally:
+            f.close()
+    else:
+        print output
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Deterministic synthetic zones for the benchmarks.
+
+The same size and seed always give the same zone, records are spread over
+every record type of dns_tag_lookup (the SOA and NS records are the fixed
+cotendo ones heading every configuration). The zones pass validate_zone.
+"""
+import random
+
+from cotendo.cotendohelper import config_header, config_footer
+
+# Share of the records of every type
+type_weights = (
+    ('a', 45),
+    ('cname', 25),
+    ('mx', 5),
+    ('ptr', 10),
+    ('srv', 5),
+    ('txt', 10),
+    )
+
+def _host(rng, record_type, i):
+    if record_type == 'cname':
+        # A CNAME can't share its host with other records
+        return "alias%d" % i
+    return "%s%d" % (rng.choice(('www', 'api', 'mail', 'cdn', 'db', 'app')), i)
+
+def _result(rng, record_type, i, n):
+    """Attributes of the result n of a record, in serialization order"""
+    ttl = str(rng.choice((60, 300, 1800, 3600, 10800)))
+    if record_type == 'a':
+        return (('ttl', ttl), ('ip', "10.%d.%d.%d" % (
+            i >> 14 & 255, i >> 6 & 255, (i & 63) * 4 + n)))
+    if record_type in ('cname', 'ptr'):
+        return (('ttl', ttl), ('domain_name', "host%d-%d.example.com." % (i, n)))
+    if record_type == 'mx':
+        return (('ttl', ttl), ('domain_name', "mx%d-%d.example.com." % (i, n)),
+                ('preference', str(10 * (n + 1))))
+    if record_type == 'srv':
+        return (('ttl', ttl), ('domain_name', "_sip._tcp%d." % i),
+                ('priority', str(rng.randint(0, 10))),
+                ('weight', str(rng.randint(0, 100))),
+                ('port', str(rng.choice((80, 443, 5060)))),
+                ('target', "sip%d-%d.example.com." % (i, n)))
+    return (('ttl', ttl),
+            ('text', "v=spf1 include:spf%d-%d.example.com -all" % (i, n)))
+
+def generate_records(size, seed=0):
+    """
+    Returns a list of (record_type, host, results) for size records, every
+    result being a tuple of (attribute, value) pairs.
+    """
+    rng = random.Random(seed)
+    total = sum(weight for record_type, weight in type_weights)
+    records = []
+    for record_type, weight in type_weights:
+        count = size * weight // total
+        if record_type == type_weights[-1][0]:
+            count = size - len(records)
+        for i in xrange(count):
+            results = 1
+            if record_type != 'cname':
+                results = rng.choice((1, 1, 1, 2, 3))
+            records.append((record_type, _host(rng, record_type, i), [
+                _result(rng, record_type, i, n) for n in xrange(results)]))
+    rng.shuffle(records)
+    return records
+
+def generate_config(size, seed=0):
+    """The dns configuration xml of a zone of size records"""
+    parts = [config_header]
+    for record_type, host, results in generate_records(size, seed):
+        parts.append('    <%s host="%s">\n' % (record_type, host))
+        for result in results:
+            parts.append('      <result %s/>\n' % " ".join(
+                '%s="%s"' % pair for pair in result))
+        parts.append('    </%s>\n' % record_type)
+    parts.append(config_footer)
+    return "".join(parts)
@@ -1,11 +1,32 @@
 import logging
+import os
+import threading
+import time
+import urllib
 import suds
 
+from suds.cache import ObjectCache
 from suds.client import Client
 from suds.plugin import MessagePlugin
 from suds.sax.text import Text
 
 from cotendohelper import CotendoDNS, CotendoCDN, UnescapedText
+from transport import PooledTransport
+from bulk import fetch_configs, production
+from envelope import TemplateInvoker
+from cache import ConfigCache
+from snapshot import SnapshotStore
+from metrics import timed, get_recorder
+from variables import VariableUpdater
+from zonefile import load_zone, write_zone
+from validate import validate_zone, ZoneError
+
+cws_wsdl = 'https://api.cotendo.net/cws?wsdl'
+cws_location = 'http://api.cotendo.net/cws?ver=1.0'
+
+# Service definition shipped with the package, needs no network access
+bundled_wsdl = 'file:' + urllib.pathname2url(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cws.wsdl'))
 
 class Cotendo(object):
     """
@@ -51,33 +72,152 @@ class Cotendo(object):
 
             <variable name="ny_weight" value="10"/>
 
+    Pass stream=True to parse the get_conf responses in a single pass
+    with lxml instead of going through BeautifulSoup, and lazy=True to
+    only build the DNS records which are accessed (see CotendoDNS).
+
+    A suds transport can be given with transport, PooledTransport keeps
+    persistent connections to the API between calls and threads. It also
+    negotiates compressed responses, and with stream=True the get_conf
+    replies it returns are parsed as they are received: the configuration
+    goes straight from the socket into the record parser.
+
+    The suds client is only created on the first API call. Pass
+    wsdl=bundled_wsdl to use the service definition shipped with the
+    package instead of downloading it, and cache (a directory or a suds
+    cache) to keep the parsed definition on disk between runs.
+
+    With precompile=True the request envelopes are rendered from templates
+    compiled once per operation instead of being built and rewritten by
+    suds on every call, the bytes sent are the same. PooledTransport then
+    streams large configurations without copying them into the envelope.
+
+    Timings and sizes of the calls are reported to the recorder installed
+    with cotendo.metrics.set_recorder, see cotendo.metrics.
+
+    A ConfigCache given as config_cache keeps the parsed configurations
+    returned by cdn_get_conf/dns_get_conf, every call returns a new object.
+    The set_conf and publish_conf calls invalidate the entries of the
+    configuration they change.
     """
-    def __init__(self, username, password, debug=False):
+    def __init__(self, username, password, debug=False, stream=False,
+                 transport=None, wsdl=cws_wsdl, location=cws_location,
+                 cache=None, precompile=False, config_cache=None,
+                 lazy=False):
         logging.basicConfig(level=logging.INFO)
-        self.client = Client('https://api.cotendo.net/cws?wsdl',
-                             location = 'http://api.cotendo.net/cws?ver=1.0',
-                             username=username, password=password,
-                             plugins=[CotendoPlugin()])
+        self.stream = stream
+        self.lazy = lazy
+        self.config_cache = config_cache
+        self._templates = TemplateInvoker(CotendoPlugin)
+        self._invoker = None
+        if precompile:
+            self._invoker = self._templates
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._client_args = (username, password, transport, wsdl,
+                             location, cache)
         if debug:
             logging.getLogger('suds.client').setLevel(logging.DEBUG)
             logging.getLogger('suds.transport').setLevel(logging.DEBUG)
             logging.getLogger('suds.xsd.schema').setLevel(logging.DEBUG)
             logging.getLogger('suds.wsdl').setLevel(logging.DEBUG)
 
+    @property
+    def client(self):
+        """The suds client, created on first use"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._create_client(*self._client_args)
+        return self._client
+
+    def _create_client(self, username, password, transport, wsdl, location,
+                       cache):
+        options = {}
+        if transport is not None:
+            options['transport'] = transport
+        if isinstance(cache, basestring):
+            cache = ObjectCache(location=cache, days=7)
+        if cache is not None:
+            options['cache'] = cache
+        client = Client(wsdl, location=location,
+                        username=username, password=password,
+                        plugins=[CotendoPlugin()], **options)
+        if transport is not None:
+            # The credentials are transport options, set them once the
+            # transport is linked to the client
+            client.set_options(username=username, password=password)
+        return client
+
+    def _cdn_config(self, response):
+        return CotendoCDN(response, self.stream)
+
+    def _dns_config(self, response):
+        return CotendoDNS(response, self.stream, self.lazy)
+
+    def _invoke(self, operation, *args):
+        if self._invoker is not None:
+            return self._invoker.invoke(self.client, operation, args)
+        return getattr(self.client.service, operation)(*args)
+
+    def _get_conf(self, operation, *args):
+        # Stream the reply into the parser when the transport can
+        if self.stream and self._templates.streamable(self.client, args):
+            return self._templates.invoke_streamed(
+                self.client, operation, args)
+        return self._invoke(operation, *args)
+
+    def _read_conf(self, kind, operation, parse, name, environment):
+        """A get_conf call, read through config_cache when there is one"""
+        config = self._cached_conf(kind, name, environment)
+        if config is not None:
+            return config
+        response = self._get_conf(operation, name, environment)
+        return self._parse_conf(kind, parse, name, environment, response)
+
+    def _cached_conf(self, kind, name, environment):
+        """The cached configuration, if it can be used without a call"""
+        cache = self.config_cache
+        if cache is not None and not cache.validate:
+            return cache.get(kind, name, environment)
+
+    def _parse_conf(self, kind, parse, name, environment, response):
+        """
+        The configuration of a get_conf response, the cached one when the
+        cache validates it with the response token
+        """
+        cache = self.config_cache
+        if cache is not None and cache.validate:
+            config = cache.get(kind, name, environment, response[0])
+            if config is not None:
+                return config
+        config = parse(response)
+        if cache is not None:
+            cache.put(kind, name, environment, config)
+        return config
+
+    def _invalidate(self, kind, name, environment=None):
+        """Drop the cached configurations a set or publish changes"""
+        if self.config_cache is not None:
+            self.config_cache.invalidate(kind, name, environment)
+
+    @timed('cotendo.cdn_get_conf')
     def cdn_get_conf(self, cname, environment):
         """
         Returns the existing origin configuration and token from the CDN
         """
-        response = self.client.service.cdn_get_conf(cname, environment)
-        cdn_config = CotendoCDN(response)
-        return cdn_config
+        return self._read_conf('cdn', 'cdn_get_conf', self._cdn_config,
+                               cname, environment)
 
+    @timed('cotendo.cdn_publish_conf')
     def cdn_publish_conf(self, cname):
         """
         Publishes a requested origin staging configuration
         """
-        return self.client.service.cdn_publish_conf(cname)
+        self._invalidate('cdn', cname)
+        return self._invoke('cdn_publish_conf', cname)
 
+    @timed('cotendo.cdn_set_conf')
     def cdn_set_conf(self, cname, originConf, environment, token):
         """
         The cdn_set_conf method enables the user to update an existing
@@ -89,23 +229,27 @@ class Cotendo(object):
         The set action is valid only if the token returned is equal to
         the token representing the current version of the configuration file.
         """
-        return self.client.service.cdn_set_conf(
-            cname, originConf, environment, token)
+        self._invalidate('cdn', cname, environment)
+        return self._invoke(
+            'cdn_set_conf', cname, originConf, environment, token)
 
+    @timed('cotendo.dns_get_conf')
     def dns_get_conf(self, domainName, environment):
         """
         Returns the existing domain configuration and token from the ADNS
         """
-        response = self.client.service.dns_get_conf(domainName, environment)
-        dns_config = CotendoDNS(response)
-        return dns_config
+        return self._read_conf('dns', 'dns_get_conf', self._dns_config,
+                               domainName, environment)
 
+    @timed('cotendo.dns_publish_conf')
     def dns_publish_conf(self, domainName):
         """
         Publishes a requested origin staging configuration
         """
-        return self.client.service.dns_publish_conf(domainName)
+        self._invalidate('dns', domainName)
+        return self._invoke('dns_publish_conf', domainName)
 
+    @timed('cotendo.dns_set_conf')
     def dns_set_conf(self, domainName, domainConf, environment, token):
         """
         The cdn_set_conf method enables the user to update an existing
@@ -117,15 +261,18 @@ class Cotendo(object):
         The set action is valid only if the token returned is equal to
         the token representing the current version of the configuration file.
         """
-        return self.client.service.dns_set_conf(
-            domainName, domainConf, environment, token)
+        self._invalidate('dns', domainName, environment)
+        return self._invoke(
+            'dns_set_conf', domainName, domainConf, environment, token)
 
+    @timed('cotendo.dns_set_variables')
     def dns_set_variables(self, variables):
         """
         This API sets one or more variable values in the DNS configuration.
         """
-        return self.client.service.dns_set_variables(variables)
+        return self._invoke('dns_set_variables', variables)
 
+    @timed('cotendo.doFlush')
     def doFlush(self, cname, flushExpression, flushType):
         """
         doFlush method enables specific content to be "flushed" from the
@@ -134,11 +281,31 @@ class Cotendo(object):
         * Note: The flush API is limited to 1,000 flush invocations per hour
         (each flush invocation may include several objects). *
         """
-        return self.client.service.doFlush(
-            cname, flushExpression, flushType)
+        return self._invoke(
+            'doFlush', cname, flushExpression, flushType)
 
 class CotendoPlugin(MessagePlugin):
     def marshalled(self, context):
+        recorder = get_recorder()
+        if not recorder.enabled:
+            return self._marshalled(context)
+        start = time.time()
+        try:
+            self._marshalled(context)
+        finally:
+            recorder.timing('soap.marshalled', time.time() - start)
+
+    def sending(self, context):
+        recorder = get_recorder()
+        if recorder.enabled:
+            recorder.size('soap.request_bytes', len(context.envelope))
+
+    def received(self, context):
+        recorder = get_recorder()
+        if recorder.enabled:
+            recorder.size('soap.response_bytes', len(context.reply))
+
+    def _marshalled(self, context):
         # Adjust prefixes
         context.envelope.refitPrefixes()
         context.envelope.expns = None
@@ -179,21 +346,72 @@ class CotendoPlugin(MessagePlugin):
             param.text = UnescapedText('<![CDATA[' + Text(param.text) + ']]>')
 
 class CotendoHelper(Cotendo):
-    def __init__(self, username, password, debug=False):
+    def __init__(self, username, password, debug=False, **kwargs):
         super(CotendoHelper, self).__init__(
-            username, password, debug=False)
+            username, password, debug=False, **kwargs)
         # DNS Helper
         self.dns = None
         # CDN Helper
         self.cdn = None
+        # (domain, environment, fingerprint) of the last grabbed/pushed zone
+        self._dns_baseline = None
 
     def GrabDNS(self, domain, environment):
         self.dns = self.dns_get_conf(domain, environment)
+        self._dns_baseline = (
+            domain, str(environment), self.dns.fingerprint())
+
+    def GrabCDN(self, cname, environment):
+        self.cdn = self.cdn_get_conf(cname, environment)
+
+    def GrabManyDNS(self, domains, environment=production, workers=8):
+        """
+        Fetch many domain configurations concurrently
+
+        domains are names or (name, environment) pairs, the others are
+        fetched from environment. Returns a BulkResult mapping every
+        (name, environment) to its CotendoDNS or its error.
+        """
+        return fetch_configs(self, 'dns', domains, environment, workers)
+
+    def GrabManyCDN(self, cnames, environment=production, workers=8):
+        """
+        Fetch many origin configurations concurrently
+
+        cnames are names or (name, environment) pairs, the others are
+        fetched from environment. Returns a BulkResult mapping every
+        (name, environment) to its CotendoCDN or its error.
+        """
+        return fetch_configs(self, 'cdn', cnames, environment, workers)
+
+    def UpdateDNS(self, domain, environment, force=False, validate=True):
+        """
+        Pushes DNS updates
+
+        Nothing is sent, and False is returned, when the zone has no
+        differences with the one last grabbed from or pushed to the same
+        domain and environment. Use force=True to always push.
 
-    def UpdateDNS(self, domain, environment):
-        """Pushes DNS updates"""
-        self.dns_set_conf(domain, self.dns.config,
-                          environment, self.dns.token)
+        The zone is checked with validate_zone first, a ZoneError listing
+        every problem is raised instead of sending an invalid zone.
+        """
+        fingerprint = self.dns.fingerprint()
+        baseline = (domain, str(environment), fingerprint)
+        if not force and self._dns_baseline == baseline:
+            return False
+        if validate:
+            problems = validate_zone(self.dns)
+            if problems:
+                raise ZoneError(problems)
+        result = self.dns_set_conf(domain, self.dns.config,
+                                   environment, self.dns.token)
+        self._dns_baseline = baseline
+        return result
+
+    def UpdateCDN(self, cname, environment):
+        """Pushes the origin configuration edited through self.cdn.origin"""
+        return self.cdn_set_conf(cname, self.cdn.config,
+                                 environment, self.cdn.token)
 
     def ImportDNS(self, config, token=None):
         """
@@ -204,9 +422,66 @@ class CotendoHelper(Cotendo):
         """
         if not token:
             raise Exception("You must have the dns token set first.")
-        self.dns = CotendoDNS([token, config])
+        self.dns = self._dns_config([token, config])
+        self._dns_baseline = None
+        return True
+
+    def SaveDNS(self, domain, environment, snapshots):
+        """Save the helper zone to a SnapshotStore"""
+        snapshots.save(domain, environment, self.dns)
+
+    def LoadDNS(self, domain, environment, snapshots, max_age=None,
+                verify=False):
+        """
+        Load a zone from a SnapshotStore, falls back to GrabDNS
+
+        The zone is grabbed (and its snapshot saved) when there is no
+        snapshot or when it is older than max_age seconds. With
+        verify=True, the configuration is fetched and only parsed if its
+        token differs from the one of the snapshot.
+
+        Returns True when the zone came from the snapshot.
+        """
+        dns = None
+        age = snapshots.age(domain, environment)
+        if age is not None and (max_age is None or age <= max_age):
+            dns = snapshots.load(domain, environment)
+        if dns is not None and verify:
+            response = self._get_conf('dns_get_conf', domain, environment)
+            if response[0] != dns.token:
+                dns = self._dns_config(response)
+                snapshots.save(domain, environment, dns)
+                self.dns = dns
+                self._dns_baseline = (
+                    domain, str(environment), dns.fingerprint())
+                return False
+        if dns is None:
+            self.GrabDNS(domain, environment)
+            snapshots.save(domain, environment, self.dns)
+            return False
+        self.dns = dns
+        self._dns_baseline = (domain, str(environment), dns.fingerprint())
         return True
 
     def ExportDNS(self):
         """Export a dns configuration file from the helper"""
         return self.dns.config
+
+    def ImportZoneFile(self, zonefile, origin, token=None):
+        """
+        Import a BIND master file (an open file or any iterable of lines)
+        into the helper
+
+        Note: This requires that you have the latest token.
+        To get the latest token, run the GrabDNS command first.
+        """
+        if not token:
+            raise Exception("You must have the dns token set first.")
+        self.dns = load_zone(zonefile, origin, token)
+        self._dns_baseline = None
+        return True
+
+    def ExportZoneFile(self, zonefile, origin):
+        """Write the helper zone to an open file as a UTF-8 master file"""
+        for line in write_zone(self.dns, origin):
+            zonefile.write((line + "\n").encode('utf-8'))
@@ -0,0 +1,382 @@
+import asyncore
+import base64
+import socket
+import ssl
+import sys
+import time
+
+from collections import deque
+from StringIO import StringIO
+from urlparse import urlparse
+
+from suds.client import SoapClient
+from suds.plugin import PluginContainer
+from suds.transport import TransportError
+
+from cotendo import Cotendo
+from envelope import marshal, process_reply
+from metrics import get_recorder
+
+class Call(object):
+    """Pending result of an asynchronous API call"""
+    def __init__(self, operation, args):
+        self.operation = operation
+        self.args = args
+        self.done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def add_callback(self, callback):
+        """Call callback(call) once the call is done"""
+        if self.done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def result(self):
+        """Return the result of the call, or raise its error"""
+        if not self.done:
+            raise RuntimeError("%s has not completed" % self.operation)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self):
+        """Return the error raised by the call, None if it succeeded"""
+        if self._exc_info is not None:
+            return self._exc_info[1]
+
+    def _finish(self, result=None, exc_info=None):
+        self.done = True
+        self._result = result
+        self._exc_info = exc_info
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+class HTTPRequest(asyncore.dispatcher):
+    """
+    Non-blocking HTTP/1.0 POST, over TLS when an ssl_context is given
+
+    callback(status, headers, body, exc_info) is called once the whole
+    response has been read or the request failed. A response closed
+    before the Content-Length it announced fails with a TransportError.
+    """
+    chunk_size = 65536
+
+    def __init__(self, host, port, data, callback, map, timeout,
+                 ssl_context=None):
+        asyncore.dispatcher.__init__(self, map=map)
+        self.deadline = time.time() + timeout
+        self._host = host
+        self._data = data
+        self._offset = 0
+        self._received = []
+        self._length = None
+        self._header_size = None
+        self._callback = callback
+        self._ssl_context = ssl_context
+        self._handshaking = False
+        self._want_write = False
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect((host, port))
+
+    def writable(self):
+        if self._handshaking:
+            return self._want_write
+        return not self.connected or self._offset < len(self._data)
+
+    def handle_connect(self):
+        if self._ssl_context is not None:
+            # The wrapped socket keeps the file descriptor of the map
+            self.socket = self._ssl_context.wrap_socket(
+                self.socket, server_hostname=self._host,
+                do_handshake_on_connect=False)
+            self._handshaking = True
+            self._handshake()
+
+    def _handshake(self):
+        try:
+            self.socket.do_handshake()
+        except ssl.SSLWantReadError:
+            self._want_write = False
+        except ssl.SSLWantWriteError:
+            self._want_write = True
+        else:
+            self._handshaking = False
+
+    def handle_write(self):
+        if self._handshaking:
+            return self._handshake()
+        try:
+            self._offset += self.send(
+                buffer(self._data, self._offset, self.chunk_size))
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            pass
+
+    def handle_read(self):
+        if self._handshaking:
+            return self._handshake()
+        try:
+            data = self.recv(self.chunk_size)
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return
+        while data:
+            self._received.append(data)
+            if self._complete():
+                return self._done()
+            # Data already decrypted by TLS is not seen by select
+            if self._ssl_context is None or not self.socket.pending():
+                return
+            data = self.recv(self.chunk_size)
+
+    def handle_close(self):
+        self._done()
+
+    def handle_error(self):
+        self._done(sys.exc_info())
+
+    def expire(self):
+        try:
+            raise socket.timeout("timed out")
+        except socket.timeout:
+            self._done(sys.exc_info())
+
+    def _complete(self):
+        if self._header_size is None:
+            data = ''.join(self._received)
+            self._received = [data]
+            end = data.find('\r\n\r\n')
+            if end < 0:
+                return False
+            self._header_size = end + 4
+            for line in data[:end].split('\r\n')[1:]:
+                name, sep, value = line.partition(':')
+                if name.strip().lower() == 'content-length':
+                    self._length = int(value)
+        if self._length is None:
+            return False
+        received = sum(len(data) for data in self._received)
+        return received - self._header_size >= self._length
+
+    def _done(self, exc_info=None):
+        if self._callback is None:
+            return
+        callback, self._callback = self._callback, None
+        self.close()
+        if exc_info is not None:
+            return callback(None, None, None, exc_info)
+        data = ''.join(self._received)
+        head, sep, body = data.partition('\r\n\r\n')
+        lines = head.split('\r\n')
+        try:
+            status = int(lines[0].split()[1])
+        except (IndexError, ValueError):
+            try:
+                raise TransportError("Invalid HTTP response", None)
+            except TransportError:
+                return callback(None, None, None, sys.exc_info())
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if self._length is not None:
+            if len(body) < self._length:
+                try:
+                    raise TransportError(
+                        "Truncated HTTP response: %d of %d bytes"
+                        % (len(body), self._length), status)
+                except TransportError:
+                    return callback(None, None, None, sys.exc_info())
+            body = body[:self._length]
+        callback(status, headers, body, None)
+
+default_ports = {'http': 80, 'https': 443}
+
+class AsyncCotendo(Cotendo):
+    """
+    Non-blocking Cotendo client driven by an asyncore event loop.
+
+    Every API method returns a Call right away, run() drives the loop until
+    every call is done. The envelopes are built by suds and CotendoPlugin
+    exactly like the blocking client, and the get_conf calls return the
+    same CotendoDNS/CotendoCDN objects:
+
+        c = AsyncCotendo(username, password)
+        calls = dict((domain, c.dns_get_conf(domain, 1))
+                     for domain in domains)
+        c.run()
+        configs = dict((domain, call.result())
+                       for domain, call in calls.iteritems())
+
+    * max_connections
+        Number of requests in flight at the same time, the others wait
+
+    * timeout
+        Seconds a single request may take
+
+    * ssl_context
+        ssl.SSLContext of the https connections, ssl's default context
+        (which verifies the certificates) if it is None
+
+    The first call creates the suds client (and loads the WSDL) before
+    anything is sent. Like the blocking client, the get_conf calls read
+    through config_cache, the set_conf and publish_conf calls invalidate
+    it, and the wall time of every call is reported as cotendo.<method>.
+    """
+    def __init__(self, username, password, debug=False,
+                 max_connections=20, timeout=90, ssl_context=None,
+                 **kwargs):
+        super(AsyncCotendo, self).__init__(
+            username, password, debug, **kwargs)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self._credentials = (username, password)
+        self._map = {}
+        self._queue = deque()
+
+    def cdn_get_conf(self, cname, environment):
+        return self._read_conf('cdn', 'cdn_get_conf', self._cdn_config,
+                               cname, environment)
+
+    def cdn_publish_conf(self, cname):
+        self._invalidate('cdn', cname)
+        return self._call('cdn_publish_conf', (cname,))
+
+    def cdn_set_conf(self, cname, originConf, environment, token):
+        self._invalidate('cdn', cname, environment)
+        return self._call(
+            'cdn_set_conf', (cname, originConf, environment, token))
+
+    def dns_get_conf(self, domainName, environment):
+        return self._read_conf('dns', 'dns_get_conf', self._dns_config,
+                               domainName, environment)
+
+    def dns_publish_conf(self, domainName):
+        self._invalidate('dns', domainName)
+        return self._call('dns_publish_conf', (domainName,))
+
+    def dns_set_conf(self, domainName, domainConf, environment, token):
+        self._invalidate('dns', domainName, environment)
+        return self._call(
+            'dns_set_conf', (domainName, domainConf, environment, token))
+
+    def dns_set_variables(self, variables):
+        return self._call('dns_set_variables', (variables,))
+
+    def doFlush(self, cname, flushExpression, flushType):
+        return self._call(
+            'doFlush', (cname, flushExpression, flushType))
+
+    @property
+    def pending(self):
+        """Number of calls queued or in flight"""
+        return len(self._queue) + len(self._map)
+
+    def run(self):
+        """Drive the event loop until every call is done"""
+        while self.pending:
+            self.poll(1.0)
+
+    def poll(self, timeout=0.0):
+        """Run a single iteration of the event loop"""
+        while self._queue and len(self._map) < self.max_connections:
+            self._start(*self._queue.popleft())
+        if self._map:
+            asyncore.loop(timeout, True, self._map, 1)
+        now = time.time()
+        for request in self._map.values():
+            if request.deadline < now:
+                request.expire()
+
+    def _read_conf(self, kind, operation, parse, name, environment):
+        """A get_conf Call, read through config_cache when there is one"""
+        config = self._cached_conf(kind, name, environment)
+        if config is not None:
+            call = self._timed(Call(operation, (name, environment)))
+            call._finish(config)
+            return call
+        return self._call(operation, (name, environment),
+                          lambda response: self._parse_conf(
+                              kind, parse, name, environment, response))
+
+    def _timed(self, call):
+        """Report the wall time of a call once it is done"""
+        recorder = get_recorder()
+        if recorder.enabled:
+            start = time.time()
+            call.add_callback(lambda call: recorder.timing(
+                'cotendo.%s' % call.operation, time.time() - start))
+        return call
+
+    def _call(self, operation, args, wrapper=None):
+        call = self._timed(Call(operation, args))
+        try:
+            soap = SoapClient(
+                self.client, getattr(self.client.service, operation).method)
+            request = self._marshal(soap, args)
+        except Exception:
+            call._finish(exc_info=sys.exc_info())
+        else:
+            self._queue.append((call, soap, request, wrapper))
+        return call
+
+    def _marshal(self, soap, args):
+        """Build the raw http request, like suds' SoapClient.send does"""
+        soapenv = marshal(soap, args)
+        PluginContainer(soap.options.plugins).message.sending(
+            envelope=soapenv)
+
+        location = urlparse(soap.location())
+        if location.scheme not in default_ports:
+            raise NotImplementedError(
+                "Unsupported location: %s" % soap.location())
+        path = location.path or '/'
+        if location.query:
+            path = '%s?%s' % (path, location.query)
+        headers = soap.headers()
+        headers['Host'] = location.netloc
+        headers['Content-Length'] = str(len(soapenv))
+        if not (None in self._credentials):
+            headers['Authorization'] = 'Basic %s' % base64.b64encode(
+                ':'.join(self._credentials))
+        head = ['POST %s HTTP/1.0' % path]
+        head.extend('%s: %s' % item for item in headers.iteritems())
+        head = '\r\n'.join(head).encode('utf-8')
+        data = head + '\r\n\r\n' + soapenv
+        port = location.port or default_ports[location.scheme]
+        return location.scheme, location.hostname, port, data
+
+    def _start(self, call, soap, request, wrapper):
+        scheme, host, port, data = request
+        ssl_context = None
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            ssl_context = self.ssl_context
+        def received(status, headers, body, exc_info):
+            if exc_info is None:
+                try:
+                    result = self._unmarshal(soap, status, body)
+                    if wrapper is not None:
+                        result = wrapper(result)
+                except Exception:
+                    exc_info = sys.exc_info()
+            if exc_info is not None:
+                call._finish(exc_info=exc_info)
+            else:
+                call._finish(result)
+        HTTPRequest(host, port, data, received, self._map, self.timeout,
+                    ssl_context)
+
+    def _unmarshal(self, soap, status, body):
+        """Process a reply, like suds' SoapClient.send does"""
+        binding = soap.method.binding.input
+        if status in (202, 204):
+            return None
+        if status >= 300:
+            return soap.failed(binding, TransportError(
+                "HTTP %s" % status, status, StringIO(body)))
+        return process_reply(soap, body)
@@ -0,0 +1,91 @@
+import copy
+import sys
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+# kind: Cotendo get_conf method
+operations = {
+    'dns': 'dns_get_conf',
+    'cdn': 'cdn_get_conf',
+    }
+
+production = 1
+
+class BulkResult(object):
+    """
+    Outcome of a bulk fetch
+
+    * configs
+        Dict of (name, environment) to CotendoDNS/CotendoCDN for every
+        successful fetch
+
+    * errors
+        Dict of (name, environment) to the exception raised while fetching
+        or parsing
+    """
+    def __init__(self):
+        self.configs = {}
+        self.errors = {}
+
+    def __getitem__(self, key):
+        return self.configs[key]
+
+    def __contains__(self, key):
+        return key in self.configs
+
+    def __len__(self):
+        return len(self.configs)
+
+    @property
+    def ok(self):
+        return not self.errors
+
+def fetch_configs(cotendo, kind, items, environment=production,
+                  workers=8):
+    """
+    Fetch many configurations on a bounded pool of threads.
+
+    items are names, or (name, environment) pairs overriding environment.
+    Each worker thread calls the get_conf method of its own copy of
+    cotendo on a clone of the suds client, so the config_cache, streaming,
+    precompiled envelopes and metrics apply, and the parsing of a
+    configuration overlaps with the other workers waiting on the network.
+    Errors are captured per (name, environment), they don't stop the
+    others.
+    """
+    operation = operations[kind]
+    local = threading.local()
+
+    def fetch(item):
+        if isinstance(item, (tuple, list)):
+            name, env = item
+        else:
+            name, env = item, environment
+        try:
+            worker = getattr(local, 'cotendo', None)
+            if worker is None:
+                worker = copy.copy(cotendo)
+                worker._client = cotendo.client.clone()
+                local.cotendo = worker
+            return (name, env), getattr(worker, operation)(name, env), None
+        except Exception:
+            return (name, env), None, sys.exc_info()[1]
+
+    result = BulkResult()
+    items = list(items)
+    if not items:
+        return result
+    # Create the shared client (and load the WSDL) once, before cloning
+    cotendo.client
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        for key, config, error in pool.imap_unordered(fetch, items):
+            if error is None:
+                result.configs[key] = config
+            else:
+                result.errors[key] = error
+    finally:
+        pool.close()
+        pool.join()
+    return result
@@ -0,0 +1,124 @@
+import copy
+import threading
+import time
+
+from collections import OrderedDict
+
+from cotendohelper import CotendoDNS, CotendoCDN, paused_gc
+
+def freeze(kind, config):
+    """The form a configuration is cached in, shared with no caller"""
+    if kind == 'dns':
+        return config.token, config.record_values()
+    return config.token, copy.deepcopy(config._data)
+
+def thaw(kind, frozen):
+    """A new configuration object built from its cached form"""
+    token, data = frozen
+    if kind == 'dns':
+        with paused_gc():
+            return CotendoDNS.from_record_values(token, data)
+    return CotendoCDN.from_tree(token, data)
+
+class ConfigCache(object):
+    """
+    LRU cache of parsed configurations with a time to live.
+
+    Entries are keyed by (kind, name, environment), kind being 'dns' or
+    'cdn'. The records of a zone are cached as plain tuples, and the tree
+    of an origin configuration as a private copy: every get builds a new
+    CotendoDNS/CotendoCDN, so edits made by a caller never reach the cache
+    or the other callers.
+
+    * ttl
+        Seconds an entry stays valid, None keeps it until evicted
+
+    * max_size
+        Number of entries kept, the least recently used are evicted first
+
+    * validate
+        Check the cached token against the live one: the get_conf call is
+        still made, but the configuration is only parsed when its token
+        changed. There is no API call returning only the token, this saves
+        the parsing and not the transfer.
+    """
+    def __init__(self, ttl=300, max_size=128, validate=False,
+                 clock=time.time):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.validate = validate
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(kind, name, environment):
+        return (kind, name, str(environment))
+
+    def get(self, kind, name, environment, token=None):
+        """
+        Return a new configuration built from the cached one, or None.
+        When token is given, an entry with another token is dropped.
+        """
+        key = self.key(kind, name, environment)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                expires, frozen = entry
+                if token is not None and token != frozen[0]:
+                    self.stale += 1
+                    entry = None
+                elif expires is None or expires > self._clock():
+                    self._entries[key] = entry
+                    self.hits += 1
+                else:
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+        return thaw(kind, frozen)
+
+    def put(self, kind, name, environment, config):
+        key = self.key(kind, name, environment)
+        frozen = freeze(kind, config)
+        expires = None
+        if self.ttl is not None:
+            expires = self._clock() + self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, frozen)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, kind, name, environment=None):
+        """Drop the entry of an environment, or of every environment"""
+        with self._lock:
+            if environment is not None:
+                self._entries.pop(self.key(kind, name, environment), None)
+                return
+            for key in self._entries.keys():
+                if key[:2] == (kind, name):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        """Dict of hits, misses, evictions, stale, size and hit_rate"""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'stale': self.stale,
+                'size': len(self._entries),
+                'hit_rate': lookups and float(self.hits) / lookups or 0.0}
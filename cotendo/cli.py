@@ -0,0 +1,142 @@
+"""
+The cotendo command line script.
+
+    cotendo record-set mysite.com 1 a www 10.1.2.3 10.1.2.4 --ttl 300
+    cotendo dns-publish mysite.com
+
+Commands go to the local daemon (cotendo daemon) when one is running, and
+run in the script itself otherwise. The credentials are taken from
+--username/--password or $COTENDO_USERNAME/$COTENDO_PASSWORD.
+"""
+import errno
+import optparse
+import os
+import socket
+import sys
+
+from cotendo import CotendoHelper, bundled_wsdl, cws_location
+from daemon import CommandError, CommandServer, Session, call, commands, \
+    socket_path
+from transport import PooledTransport
+
+def create_helper(options):
+    """The CotendoHelper used by the script and the daemon"""
+    username = options.username or os.environ.get('COTENDO_USERNAME')
+    password = options.password or os.environ.get('COTENDO_PASSWORD')
+    if not username or not password:
+        raise CommandError("Set $COTENDO_USERNAME and $COTENDO_PASSWORD, "
+                           "or pass --username and --password")
+    return CotendoHelper(username, password, stream=True, lazy=True,
+                         precompile=True, transport=PooledTransport(),
+                         wsdl=options.wsdl, location=options.location)
+
+def _parser():
+    lines = ["%prog [options] COMMAND [ARGS]", "", "Commands:"]
+    for command in commands.itervalues():
+        lines.append(("  %s %s" % (command.name, command.usage)).rstrip())
+        lines.append("      %s" % command.help)
+    lines.append("  daemon")
+    lines.append("      Run the daemon, in the foreground")
+    lines.append("  stop")
+    lines.append("      Stop the daemon")
+    parser = optparse.OptionParser(usage="\n".join(lines))
+    parser.add_option("-u", "--username", help="API user name")
+    parser.add_option("-p", "--password", help="API password")
+    parser.add_option("--socket", help="daemon socket [~/.cotendo.sock]")
+    parser.add_option("--no-daemon", action="store_true",
+                      help="run the command in the script itself")
+    parser.add_option("--wsdl", default=bundled_wsdl,
+                      help="service definition [the bundled one]")
+    parser.add_option("--location", default=cws_location,
+                      help="API endpoint [%default]")
+    parser.add_option("--max-age", type="int", default=300,
+                      help="seconds the daemon keeps a zone [%default]")
+    parser.add_option("--fresh", action="store_true",
+                      help="grab the zone again, even if the daemon has it")
+    parser.add_option("--ttl", type="int", help="TTL of the results set")
+    parser.add_option("--no-push", action="store_true",
+                      help="keep record edits in the daemon until dns-push")
+    parser.add_option("--force", action="store_true",
+                      help="push even if the zone is unchanged")
+    parser.add_option("--type", dest="flush_type", default="hard",
+                      choices=("hard", "soft"), help="flush type [%default]")
+    return parser
+
+def _read(path):
+    if path == '-':
+        return sys.stdin.read()
+    f = open(path)
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def _output(text):
+    if text:
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        sys.stdout.write(text + "\n")
+
+def run(options, name, args):
+    """Run a command, in the daemon if one is listening"""
+    path = socket_path(options.socket)
+    if name == 'daemon':
+        server = CommandServer(
+            Session(create_helper(options), options.max_age), path)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        return None
+    if name == 'stop':
+        return call(path, 'stop')
+
+    command = commands.get(name)
+    if command is None:
+        raise CommandError("Unknown command %s" % name)
+    command.check(args)
+    # Files are read here, the daemon may not see the same ones
+    args = list(args)
+    for i, param in enumerate(command.params):
+        if param == 'FILE':
+            args[i] = _read(args[i])
+    command_options = {
+        'fresh': options.fresh,
+        'ttl': options.ttl,
+        'push': not options.no_push,
+        'force': options.force,
+        'flush_type': options.flush_type,
+        }
+    if not options.no_daemon:
+        try:
+            return call(path, name, args, command_options)
+        except socket.error, e:
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                raise
+    if options.no_push:
+        raise CommandError("--no-push keeps edits in the daemon, which "
+                           "isn't running")
+    session = Session(create_helper(options), options.max_age)
+    return session.execute(name, args, command_options)
+
+def main(argv=None):
+    parser = _parser()
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.print_help()
+        return 2
+    try:
+        _output(run(options, args[0], args[1:]))
+    except KeyboardInterrupt:
+        return 130
+    except (CommandError, socket.error, IOError), e:
+        print >>sys.stderr, "cotendo: %s" % e
+        return 1
+    except Exception, e:
+        # Errors of the API or of the zone, as the daemon reports them
+        print >>sys.stderr, "cotendo: %s: %s" % (e.__class__.__name__, e)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,18 @@
+import copy
+import gc
+import re
+import threading
+import time
+
+from contextlib import contextmanager
 from lxml import etree
 from BeautifulSoup import BeautifulSoup
 from records import *
+from store import RecordStore, record_order
+from diff import diff_zones
+from metrics import get_recorder
+from index import ResultIndex, indexed_fields
+from origin import OriginConfig
 
 dns_tag_lookup = {
     'soa': SOARecord,
@@ -17,108 +29,448 @@ self_closing_tags = [
     'result'
     ]
 
+class ConfigTarget(object):
+    """
+    lxml parser target building a configuration tree in a single pass.
+
+    If given, record_handler is called with every element directly below
+    <resource_records> as soon as it is complete. Elements a truncated
+    configuration leaves open are closed by close().
+    """
+    def __init__(self, record_handler=None):
+        self._builder = etree.TreeBuilder()
+        self._record_handler = record_handler
+        # Tags of the open elements
+        self._stack = []
+
+    def start(self, tag, attrib):
+        self._builder.start(tag, attrib)
+        self._stack.append(tag)
+
+    def end(self, tag):
+        element = self._builder.end(self._stack.pop())
+        if len(self._stack) == 2 and self._record_handler is not None:
+            self._record_handler(element)
+
+    def data(self, data):
+        if self._stack:
+            self._builder.data(data)
+
+    def comment(self, text):
+        if self._stack:
+            self._builder.comment(text)
+
+    def close(self):
+        while self._stack:
+            self.end(self._stack[-1])
+        return self._builder.close()
+
+self_closing_re = re.compile(r'<(%s)\b([^>]*?)/?>|</(?:%s)\s*>' % (
+    '|'.join(self_closing_tags), '|'.join(self_closing_tags)))
+
+def _close_tag(match):
+    if match.group(1) is None:
+        return ''
+    return '<%s%s/>' % (match.group(1), match.group(2).rstrip())
+
+def _closed_tags(chunks):
+    """
+    The chunks with the tags listed in self_closing_tags closed as soon as
+    they are opened, the same way BeautifulSoup treats them, so an unclosed
+    <result> never swallows the elements that follow it. A tag cut between
+    two chunks is held back until it is complete.
+    """
+    tail = ''
+    for chunk in chunks:
+        chunk = tail + chunk
+        cut = chunk.rfind('<')
+        if cut != -1 and chunk.find('>', cut) == -1:
+            chunk, tail = chunk[:cut], chunk[cut:]
+        else:
+            tail = chunk[:0]
+        if chunk:
+            yield self_closing_re.sub(_close_tag, chunk)
+    if tail:
+        yield tail
+
+_gc_lock = threading.Lock()
+# Loads pausing the collector, and whether it was enabled before the first
+_gc_pauses = 0
+_gc_was_enabled = False
+
+@contextmanager
+def paused_gc():
+    """
+    Pause the garbage collector while a zone is loaded, nothing created
+    then is garbage and collecting only costs time. Loads running at the
+    same time, in any thread, share the pause: the collector is enabled
+    again when the last one ends.
+    """
+    global _gc_pauses, _gc_was_enabled
+    with _gc_lock:
+        if not _gc_pauses:
+            _gc_was_enabled = gc.isenabled()
+            gc.disable()
+        _gc_pauses += 1
+    try:
+        yield
+    finally:
+        with _gc_lock:
+            _gc_pauses -= 1
+            if not _gc_pauses and _gc_was_enabled:
+                gc.enable()
+
+def parse_config(config, record_handler=None):
+    """
+    Parse a configuration string, or an iterable of string chunks, with
+    lxml's recovering XML parser in a single pass. Byte strings are
+    decoded as UTF-8.
+    """
+    if isinstance(config, basestring):
+        config = (config,)
+    parser = None
+    for chunk in _closed_tags(config):
+        if parser is None:
+            encoding = isinstance(chunk, str) and 'utf-8' or None
+            parser = etree.XMLParser(
+                target=ConfigTarget(record_handler), encoding=encoding,
+                recover=True)
+        parser.feed(chunk)
+    if parser is None:
+        parser = etree.XMLParser(target=ConfigTarget(record_handler),
+                                 recover=True)
+    return parser.close()
+
+# The SOA and NS records never change, serialize them only once
+config_header = "<xml>\n  <resource_records>\n%s%s" % (
+    SOARecord()._serialize(), NSRecord()._serialize())
+config_footer = "  </resource_records>\n</xml>\n"
+
 class CotendoObject(object):
-    def __init__(self, response):
+    def __init__(self, response, stream=False):
         self.token = response[0]
-        self._add_config(response[1])
+        self._add_config(response[1], stream)
+
+    def _add_config(self, config, stream=False):
+        recorder = get_recorder()
+        if not recorder.enabled:
+            return self._parse_config(config, stream)
+        start = time.time()
+        try:
+            self._parse_config(config, stream)
+        finally:
+            recorder.timing('config.parse', time.time() - start)
 
-    def _add_config(self, config):
-        soup = BeautifulSoup(
-            config, selfClosingTags=self_closing_tags)
-        self._data = etree.XML(soup.prettify())
+    def _parse_config(self, config, stream=False):
+        if stream:
+            self._data = parse_config(config, self._parsed_element)
+        else:
+            soup = BeautifulSoup(
+                config, selfClosingTags=self_closing_tags)
+            self._data = etree.XML(soup.prettify())
+
+    def _parsed_element(self, element):
+        """Called by the streaming parser for every complete record"""
+        pass
 
 class CotendoDNS(CotendoObject):
-    def __init__(self, response):
-        super(CotendoDNS, self).__init__(response)
-        self._entries = self._get_entries()
-        self.sort()
+    """
+    DNS zone configuration
+
+    With lazy=True the records are kept as their parsed elements, indexed
+    by (record_type, host), and only built when they are accessed through
+    get_record or _entries. Records never accessed are serialized from
+    their elements.
+    """
+    _lazy = False
+
+    def __init__(self, response, stream=False, lazy=False):
+        self._lazy = lazy
+        self._parsed = []
+        with paused_gc():
+            super(CotendoDNS, self).__init__(response, stream)
+            if stream:
+                records = self._parsed
+            else:
+                records = self._get_entries()
+            del self._parsed
+            self._load_records(records)
+
+    @classmethod
+    def from_records(cls, token, records):
+        """Create a zone from record objects, without any xml to parse"""
+        dns = cls.__new__(cls)
+        dns.token = token
+        dns._data = None
+        dns._load_records(records)
+        return dns
+
+    @classmethod
+    def from_record_values(cls, token, values):
+        """Create a zone from the tuples returned by record_values"""
+        return cls.from_records(token, [
+            dns_tag_lookup[record_type].from_values(record_type, host, results)
+            for record_type, host, results in values])
+
+    def record_values(self):
+        """
+        The records as nested tuples of plain values,
+        ((record_type, host, (result values, ...)), ...), sharing nothing
+        with the zone
+        """
+        values = []
+        for record in self._store:
+            if isinstance(record, LazyRecord):
+                results = record._result_values()
+            else:
+                results = [result._values() for result in record.results]
+            values.append((record._record_type, record.host, tuple(results)))
+        return tuple(values)
+
+    def _load_records(self, records):
+        self._config = None
+        self._index = None
+        self._store = RecordStore(records)
+        for record in self._store:
+            record._parent = self
 
     def _get_entries(self):
         records = self._data.getchildren()[0]
         record_list = []
         for record in records:
-            # Do not show SOA/NS Records
-            if record.tag in ['soa', 'ns', 'comment']:
-                continue
+            recordObj = self._create_record(record)
+            if recordObj is not None:
+                record_list.append(recordObj)
 
-            # Do not show comments
-            if record.tag == etree.Comment:
-                continue
+        return record_list
 
-            recordObj = dns_tag_lookup[record.tag](record)
-            record_list.append(recordObj)
+    def _parsed_element(self, element):
+        recordObj = self._create_record(element)
+        if recordObj is not None:
+            self._parsed.append(recordObj)
 
-        return record_list
+    def _create_record(self, record):
+        # Do not show SOA/NS Records
+        if record.tag in ['soa', 'ns', 'comment']:
+            return None
+
+        # Do not show comments
+        if record.tag == etree.Comment:
+            return None
+
+        if self._lazy:
+            return LazyRecord(dns_tag_lookup[record.tag], record.tag, record)
+        return dns_tag_lookup[record.tag](record)
+
+    def _materialize(self, record):
+        """Replace a LazyRecord by its record object"""
+        if isinstance(record, LazyRecord):
+            record._parent = None
+            record = record.materialize()
+            record._parent = self
+            self._store.put(record)
+        return record
+
+    @property
+    def _entries(self):
+        """The sorted list of records"""
+        return [self._materialize(record) for record in list(self._store)]
 
     def show(self):
         """This could use some love, it's currently here as reference"""
-        for entry in self._entries:
+        for entry in self._store:
             print "{'%s': %s, 'records': %s}" % (
                 entry._record_type, entry.host, entry.records)
         print
 
     def add_record(self, record):
         """Add or update a given DNS record"""
-        rec = self.get_record(record._record_type, record.host)
-        if rec:
-            rec = record
-            for i,r in enumerate(self._entries):
-                if r._record_type == record._record_type \
-                        and r.host == record.host:
-                            self._entries[i] = record
-        else:
-            self._entries.append(record)
-        self.sort()
+        rec = self._store.get(record._record_type, record.host)
+        if rec is not None:
+            rec._parent = None
+        self._store.put(record)
+        record._parent = self
+        self._config = None
+        if self._index is not None:
+            if rec is not None:
+                self._index.discard(rec)
+            self._index.add(record)
         return True
 
+    def apply_changes(self, upserts=(), deletes=()):
+        """
+        Add, replace and remove many records at once
+
+        * upserts
+            DNSRecord objects, (record_type, host, results) tuples or
+            {'type': ..., 'host': ..., 'results': [...]} dicts. Results are
+            dicts keyed by attribute name, like CreateRecord takes them, or
+            tuples of the result constructor arguments.
+
+        * deletes
+            (record_type, host) tuples or {'type': ..., 'host': ...} dicts
+
+        Every change is checked before the zone is touched, a ValueError
+        leaves the zone as it was. Deletes are applied before upserts, the
+        last upsert of a (record_type, host) wins and the records are only
+        sorted once.
+        """
+        changed = {}
+        for change in upserts:
+            record = self._change_record(change)
+            changed[record._record_type, record.host] = record
+        records = changed.values()
+        keys = [self._change_key(change) for change in deletes]
+        for record in self._store.update(records, keys):
+            record._parent = None
+            if self._index is not None:
+                self._index.discard(record)
+        for record in records:
+            record._parent = self
+            if self._index is not None:
+                self._index.discard(record)
+                self._index.add(record)
+        self._config = None
+        return True
+
+    @staticmethod
+    def _change_key(change):
+        if isinstance(change, DNSRecord):
+            return change._record_type, change.host
+        if isinstance(change, dict):
+            change = change.get('type'), change.get('host')
+        try:
+            record_type, host = change
+        except (TypeError, ValueError):
+            raise ValueError("Deletes are (record_type, host) pairs: %r"
+                             % (change,))
+        return record_type, host
+
+    @staticmethod
+    def _change_record(change):
+        if isinstance(change, DNSRecord):
+            record_type, host = change._record_type, change.host
+        else:
+            if isinstance(change, dict):
+                change = (change.get('type'), change.get('host'),
+                          change.get('results', ()))
+            try:
+                record_type, host, results = change
+            except (TypeError, ValueError):
+                raise ValueError("Upserts are (record_type, host, results) "
+                                 "tuples: %r" % (change,))
+        if record_type not in record_order:
+            raise ValueError("Unsupported record type: %r" % (record_type,))
+        if not isinstance(host, basestring):
+            raise ValueError("Invalid %s record host: %r"
+                             % (record_type, host))
+        if isinstance(change, DNSRecord):
+            return change
+        try:
+            return dns_tag_lookup[record_type].from_params(
+                record_type, host, results)
+        except TypeError, e:
+            raise ValueError("Invalid %s record %r: %s"
+                             % (record_type, host, e))
+
     def diff_record(self, record):
         """Return the removed and added diffs"""
         rec = self.get_record(record._record_type, record.host)
-        if rec is not None and record is not None:
+        if rec and record is not None:
             return {'removed': tuple(set(rec.results) - set(record.results)),
-                    'added': tuple(set(record.results) - set(rec.recults))}
+                    'added': tuple(set(record.results) - set(rec.results))}
         else:
             return False
 
+    def diff(self, other):
+        """
+        Return the ZoneDiff going from this zone to other: the records
+        added, removed and changed in other.
+        """
+        return diff_zones(self, other)
+
+    def fingerprint(self):
+        """Dict of (record_type, host) to the fingerprint of every record"""
+        return dict(((record._record_type, record.host),
+                     record.fingerprint()) for record in self._store)
+
     def get_record(self, dns_record_type, host):
         """Fetch a DNS record"""
-        record_list = self._entries
-        for record in record_list:
-            if record._record_type == dns_record_type \
-                    and record.host == host:
-                return record
-        return False
+        record = self._store.get(dns_record_type, host)
+        if record is None:
+            return False
+        return self._materialize(record)
 
     def del_record(self, dns_record_type, host):
         """Remove a DNS record"""
-        rec = self.get_record(dns_record_type, host)
-        if rec:
-            self._entries = list(set(self._entries) - set([rec]))
+        rec = self._store.remove(dns_record_type, host)
+        if rec is not None:
+            rec._parent = None
+            self._config = None
+            if self._index is not None:
+                self._index.discard(rec)
         return True
 
     def sort(self):
-        unsorted = {
-            'a': [],
-            'cname': [],
-            'mx': [],
-            'ptr': [],
-            'srv': [],
-            'txt': []
-        }
-        for record in self._entries:
-            if record._record_type in unsorted.keys():
-                unsorted[record._record_type].append(record)
-
-        for key in unsorted.keys():
-            unsorted[key] = sorted(
-                unsorted[key], key=lambda result: result.host)
-
-        sorted_entries = []
-        for key in ('a', 'cname', 'mx', 'ptr', 'txt'):
-            for record in unsorted[key]:
-                sorted_entries.append(record)
-
-        self._entries = sorted_entries
+        """
+        Records are kept sorted as they are added and renamed, this only
+        sorts them again.
+        """
+        self._store.sort()
+        self._config = None
+
+    def _record_renamed(self, record, host):
+        """
+        Called by a stored record before its host changes, raises
+        ValueError if the zone already has a record of its type for host
+        """
+        self._store.rename(record, host)
+
+    def _record_changed(self, record):
+        """Called by a stored record whose host or results changed"""
+        self._config = None
+        if self._index is not None:
+            self._index.changed(record)
+
+    def find_records(self, **criteria):
+        """
+        Reverse lookup of the records by result values, returns the sorted
+        (record_type, host) pairs having results matching every criteria:
+
+        * ip
+            A records resolving to an ip
+
+        * domain
+            CNAME, MX, PTR and SRV records pointing to a domain name
+
+        * target
+            SRV records with a target
+
+        * text
+            TXT records with a text
+
+            c.dns.find_records(ip='10.1.2.3')
+            c.dns.find_records(domain='web1.mysite.com.')
+
+        The index is built on the first lookup, and kept up to date as
+        records are added, changed and removed.
+        """
+        if not criteria:
+            raise TypeError("find_records needs at least one criteria")
+        for field in criteria:
+            if field not in indexed_fields:
+                raise TypeError("Unknown criteria: %s" % field)
+        if self._index is None:
+            self._index = ResultIndex(self._entries)
+        records = None
+        for field, value in criteria.iteritems():
+            matches = self._index.lookup(field, value)
+            if records is None:
+                records = matches
+            else:
+                records &= matches
+        return sorted((record._record_type, record.host)
+                      for record in records)
 
     @staticmethod
     def CreateRecord(record_type, host, results):
@@ -139,25 +491,55 @@ class CotendoDNS(CotendoObject):
 
     @property
     def config(self):
-        """Create the finalized configuration"""
-        root = etree.Element("xml")
-        resource_records = etree.SubElement(root, "resource_records")
+        """
+        Create the finalized configuration
 
-        # Append SOA and NS records
-        resource_records.append(SOARecord()._etree)
-        resource_records.append(NSRecord()._etree)
+        Every record caches its own serialized fragment, so only the records
+        changed since the last call are serialized again.
+        """
+        if self._config is None:
+            recorder = get_recorder()
+            start = recorder.enabled and time.time()
+            parts = [config_header]
+            parts.extend(record._serialize() for record in self._store)
+            parts.append(config_footer)
+            self._config = "".join(parts)
+            if recorder.enabled:
+                recorder.timing('config.serialize', time.time() - start)
+        return self._config
 
-        # Append the rest
-        for record in self._entries:
-            resource_records.append(record._etree)
+class CotendoCDN(CotendoObject):
+    """
+    CDN origin configuration
 
-        return etree.tostring(root, encoding="utf-8",
-                              pretty_print=True)
+    origin is the OriginConfig object model of the configuration, edits
+    made through it are reflected by config, which only serializes the
+    changed elements again.
+    """
+    _origin = None
+
+    @classmethod
+    def from_tree(cls, token, tree):
+        """Create a configuration from a copy of a parsed tree"""
+        cdn = cls.__new__(cls)
+        cdn.token = token
+        cdn._data = copy.deepcopy(tree)
+        return cdn
 
-class CotendoCDN(CotendoObject):
     def entries(self):
         return etree.tostring(self._data)
 
+    @property
+    def origin(self):
+        if self._origin is None:
+            self._origin = OriginConfig(self._data)
+        return self._origin
+
+    @property
+    def config(self):
+        """The origin configuration xml"""
+        return self.origin.serialize()
+
 class UnescapedText(unicode):
     def escape(self):
         return self
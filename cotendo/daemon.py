@@ -0,0 +1,361 @@
+"""
+Local daemon keeping a warm CotendoHelper for the command line.
+
+The daemon listens on a Unix socket (only accessible to its user) and runs
+the commands of the cotendo script with a client whose service definition
+is loaded and whose connections are open. The zones it grabs stay parsed
+in memory for max_age seconds, so reading or editing a record doesn't
+fetch and parse the zone again.
+
+The protocol is one JSON line each way per connection:
+
+    {"command": "record-get", "args": [...], "options": {...}}
+    {"result": "www\\t300\\tIN\\tA\\t10.1.2.3"}   or   {"error": "...", "type": "..."}
+"""
+import errno
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from collections import OrderedDict
+from SocketServer import ThreadingMixIn, UnixStreamServer, \
+    StreamRequestHandler
+
+from flush import FlushScheduler
+from variables import variables_xml
+from zonefile import parse_record, record_lines, write_zone
+
+log = logging.getLogger('cotendo.daemon')
+
+# Seconds between two sends of the queued flushes
+flush_interval = 5.0
+
+def socket_path(path=None):
+    """The socket of the daemon, $COTENDO_SOCKET or ~/.cotendo.sock"""
+    return path or os.environ.get('COTENDO_SOCKET') or \
+        os.path.expanduser('~/.cotendo.sock')
+
+class CommandError(Exception):
+    """Unknown command, wrong arguments, or an error raised by the daemon"""
+
+class Command(object):
+    def __init__(self, name, function, usage, help):
+        self.name = name
+        self.function = function
+        self.usage = usage
+        self.help = help
+        self.params = usage.split()
+
+    def check(self, args):
+        """Raise CommandError if args don't match the usage"""
+        params = self.params
+        if params and params[-1].endswith('...'):
+            ok = len(args) >= len(params)
+        else:
+            ok = len(args) == len(params)
+        if not ok:
+            raise CommandError("usage: %s %s" % (self.name, self.usage))
+
+# Commands by name, in the order they are listed by the script
+commands = OrderedDict()
+
+def command(usage, help):
+    """Register a command, named after the function (dns_get: dns-get)"""
+    def register(function):
+        name = function.__name__.replace('_', '-')
+        commands[name] = Command(name, function, usage, help)
+        return function
+    return register
+
+class Session(object):
+    """
+    State of the commands: the helper, the zones grabbed and the flush
+    queue. Commands run one at a time.
+
+    * max_age
+        Seconds a grabbed zone is used before being grabbed again, zones
+        with edits not pushed yet are kept until they are
+    """
+    def __init__(self, helper, max_age=300):
+        self.helper = helper
+        self.max_age = max_age
+        self.flusher = FlushScheduler(helper)
+        # (domain, environment) -> (dns, baseline, time grabbed)
+        self._zones = {}
+        # Zones edited since they were grabbed
+        self._edited = set()
+        self._lock = threading.Lock()
+
+    def execute(self, name, args, options=None):
+        """Run a command, returns its output text or None"""
+        command = commands.get(name)
+        if command is None:
+            raise CommandError("Unknown command %s" % name)
+        command.check(args)
+        with self._lock:
+            return command.function(self, options or {}, *args)
+
+    def zone(self, domain, environment, fresh=False):
+        """Make the zone of a domain the helper's, grabbing it if needed"""
+        key = (domain, str(environment))
+        entry = self._zones.get(key)
+        if fresh or entry is None or key not in self._edited and \
+                time.time() - entry[2] > self.max_age:
+            self._edited.discard(key)
+            self.helper.GrabDNS(domain, environment)
+            entry = (self.helper.dns, self.helper._dns_baseline, time.time())
+            self._zones[key] = entry
+        else:
+            self.helper.dns, self.helper._dns_baseline = entry[:2]
+        return self.helper.dns
+
+    def edited(self, domain, environment):
+        """Keep the edits of a zone until it is pushed"""
+        self._edited.add((domain, str(environment)))
+
+    def push(self, domain, environment, force=False):
+        """
+        Push the zone of a domain. It is forgotten afterwards, its token is
+        spent, and when the push fails, so bad edits aren't kept.
+        """
+        self.zone(domain, environment)
+        try:
+            result = self.helper.UpdateDNS(domain, environment, force)
+        except Exception:
+            self.forget(domain, environment)
+            raise
+        if result is False:
+            return "unchanged"
+        self.forget(domain, environment)
+        return _text(result)
+
+    def forget(self, domain, environment):
+        key = (domain, str(environment))
+        self._zones.pop(key, None)
+        self._edited.discard(key)
+
+    def zones(self):
+        """(domain, environment, age, edited) of the zones held"""
+        now = time.time()
+        return [(domain, environment, now - entry[2],
+                 (domain, environment) in self._edited)
+                for (domain, environment), entry in sorted(
+                    self._zones.iteritems())]
+
+def _text(result):
+    if result is not None:
+        return unicode(result)
+
+def _origin(domain):
+    return domain.rstrip('.') + '.'
+
+@command('', "Show the daemon process and the zones it holds")
+def status(session, options):
+    lines = ["pid %d" % os.getpid()]
+    for domain, environment, age, edited in session.zones():
+        lines.append("%s %s (%ds old%s)" % (
+            domain, environment, age, edited and ", edited" or ""))
+    if session.flusher.pending_expressions:
+        lines.append("%d flush expressions queued"
+                     % session.flusher.pending_expressions)
+    return "\n".join(lines)
+
+@command('DOMAIN ENV', "Print the DNS configuration xml")
+def dns_get(session, options, domain, environment):
+    return session.zone(domain, environment, options.get('fresh')).config
+
+@command('DOMAIN ENV', "Print the zone as a BIND master file")
+def dns_zonefile(session, options, domain, environment):
+    dns = session.zone(domain, environment, options.get('fresh'))
+    return "\n".join(write_zone(dns, _origin(domain)))
+
+@command('DOMAIN ENV FILE', "Replace the DNS configuration and push it")
+def dns_set(session, options, domain, environment, config):
+    dns = session.zone(domain, environment, fresh=True)
+    session.helper.ImportDNS(config, dns.token)
+    session._zones[(domain, str(environment))] = (
+        session.helper.dns, None, time.time())
+    return session.push(domain, environment)
+
+@command('DOMAIN ENV', "Push the edits kept with --no-push")
+def dns_push(session, options, domain, environment):
+    return session.push(domain, environment, options.get('force'))
+
+@command('DOMAIN', "Publish the staging DNS configuration")
+def dns_publish(session, options, domain):
+    return _text(session.helper.dns_publish_conf(domain))
+
+@command('DOMAIN ENV TYPE HOST', "Print a record")
+def record_get(session, options, domain, environment, record_type, host):
+    dns = session.zone(domain, environment, options.get('fresh'))
+    record_type, host = record_type.lower(), host != '@' and host or ''
+    record = dns.get_record(record_type, host)
+    if not record:
+        raise CommandError("No %s record for %s"
+                           % (record_type.upper(), host or '@'))
+    return "\n".join(record_lines(record, _origin(domain)))
+
+@command('DOMAIN ENV TYPE HOST RDATA...',
+         "Add or replace a record, one RDATA per result ('10 mail' for MX)")
+def record_set(session, options, domain, environment, record_type, host,
+               *rdata):
+    record = parse_record(record_type, host, rdata, _origin(domain),
+                          options.get('ttl'))
+    session.zone(domain, environment).add_record(record)
+    session.edited(domain, environment)
+    if options.get('push', True):
+        return session.push(domain, environment)
+
+@command('DOMAIN ENV TYPE HOST', "Remove a record")
+def record_del(session, options, domain, environment, record_type, host):
+    dns = session.zone(domain, environment)
+    record_type, host = record_type.lower(), host != '@' and host or ''
+    if not dns.get_record(record_type, host):
+        raise CommandError("No %s record for %s"
+                           % (record_type.upper(), host or '@'))
+    dns.del_record(record_type, host)
+    session.edited(domain, environment)
+    if options.get('push', True):
+        return session.push(domain, environment)
+
+@command('CNAME ENV', "Print the origin configuration xml")
+def cdn_get(session, options, cname, environment):
+    return session.helper.cdn_get_conf(cname, environment).config
+
+@command('CNAME ENV FILE', "Replace the origin configuration")
+def cdn_set(session, options, cname, environment, config):
+    token = session.helper.cdn_get_conf(cname, environment).token
+    return _text(session.helper.cdn_set_conf(
+        cname, config, environment, token))
+
+@command('CNAME', "Publish the staging origin configuration")
+def cdn_publish(session, options, cname):
+    return _text(session.helper.cdn_publish_conf(cname))
+
+@command('CNAME EXPRESSION...',
+         "Flush content, under the rate limit of the flush API")
+def flush(session, options, cname, *expressions):
+    flusher = session.flusher
+    flusher.enqueue(cname, "\n".join(expressions),
+                    options.get('flush_type') or 'hard')
+    sent = flusher.send_ready()
+    lines = ["%s %s: %s" % (cname, flush_type, _text(result))
+             for cname, flush_type, exprs, result in sent]
+    if flusher.pending_expressions:
+        lines.append("%d expressions queued, sent in %ds" % (
+            flusher.pending_expressions, flusher.drain_time()))
+    return "\n".join(lines)
+
+@command('NAME=VALUE...', "Set DNS variables")
+def set_variables(session, options, *assignments):
+    variables = OrderedDict()
+    for assignment in assignments:
+        name, sep, value = assignment.partition('=')
+        if not sep:
+            raise CommandError("Variables are set as NAME=VALUE: %s"
+                               % assignment)
+        variables[name] = value
+    return _text(session.helper.dns_set_variables(variables_xml(variables)))
+
+class CommandHandler(StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            if request.get('command') == 'stop':
+                # shutdown() waits for serve_forever, which runs this
+                threading.Thread(target=self.server.shutdown).start()
+                response = {'result': "stopping"}
+            else:
+                response = {'result': self.server.session.execute(
+                    request.get('command'), request.get('args', []),
+                    request.get('options'))}
+        except Exception, e:
+            response = {'error': str(e), 'type': e.__class__.__name__}
+        self.wfile.write(json.dumps(response) + "\n")
+
+class CommandServer(ThreadingMixIn, UnixStreamServer):
+    """Serves the commands of a Session on a Unix socket"""
+    daemon_threads = True
+
+    def __init__(self, session, path=None):
+        path = socket_path(path)
+        if os.path.exists(path):
+            if running(path):
+                raise CommandError("A daemon is already listening on %s"
+                                   % path)
+            # Left by a daemon which didn't stop cleanly
+            os.unlink(path)
+        self.session = session
+        umask = os.umask(0177)
+        try:
+            UnixStreamServer.__init__(self, path, CommandHandler)
+        finally:
+            os.umask(umask)
+        self._stopped = threading.Event()
+
+    def serve_forever(self, poll_interval=0.5):
+        flusher = threading.Thread(target=self._send_flushes)
+        flusher.daemon = True
+        flusher.start()
+        try:
+            UnixStreamServer.serve_forever(self, poll_interval)
+        finally:
+            self._stopped.set()
+            flusher.join()
+
+    def server_close(self):
+        UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+    def _send_flushes(self):
+        session = self.session
+        while not self._stopped.wait(flush_interval):
+            # The helper's client isn't shared between threads, the
+            # commands hold the lock while they use it
+            with session._lock:
+                try:
+                    session.flusher.send_ready()
+                except Exception:
+                    log.exception("Sending the queued flushes failed")
+
+def call(path, command, args=(), options=None):
+    """
+    Run a command in the daemon listening on path. Returns its output, or
+    raises CommandError; raises socket.error with errno ENOENT or
+    ECONNREFUSED when no daemon is running.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path(path))
+        sock.sendall(json.dumps({'command': command, 'args': list(args),
+                                 'options': options or {}}) + "\n")
+        data = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data.append(chunk)
+    finally:
+        sock.close()
+    if not data:
+        raise CommandError("The daemon closed the connection")
+    response = json.loads("".join(data))
+    if 'error' in response:
+        if response.get('type') in (None, 'CommandError'):
+            raise CommandError(response['error'])
+        raise CommandError("%s: %s" % (response['type'], response['error']))
+    return response.get('result')
+
+def running(path=None):
+    """Whether a daemon is listening on path"""
+    try:
+        call(path, 'status')
+    except socket.error, e:
+        if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+            return False
+        raise
+    return True
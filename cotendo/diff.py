@@ -0,0 +1,52 @@
+def diff_fingerprints(old, new):
+    """
+    Compare two {(record_type, host): fingerprint} dicts, returns the
+    added, removed and changed keys.
+    """
+    added = []
+    changed = []
+    for key, fingerprint in new.iteritems():
+        previous = old.get(key)
+        if previous is None:
+            added.append(key)
+        elif previous != fingerprint:
+            changed.append(key)
+    removed = [key for key in old if key not in new]
+    return added, removed, changed
+
+class ZoneDiff(object):
+    """
+    Differences between two zones
+
+    * added
+        Records only found in the new zone
+
+    * removed
+        Records only found in the old zone
+
+    * changed
+        (old record, new record) pairs of the records whose results differ
+    """
+    def __init__(self, added=(), removed=(), changed=()):
+        self.added = list(added)
+        self.removed = list(removed)
+        self.changed = list(changed)
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def __nonzero__(self):
+        return len(self) > 0
+
+    def __repr__(self):
+        return "<ZoneDiff added=%d removed=%d changed=%d>" % (
+            len(self.added), len(self.removed), len(self.changed))
+
+def diff_zones(old, new):
+    """Compare two CotendoDNS zones in linear time"""
+    added, removed, changed = diff_fingerprints(
+        old.fingerprint(), new.fingerprint())
+    return ZoneDiff(
+        [new.get_record(*key) for key in added],
+        [old.get_record(*key) for key in removed],
+        [(old.get_record(*key), new.get_record(*key)) for key in changed])
@@ -0,0 +1,395 @@
+import random
+
+from lxml import etree
+from suds import WebFault
+from suds.client import SoapClient
+from suds.plugin import PluginContainer
+from suds.transport import Request, TransportError
+
+from metrics import get_recorder
+
+class EnvelopeBody(object):
+    """
+    File-like request body reading through the chunks of an envelope, so a
+    large parameter is sent as is instead of being copied into one string.
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self._length = sum(len(chunk) for chunk in chunks)
+        self.seek(0)
+
+    def __len__(self):
+        return self._length
+
+    def __str__(self):
+        return ''.join(self.chunks)
+
+    def seek(self, position):
+        if position != 0:
+            raise ValueError("Envelope bodies can only be rewound")
+        self._chunk = 0
+        self._offset = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = ''.join(self.chunks[self._chunk:])[self._offset:]
+            self._chunk = len(self.chunks)
+            self._offset = 0
+            return data
+        while self._chunk < len(self.chunks):
+            chunk = self.chunks[self._chunk]
+            if self._offset < len(chunk):
+                data = chunk[self._offset:self._offset + size]
+                self._offset += len(data)
+                return data
+            self._chunk += 1
+            self._offset = 0
+        return ''
+
+class EnvelopeTemplate(object):
+    """
+    SOAP envelope of an operation, precompiled around its parameters.
+
+    The envelope is marshalled once by suds and CotendoPlugin with markers
+    in place of the parameters. Rendering it then only puts the parameter
+    values back between the static parts, which gives the same bytes as
+    marshalling the call through suds.
+    """
+    def __init__(self, operation, parts):
+        self.operation = operation
+        self.parts = parts
+
+    @classmethod
+    def compile(cls, soap):
+        """Compile the template of the method of a suds SoapClient"""
+        method = soap.method
+        nparams = len(method.binding.input.param_defs(method))
+        marker = 'cotendo%08x' % random.getrandbits(32)
+        markers = ['%s_%d_' % (marker, i) for i in xrange(nparams)]
+        message = marshal(soap, markers)
+        parts = []
+        for i in xrange(nparams):
+            part, sep, message = message.partition(markers[i])
+            if not sep:
+                raise ValueError("Parameter %d of %s is not rendered as is"
+                                 % (i, method.name))
+            parts.append(part)
+        parts.append(message)
+        return cls(method.name, parts)
+
+    def chunks(self, args):
+        """The envelope as a list of strings"""
+        if len(args) != len(self.parts) - 1:
+            raise TypeError("%s takes %d arguments (%d given)" % (
+                self.operation, len(self.parts) - 1, len(args)))
+        chunks = [self.parts[0]]
+        for arg, part in zip(args, self.parts[1:]):
+            chunks.append(encode_param(arg))
+            chunks.append(part)
+        return chunks
+
+    def render(self, args):
+        return ''.join(self.chunks(args))
+
+    def body(self, args):
+        return EnvelopeBody(self.chunks(args))
+
+def renderable(args):
+    """Whether parameters can be rendered without suds"""
+    for arg in args:
+        if isinstance(arg, bool) or arg == '':
+            return False
+        if not isinstance(arg, (basestring, int, long)):
+            return False
+    return True
+
+def encode_param(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def marshal(soap, args):
+    """The encoded envelope of a call, as suds' SoapClient.send builds it"""
+    plugins = PluginContainer(soap.options.plugins)
+    soapenv = soap.method.binding.input.get_message(soap.method, args, {})
+    plugins.message.marshalled(envelope=soapenv.root())
+    if soap.options.prettyxml:
+        soapenv = soapenv.str()
+    else:
+        soapenv = soapenv.plain()
+    return soapenv.encode('utf-8')
+
+def process_reply(soap, message):
+    """Process a successful reply, as suds' SoapClient.send does"""
+    plugins = PluginContainer(soap.options.plugins)
+    message = plugins.message.received(reply=message).reply
+    if soap.options.retxml:
+        return message
+    return soap.succeeded(soap.method.binding.input, message)
+
+class ConfReplyTarget(object):
+    """
+    lxml parser target reading the reply of a get_conf operation, keeps
+    the token and queues the text of the configuration as it is parsed.
+
+    parts are the names of the return parts, the token first. The parts
+    are the children of the response element, the first child of the SOAP
+    Body. unexpected is set as soon as the reply has anything else, or the
+    parts are not exactly the expected ones, in order and holding text.
+    """
+    def __init__(self, parts):
+        self.parts = parts
+        self.unexpected = False
+        self.token_done = False
+        self.config = []
+        self._token = []
+        self._text = None
+        self._seen = []
+        # Local names of the open elements
+        self._path = []
+        self._body_children = 0
+
+    @property
+    def token(self):
+        if self._token:
+            return u''.join(self._token)
+
+    @property
+    def streaming(self):
+        """Whether the configuration part was reached, in a sound reply"""
+        return not self.unexpected and len(self._seen) == len(self.parts)
+
+    def start(self, tag, attrib):
+        name = etree.QName(tag).localname
+        path = self._path
+        path.append(name)
+        if self.unexpected or len(path) < 3 or path[1] != 'Body':
+            if len(path) == 1 and name != 'Envelope':
+                self.unexpected = True
+            return
+        if len(path) == 3:
+            self._body_children += 1
+            if name == 'Fault' or self._body_children > 1:
+                self.unexpected = True
+        elif len(path) == 4:
+            index = len(self._seen)
+            if index >= len(self.parts) or name != self.parts[index]:
+                self.unexpected = True
+                return
+            self._seen.append(name)
+            if index == 0:
+                self._text = self._token
+            else:
+                self._text = self.config
+        else:
+            # A part holding elements, not text
+            self.unexpected = True
+
+    def end(self, tag):
+        if len(self._path) == 4 and self._text is not None:
+            if self._text is self._token:
+                self.token_done = True
+            self._text = None
+        self._path.pop()
+
+    def data(self, data):
+        # Called for every piece of text between entities, kept as is
+        if self._text is not None and not self.unexpected:
+            self._text.append(data)
+
+    def close(self):
+        if len(self._seen) != len(self.parts):
+            self.unexpected = True
+        self.token_done = True
+
+class StreamedConf(object):
+    """
+    (token, config) reply of a get_conf operation, parsed while it is read
+    from the transport.
+
+    response[0] reads the reply up to the end of the token. response[1] is
+    an iterator over the text of the configuration, one piece for every
+    chunk received, to be handed to the configuration parser as it
+    arrives. The configuration is never held as a single string.
+
+    The reply is kept until the configuration part is reached. A reply
+    which doesn't have the expected parts is then unmarshalled by suds.
+    Past that point the configuration is gone, and an unexpected end of
+    the reply raises a TransportError.
+    """
+    def __init__(self, chunks, soap):
+        self._chunks = iter(chunks)
+        self._soap = soap
+        self._target = ConfReplyTarget(
+            [part.name for part in soap.method.soap.output.body.parts])
+        self._parser = etree.XMLParser(target=self._target, huge_tree=True)
+        self._size = 0
+        self._raw = []
+        self._reply = None
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, index):
+        if index == 0:
+            while not self._target.token_done and self._reply is None \
+                    and self._read():
+                pass
+            if self._reply is not None:
+                return self._reply[0]
+            return self._target.token
+        if index == 1:
+            return self._config()
+        raise IndexError(index)
+
+    def __iter__(self):
+        yield self[0]
+        yield self[1]
+
+    def _read(self):
+        """Parse the next chunk of the reply, False at its end"""
+        if self._parser is None:
+            return False
+        try:
+            chunk = self._chunks.next()
+        except StopIteration:
+            self._parser.close()
+            self._parser = None
+            if self._check():
+                recorder = get_recorder()
+                if recorder.enabled:
+                    recorder.size('soap.response_bytes', self._size)
+            return False
+        self._size += len(chunk)
+        if self._raw is not None:
+            self._raw.append(chunk)
+        self._parser.feed(chunk)
+        self._check()
+        return True
+
+    def _check(self):
+        """Drop the kept reply once it is sound, unmarshal it otherwise"""
+        target = self._target
+        if target.unexpected:
+            if self._raw is None:
+                raise TransportError(
+                    "Unexpected %s reply" % self._soap.method.name, None)
+            self._unmarshal()
+            return False
+        if self._raw is not None and target.streaming:
+            self._raw = None
+        return True
+
+    def _unmarshal(self):
+        self._parser = None
+        self._raw.extend(self._chunks)
+        reply = process_reply(self._soap, ''.join(self._raw))
+        self._raw = None
+        if isinstance(reply, tuple):
+            # (200, result) when the client doesn't raise faults
+            reply = reply[1]
+        values = []
+        for name in self._target.parts:
+            value = getattr(reply, name, None)
+            if value is None:
+                raise TransportError("The %s reply has no %s"
+                                     % (self._soap.method.name, name), None)
+            values.append(value)
+        self._reply = values
+
+    def _config(self):
+        config = self._target.config
+        while True:
+            if config:
+                # lxml gives str pieces for ascii text, unicode otherwise
+                data = u''.join(config)
+                del config[:]
+                yield data
+            elif self._reply is not None:
+                yield self._reply[1]
+                break
+            elif not self._read():
+                break
+
+class TemplateInvoker(object):
+    """
+    Invokes API operations through precompiled envelope templates.
+
+    Calls fall back to suds when an argument can't be rendered as is, or
+    when plugins other than CotendoPlugin are installed on the client.
+    """
+    def __init__(self, plugin_class):
+        self.plugin_class = plugin_class
+        self.templates = {}
+
+    def usable(self, client, args):
+        plugins = client.options.plugins
+        return renderable(args) and len(plugins) == 1 \
+            and isinstance(plugins[0], self.plugin_class)
+
+    def template(self, soap):
+        template = self.templates.get(soap.method.name)
+        if template is None:
+            template = EnvelopeTemplate.compile(soap)
+            self.templates[soap.method.name] = template
+        return template
+
+    def invoke(self, client, operation, args):
+        method = getattr(client.service, operation)
+        if not self.usable(client, args):
+            return method(*args)
+        soap = SoapClient(client, method.method)
+        try:
+            return self._send(soap, self.template(soap).body(args))
+        except WebFault, e:
+            if client.options.faults:
+                raise
+            return (500, e)
+
+    def streamable(self, client, args):
+        """Whether a call can be streamed with invoke_streamed"""
+        return self.usable(client, args) and \
+            hasattr(client.options.transport, 'stream')
+
+    def invoke_streamed(self, client, operation, args):
+        """
+        Invoke a get_conf operation through the stream() method of the
+        transport, the reply is a StreamedConf.
+        """
+        method = getattr(client.service, operation)
+        soap = SoapClient(client, method.method)
+        body = self.template(soap).body(args)
+        PluginContainer(soap.options.plugins).message.sending(envelope=body)
+        request = Request(soap.location(), body)
+        request.headers = soap.headers()
+        try:
+            try:
+                reply = soap.options.transport.stream(request)
+            except TransportError, e:
+                if e.httpcode in (202, 204):
+                    return None
+                return soap.failed(soap.method.binding.input, e)
+        except WebFault, e:
+            if client.options.faults:
+                raise
+            return (500, e)
+        if reply is None:
+            return None
+        return StreamedConf(reply.message, soap)
+
+    def _send(self, soap, body):
+        transport = soap.options.transport
+        PluginContainer(soap.options.plugins).message.sending(envelope=body)
+        if not getattr(transport, 'streaming', False):
+            body = str(body)
+        request = Request(soap.location(), body)
+        request.headers = soap.headers()
+        try:
+            reply = transport.send(request)
+        except TransportError, e:
+            if e.httpcode in (202, 204):
+                return None
+            return soap.failed(soap.method.binding.input, e)
+        if reply is None:
+            return None
+        return process_reply(soap, reply.message)
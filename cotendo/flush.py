@@ -0,0 +1,158 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+# The flush API is limited to 1,000 flush invocations per hour
+flush_rate = 1000
+flush_period = 3600.0
+
+class TokenBucket(object):
+    """
+    Token bucket allowing rate operations per period seconds, and bursts
+    of up to capacity operations (rate by default).
+    """
+    def __init__(self, rate=flush_rate, period=flush_period, capacity=None,
+                 clock=time.time):
+        self.rate = float(rate) / period
+        self.capacity = capacity or rate
+        self._clock = clock
+        self._tokens = float(self.capacity)
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self):
+        """Number of operations allowed right now"""
+        self._refill()
+        return int(self._tokens)
+
+    def consume(self, n=1):
+        """Take n tokens, returns False if there are not enough"""
+        self._refill()
+        if self._tokens < n:
+            return False
+        self._tokens -= n
+        return True
+
+    def wait_time(self, n=1):
+        """Seconds until n tokens are available"""
+        self._refill()
+        if self._tokens >= n:
+            return 0.0
+        return (n - self._tokens) / self.rate
+
+class FlushScheduler(object):
+    """
+    Coalesces flush expressions into as few doFlush invocations as
+    possible and sends them under the API rate limit.
+
+    Expressions are queued per (cname, flush type) and deduplicated, a hard
+    flush of an expression also covers a pending soft flush of it. Each
+    invocation carries every pending expression of a (cname, flush type),
+    up to max_expressions (no limit by default).
+
+        flusher = FlushScheduler(c)
+        flusher.enqueue('cdn.mysite.com', '/images/*')
+        flusher.enqueue('cdn.mysite.com', '/css/*')
+        flusher.send_ready()    # one doFlush for both expressions
+    """
+    def __init__(self, cotendo, rate=flush_rate, period=flush_period,
+                 max_expressions=None, clock=time.time, sleep=time.sleep):
+        self.cotendo = cotendo
+        self.max_expressions = max_expressions
+        self.bucket = TokenBucket(rate, period, clock=clock)
+        self._sleep = sleep
+        self._lock = threading.RLock()
+        # (cname, flush type) -> ordered set of expressions
+        self._queue = OrderedDict()
+
+    def enqueue(self, cname, expression, flushType='hard'):
+        """Queue one or more newline delimited flush expressions"""
+        with self._lock:
+            other = self._queue.get(
+                (cname, flushType == 'hard' and 'soft' or 'hard'), {})
+            pending = self._queue.setdefault((cname, flushType), OrderedDict())
+            for expr in expression.splitlines():
+                expr = expr.strip()
+                if not expr:
+                    continue
+                if flushType == 'hard':
+                    other.pop(expr, None)
+                elif expr in other:
+                    # Already covered by a pending hard flush
+                    continue
+                pending[expr] = True
+            for key in ((cname, 'hard'), (cname, 'soft')):
+                if key in self._queue and not self._queue[key]:
+                    del self._queue[key]
+
+    @property
+    def depth(self):
+        """Number of doFlush invocations needed to drain the queue"""
+        with self._lock:
+            return sum(len(self._batches(expressions))
+                       for expressions in self._queue.itervalues())
+
+    @property
+    def pending_expressions(self):
+        """Number of distinct expressions waiting to be flushed"""
+        with self._lock:
+            return sum(len(e) for e in self._queue.itervalues())
+
+    def drain_time(self):
+        """Expected seconds until the whole queue is sent"""
+        return self.bucket.wait_time(self.depth)
+
+    def send_ready(self):
+        """
+        Send as many invocations as the rate limit allows without waiting.
+        Returns a list of (cname, flush type, expressions, result).
+        """
+        sent = []
+        while True:
+            with self._lock:
+                if not self._queue or not self.bucket.consume():
+                    return sent
+                key, expressions = self._pop()
+            cname, flushType = key
+            try:
+                result = self.cotendo.doFlush(
+                    cname, '\n'.join(expressions), flushType)
+            except Exception:
+                # Requeue the expressions, the invocation is spent anyway
+                self.enqueue(cname, '\n'.join(expressions), flushType)
+                raise
+            sent.append((cname, flushType, expressions, result))
+
+    def drain(self):
+        """Send everything, waiting for the rate limit when needed"""
+        sent = []
+        while True:
+            sent.extend(self.send_ready())
+            with self._lock:
+                if not self._queue:
+                    return sent
+                wait = self.bucket.wait_time()
+            self._sleep(wait)
+
+    def _batches(self, expressions):
+        expressions = list(expressions)
+        size = self.max_expressions or len(expressions) or 1
+        return [expressions[i:i + size]
+                for i in xrange(0, len(expressions), size)]
+
+    def _pop(self):
+        """Take the next batch of the oldest (cname, flush type)"""
+        key, pending = self._queue.popitem(last=False)
+        batch = self._batches(pending)[0]
+        if len(batch) < len(pending):
+            for expr in batch:
+                del pending[expr]
+            self._queue[key] = pending
+        return key, batch
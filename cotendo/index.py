@@ -0,0 +1,70 @@
+# Result attributes which can be looked up
+indexed_fields = ('ip', 'domain', 'target', 'text')
+
+class ResultIndex(object):
+    """
+    Reverse index of the result values of a zone
+
+    Maps every value of the indexed_fields of the results to the records
+    holding it. Changed records are only marked, and indexed again on the
+    next lookup, so edits stay cheap.
+    """
+    def __init__(self, records=()):
+        self._values = dict((field, {}) for field in indexed_fields)
+        # record -> [(field, value), ...] it was indexed with
+        self._indexed = {}
+        self._dirty = set()
+        # result class -> its indexed python attributes
+        self._fields = {}
+        for record in records:
+            self.add(record)
+
+    def _result_fields(self, result_class):
+        fields = self._fields.get(result_class)
+        if fields is None:
+            names = set(name for xml_name, name in result_class._fields)
+            fields = self._fields[result_class] = tuple(
+                field for field in indexed_fields if field in names)
+        return fields
+
+    def add(self, record):
+        entries = []
+        for result in record.results:
+            for field in self._result_fields(type(result)):
+                value = getattr(result, field)
+                if value is not None and value != '':
+                    entries.append((field, value))
+                    self._values[field].setdefault(value, set()).add(record)
+        self._indexed[record] = entries
+
+    def discard(self, record):
+        self._dirty.discard(record)
+        for field, value in self._indexed.pop(record, ()):
+            records = self._values[field].get(value)
+            if records is not None:
+                records.discard(record)
+                if not records:
+                    del self._values[field][value]
+
+    def changed(self, record):
+        """Mark a record whose host or results changed"""
+        if record in self._indexed:
+            self._dirty.add(record)
+
+    def _refresh(self):
+        while self._dirty:
+            record = self._dirty.pop()
+            self.discard(record)
+            self.add(record)
+
+    def lookup(self, field, value):
+        """Set of the records having a result with field equal to value"""
+        if field not in self._values:
+            raise KeyError("Unindexed result field: %s" % field)
+        self._refresh()
+        return set(self._values[field].get(value, ()))
+
+    def values(self, field):
+        """Every indexed value of a field"""
+        self._refresh()
+        return self._values[field].keys()
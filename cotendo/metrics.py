@@ -0,0 +1,159 @@
+"""
+Metrics of the API calls, parsing and serialization.
+
+The package reports to a single recorder, which does nothing until one is
+installed:
+
+    from cotendo import metrics
+
+    recorder = metrics.MemoryRecorder()
+    metrics.set_recorder(recorder)
+    ...
+    print recorder.summary()
+
+Reported metrics:
+
+* cotendo.<method>
+    Wall time of every Cotendo API method
+
+* soap.request_bytes, soap.response_bytes
+    Size of the envelopes sent and received
+
+* soap.marshalled
+    Time spent by CotendoPlugin rewriting the envelopes
+
+* config.parse
+    Time spent parsing configurations in CotendoObject._add_config
+
+* config.serialize
+    Time spent serializing CotendoDNS.config
+
+* rollout.set, rollout.verify, rollout.publish
+    Time a change spent in every stage of a Rollout
+"""
+import functools
+import math
+import random
+import threading
+import time
+
+class Recorder(object):
+    """
+    Base class of the recorders, override timing and size to forward the
+    metrics to another system.
+    """
+    enabled = True
+
+    def timing(self, name, seconds):
+        pass
+
+    def size(self, name, nbytes):
+        pass
+
+class NullRecorder(Recorder):
+    """Installed by default, the hooks skip all work when it is in use"""
+    enabled = False
+
+class MemoryRecorder(Recorder):
+    """
+    Aggregates the metrics in memory
+
+    Counts, totals and extremes are exact, percentiles are computed from a
+    uniform sample of up to max_samples values of every metric.
+    """
+    def __init__(self, max_samples=1024):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._metrics = {}
+
+    def timing(self, name, seconds):
+        self._observe(name, seconds)
+
+    def size(self, name, nbytes):
+        self._observe(name, nbytes)
+
+    def _observe(self, name, value):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                # count, total, min, max, samples
+                metric = self._metrics[name] = [0, 0, value, value, []]
+            metric[0] += 1
+            metric[1] += value
+            if value < metric[2]:
+                metric[2] = value
+            if value > metric[3]:
+                metric[3] = value
+            samples = metric[4]
+            if len(samples) < self.max_samples:
+                samples.append(value)
+            else:
+                i = self._random.randint(0, metric[0] - 1)
+                if i < self.max_samples:
+                    samples[i] = value
+
+    def names(self):
+        with self._lock:
+            return sorted(self._metrics)
+
+    def stats(self, name, percentiles=(50, 90, 99)):
+        """
+        Dict of count, total, min, max, mean and pNN of a metric, None if
+        it was never reported
+        """
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                return None
+            count, total, low, high, samples = metric
+            samples = sorted(samples)
+        stats = {'count': count, 'total': total, 'min': low, 'max': high,
+                 'mean': float(total) / count}
+        for p in percentiles:
+            stats['p%d' % p] = percentile(samples, p)
+        return stats
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """Dict of the stats of every metric"""
+        return dict((name, self.stats(name, percentiles))
+                    for name in self.names())
+
+def percentile(values, p):
+    """Nearest rank percentile of a sorted list"""
+    if not values:
+        return None
+    rank = int(math.ceil(p * len(values) / 100.0)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+_recorder = NullRecorder()
+
+def get_recorder():
+    return _recorder
+
+def set_recorder(recorder):
+    """Install a recorder (None to disable), returns the previous one"""
+    global _recorder
+    previous = _recorder
+    _recorder = recorder or NullRecorder()
+    return previous
+
+def timed(name):
+    """Decorator reporting the wall time of every call as name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _recorder
+            if not recorder.enabled:
+                return func(*args, **kwargs)
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder.timing(name, time.time() - start)
+        return wrapper
+    return decorator
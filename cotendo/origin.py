@@ -0,0 +1,289 @@
+from lxml import etree
+
+# XPath queries compiled once, their variables are given on every call
+origin_queries = {
+    'tag': etree.XPath("descendant-or-self::*[name()=$tag]"),
+    'tag_attribute': etree.XPath(
+        "descendant-or-self::*[name()=$tag][@*[name()=$attribute and .=$value]]"),
+    }
+
+def register_query(name, path):
+    """Add a named XPath query, usable with OriginConfig.query"""
+    origin_queries[name] = etree.XPath(path)
+
+def _escape_text(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;") \
+        .replace(">", "&gt;").replace("\r", "&#13;")
+
+def _escape_attribute(value):
+    return _escape_text(value).replace('"', "&quot;") \
+        .replace("\n", "&#10;").replace("\t", "&#9;")
+
+def _ascii(text):
+    """Encode like lxml's default output, with character references"""
+    if isinstance(text, unicode):
+        return text.encode("ascii", "xmlcharrefreplace")
+    return text
+
+class OriginElement(object):
+    """
+    Element of an origin configuration
+
+    Edits made through these methods only invalidate the serialization of
+    the element and of its ancestors, edits made directly on the lxml
+    element must be followed by a call to changed().
+    """
+    def __init__(self, config, element):
+        self._config = config
+        self.element = element
+
+    @property
+    def tag(self):
+        return self.element.tag
+
+    def get(self, name, default=None):
+        return self.element.get(name, default)
+
+    def get_int(self, name, default=None):
+        value = self.element.get(name)
+        if value is None:
+            return default
+        return int(value)
+
+    def set(self, name, value):
+        """Set an attribute, None removes it"""
+        if value is None:
+            if name in self.element.attrib:
+                del self.element.attrib[name]
+        else:
+            if not isinstance(value, basestring):
+                value = str(value)
+            self.element.set(name, value)
+        self.changed()
+
+    def __getitem__(self, name):
+        return self.element.attrib[name]
+
+    def __setitem__(self, name, value):
+        self.set(name, value)
+
+    def __contains__(self, name):
+        return name in self.element.attrib
+
+    @property
+    def attributes(self):
+        return dict(self.element.attrib)
+
+    def _get_text(self):
+        return self.element.text
+
+    def _set_text(self, text):
+        self.element.text = text
+        self.changed()
+
+    text = property(_get_text, _set_text)
+
+    @property
+    def parent(self):
+        parent = self.element.getparent()
+        if parent is not None:
+            return self._config.node(parent)
+
+    def children(self, tag=None):
+        return [self._config.node(child) for child in self.element
+                if isinstance(child.tag, basestring)
+                and (tag is None or child.tag == tag)]
+
+    def find_all(self, tag, **attributes):
+        return self._config.find_all(tag, self.element, **attributes)
+
+    def find(self, tag, **attributes):
+        return self._config.find(tag, self.element, **attributes)
+
+    def append(self, tag, text=None, **attributes):
+        """Add a child element, returns it"""
+        element = etree.SubElement(self.element, tag)
+        for name, value in attributes.iteritems():
+            if not isinstance(value, basestring):
+                value = str(value)
+            element.set(name, value)
+        element.text = text
+        self.changed()
+        return self._config.node(element)
+
+    def remove(self):
+        """Remove the element (and its tail text) from the configuration"""
+        parent = self.element.getparent()
+        if parent is None:
+            raise ValueError("The root element can't be removed")
+        self._config._invalidate(parent)
+        parent.remove(self.element)
+        self._config._forget(self.element)
+
+    def changed(self):
+        self._config._invalidate(self.element)
+
+    def serialize(self):
+        """The element as xml, with its tail text"""
+        return self._config._serialize(self.element)
+
+    def __repr__(self):
+        return "<%s %s %r>" % (self.__class__.__name__, self.tag,
+                               self.attributes)
+
+class Origin(OriginElement):
+    """<origin> element, holds the rules and headers of an origin"""
+    def rules(self):
+        return self.children('rule')
+
+    def headers(self):
+        return self.children('header')
+
+    def add_rule(self, path, ttl=None, **attributes):
+        """Add a rule, returns it"""
+        if ttl is not None:
+            attributes['ttl'] = ttl
+        return self.append('rule', path=path, **attributes)
+
+    def add_header(self, name, value):
+        """Add a header, returns it"""
+        return self.append('header', name=name, value=value)
+
+class Rule(OriginElement):
+    """<rule> element, the caching of a path"""
+    def _get_path(self):
+        return self.get('path')
+
+    def _set_path(self, path):
+        self.set('path', path)
+
+    def _get_ttl(self):
+        return self.get_int('ttl')
+
+    def _set_ttl(self, ttl):
+        self.set('ttl', ttl)
+
+    path = property(_get_path, _set_path)
+    ttl = property(_get_ttl, _set_ttl)
+
+class Header(OriginElement):
+    """<header> element, a header sent to the origin"""
+    def _get_name(self):
+        return self.get('name')
+
+    def _set_name(self, name):
+        self.set('name', name)
+
+    def _get_value(self):
+        return self.get('value')
+
+    def _set_value(self, value):
+        self.set('value', value)
+
+    name = property(_get_name, _set_name)
+    value = property(_get_value, _set_value)
+
+# Element classes by tag, other elements are OriginElement
+origin_tag_lookup = {
+    'origin': Origin,
+    'rule': Rule,
+    'header': Header,
+    }
+
+class OriginConfig(object):
+    """
+    Object model of a parsed origin configuration
+
+    The serialized xml of every element is cached, an edit only makes the
+    edited element and its ancestors serialize again, the unchanged
+    subtrees are reused as is. The output is the same as lxml's
+    etree.tostring of the tree.
+    """
+    def __init__(self, root):
+        self.root = root
+        # element -> serialized xml followed by its tail
+        self._xml = {}
+        # element -> OriginElement, so wrappers stay the same objects
+        self._nodes = {}
+
+    def node(self, element):
+        node = self._nodes.get(element)
+        if node is None:
+            node_class = origin_tag_lookup.get(element.tag, OriginElement)
+            node = self._nodes[element] = node_class(self, element)
+        return node
+
+    @property
+    def root_node(self):
+        return self.node(self.root)
+
+    def query(self, query, element=None, **variables):
+        """Run a named query of origin_queries, returns the elements"""
+        if element is None:
+            element = self.root
+        return [self.node(e)
+                for e in origin_queries[query](element, **variables)
+                if isinstance(e, etree._Element)]
+
+    def find_all(self, tag, element=None, **attributes):
+        """Elements of a tag having every given attribute value"""
+        if not attributes:
+            return self.query('tag', element, tag=tag)
+        items = attributes.items()
+        name, value = items[0]
+        return [node for node in self.query(
+                    'tag_attribute', element, tag=tag, attribute=name,
+                    value=value)
+                if all(node.get(n) == v for n, v in items[1:])]
+
+    def find(self, tag, element=None, **attributes):
+        nodes = self.find_all(tag, element, **attributes)
+        if nodes:
+            return nodes[0]
+
+    def _invalidate(self, element):
+        self._xml.pop(element, None)
+        for ancestor in element.iterancestors():
+            self._xml.pop(ancestor, None)
+
+    def _forget(self, element):
+        for e in element.iter():
+            self._xml.pop(e, None)
+            self._nodes.pop(e, None)
+
+    def serialize(self):
+        xml = self._serialize(self.root)
+        if self.root.tail:
+            xml = xml[:-len(_ascii(_escape_text(self.root.tail)))]
+        return xml
+
+    def _serialize(self, element):
+        """The element as xml, followed by its tail text"""
+        xml = self._xml.get(element)
+        if xml is None:
+            if not isinstance(element.tag, basestring) or \
+                    element.tag.startswith("{"):
+                # Comments, processing instructions and namespaced elements
+                xml = etree.tostring(element)
+            else:
+                xml = self._compose(element)
+                if element.tail:
+                    xml += _ascii(_escape_text(element.tail))
+            self._xml[element] = xml
+        return xml
+
+    def _compose(self, element):
+        parts = ["<", _ascii(element.tag)]
+        for name, value in element.attrib.iteritems():
+            parts.append(' %s="%s"' % (
+                _ascii(name), _ascii(_escape_attribute(value))))
+        if element.text is None and len(element) == 0:
+            parts.append("/>")
+        else:
+            parts.append(">")
+            if element.text:
+                parts.append(_ascii(_escape_text(element.text)))
+            serialize = self._serialize
+            parts.extend(serialize(child) for child in element)
+            parts.append("</%s>" % _ascii(element.tag))
+        return "".join(parts)
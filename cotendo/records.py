@@ -1,125 +1,259 @@
 from lxml import etree
 
+def _int(value):
+    """Convert a numeric field, values that are not numbers are kept as is"""
+    if value is None or isinstance(value, (int, long)):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+def indent_fragment(fragment, indent="    "):
+    """Indent a pretty printed fragment to its depth in the configuration"""
+    return indent + fragment[:-1].replace("\n", "\n" + indent) + "\n"
+
 # DNS Results
 class DNSResult(object):
-    """Abstract skeleton for every DNS result"""
+    """
+    Abstract skeleton for every DNS result
+
+    Results are compact value objects, they compare and hash by value and
+    only build their <result> element when they are serialized. Changing
+    a field invalidates the cached serialization of the owning record.
+    """
+    __slots__ = ('_ttl', '_owner')
+    _result_type = 'dns'
+    # (xml attribute, python attribute) in serialization order
+    _fields = (('ttl', 'ttl'),)
+    # Python attributes holding numbers
+    _int_fields = ('ttl',)
+
     def __init__(self, ttl=1800):
-        self._etree = etree.Element("result")
+        self._owner = None
         self.ttl = ttl
-        self._result_type = 'dns'
+
+    def _changed(self):
+        if self._owner is not None:
+            self._owner._invalidate()
 
     def _get_ttl(self):
-        return self._etree.get("ttl")
+        return self._ttl
 
     def _set_ttl(self, ttl):
-        return self._etree.set("ttl", str(ttl))
+        self._ttl = _int(ttl)
+        self._changed()
 
     ttl = property(_get_ttl, _set_ttl)
 
+    @classmethod
+    def from_values(cls, values):
+        """Create a result from a tuple ordered like its _fields"""
+        result = cls.__new__(cls)
+        result._owner = None
+        for (xml_name, name), value in zip(cls._fields, values):
+            setattr(result, name, value)
+        return result
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Create a result from a dict keyed by xml or python attribute
+        names, or from a tuple of the constructor arguments
+        """
+        if isinstance(params, dict):
+            names = cls._names()
+            kwargs = {}
+            for key, value in params.iteritems():
+                if key not in names:
+                    raise ValueError("Unknown %s result field: %s"
+                                     % (cls._result_type, key))
+                kwargs[names[key]] = value
+            return cls(**kwargs)
+        return cls(*params)
+
+    @classmethod
+    def _names(cls):
+        names = {}
+        for xml_name, name in cls._fields:
+            names[xml_name] = names[name] = name
+        return names
+
+    def _values(self):
+        return tuple(getattr(self, name) for xml_name, name in self._fields)
+
+    @classmethod
+    def _element_values(cls, element):
+        """The values a result parsed from element would have"""
+        values = []
+        for xml_name, name in cls._fields:
+            value = element.get(xml_name)
+            if name in cls._int_fields:
+                value = _int(value)
+            values.append(value)
+        return tuple(values)
+
+    @classmethod
+    def _values_etree(cls, values):
+        result = etree.Element("result")
+        for (xml_name, name), value in zip(cls._fields, values):
+            if value is not None:
+                if not isinstance(value, basestring):
+                    value = str(value)
+                result.set(xml_name, value)
+        return result
+
+    def _get_etree(self):
+        return self._values_etree(self._values())
+
+    _etree = property(_get_etree)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and \
+            self._values() == other._values()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self._result_type,) + self._values())
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, ", ".join(
+            "%s=%r" % (name, getattr(self, name))
+            for xml_name, name in self._fields))
+
 class DomainResult(DNSResult):
     """Abstract skeleton for CNAME and MX records"""
+    __slots__ = ('_domain',)
+    _result_type = 'domain'
+    _fields = DNSResult._fields + (('domain_name', 'domain'),)
+
     def __init__(self, domain='', ttl=1800):
         super(DomainResult, self).__init__(ttl)
-        self.domain = str(domain)
-        self._result_type = 'domain'
+        self.domain = domain
 
     def _get_domain(self):
-        return self._etree.get("domain_name")
+        return self._domain
 
     def _set_domain(self, domain):
-        return self._etree.set("domain_name", domain)
+        self._domain = domain
+        self._changed()
 
     domain = property(_get_domain, _set_domain)
 
 class AResult(DNSResult):
     """A record entry"""
+    __slots__ = ('_ip',)
+    _result_type = 'a'
+    _fields = DNSResult._fields + (('ip', 'ip'),)
+
     def __init__(self, ip='', ttl=10800):
         super(AResult, self).__init__(ttl)
         self.ip = ip
-        self._result_type = 'a'
 
     def _get_ip(self):
-        return self._etree.get("ip")
+        return self._ip
 
     def _set_ip(self, ip):
-        return self._etree.set("ip", str(ip))
+        self._ip = ip
+        self._changed()
 
     ip = property(_get_ip, _set_ip)
 
 class CNAMEResult(DomainResult):
     """CNAME record entry"""
-    def __init__(self, domain='', ttl=1800):
-        super(CNAMEResult, self).__init__(domain, ttl)
-        self._result_type = 'cname'
+    __slots__ = ()
+    _result_type = 'cname'
 
 class MXResult(DomainResult):
     """MX record entry"""
+    __slots__ = ('_preference',)
+    _result_type = 'mx'
+    _fields = DomainResult._fields + (('preference', 'preference'),)
+    _int_fields = DomainResult._int_fields + ('preference',)
+
     def __init__(self, domain='', preference=20, ttl=1800):
         super(MXResult, self).__init__(domain, ttl)
         self.preference = preference
-        self._result_type = 'mx'
 
     def _get_preference(self):
-        return self._etree.get("preference")
+        return self._preference
 
     def _set_preference(self, preference):
-        return self._etree.set("preference", str(preference))
+        self._preference = _int(preference)
+        self._changed()
 
     preference = property(_get_preference, _set_preference)
 
 class PTRResult(DomainResult):
     """PTR record entry"""
-    def __init__(self, domain='', ttl=1800):
-        super(PTRResult, self).__init__(domain, ttl)
-        self._result_type = 'ptr'
+    __slots__ = ()
+    _result_type = 'ptr'
 
 class TXTResult(DNSResult):
+    """TXT record entry"""
+    __slots__ = ('_text',)
+    _result_type = 'txt'
+    _fields = DNSResult._fields + (('text', 'text'),)
+
     def __init__(self, text="", ttl=1800):
         super(TXTResult, self).__init__(ttl)
         self.text = text
-        self._result_type = 'txt'
 
     def _get_text(self):
-        return self._etree.get("text")
+        return self._text
 
     def _set_text(self, text):
-        return self._etree.set("text", text)
+        self._text = text
+        self._changed()
 
     text = property(_get_text, _set_text)
 
-class SRVResult(DNSResult):
-    def __init__(self, domain='', priority=0, weight=0, port=80, target=''):
-        super(SRVResult, self).__init__(ttl)
-        self.domain = domain
+class SRVResult(DomainResult):
+    """SRV record entry"""
+    __slots__ = ('_priority', '_weight', '_port', '_target')
+    _result_type = 'srv'
+    _fields = DomainResult._fields + (
+        ('priority', 'priority'), ('weight', 'weight'),
+        ('port', 'port'), ('target', 'target'))
+    _int_fields = DomainResult._int_fields + ('priority', 'weight', 'port')
+
+    def __init__(self, domain='', priority=0, weight=0, port=80, target='',
+                 ttl=1800):
+        super(SRVResult, self).__init__(domain, ttl)
         self.priority = priority
         self.weight = weight
         self.port = port
         self.target = target
-        self._result_type = 'srv'
 
     def _get_priority(self):
-        return self._etree.get("priority")
+        return self._priority
 
     def _set_priority(self, priority):
-        return self._etree.set("priority", str(priority))
+        self._priority = _int(priority)
+        self._changed()
 
     def _get_weight(self):
-        return self._etree.get("weight")
+        return self._weight
 
     def _set_weight(self, weight):
-        return self._etree.set("weight", str(weight))
+        self._weight = _int(weight)
+        self._changed()
 
     def _get_port(self):
-        return self._etree.get("port")
+        return self._port
 
-    def _set_port(self, priority):
-        return self._etree.set("port", str(port))
+    def _set_port(self, port):
+        self._port = _int(port)
+        self._changed()
 
     def _get_target(self):
-        return self._etree.get("target")
+        return self._target
 
-    def _set_target(self, priority):
-        return self._etree.set("target", str(target))
+    def _set_target(self, target):
+        self._target = target
+        self._changed()
 
     priority = property(_get_priority, _set_priority)
     weight = property(_get_weight, _set_weight)
@@ -127,25 +261,159 @@ class SRVResult(DNSResult):
     target = property(_get_target, _set_target)
 
 # DNS Records
+class ResultList(list):
+    """List of results which invalidates its record when it is modified"""
+    def __init__(self, owner, results=()):
+        super(ResultList, self).__init__(results)
+        self._owner = owner
+        for result in self:
+            result._owner = owner
+
+    def _adopt(self, results):
+        for result in results:
+            result._owner = self._owner
+        self._owner._invalidate()
+
+    def append(self, result):
+        super(ResultList, self).append(result)
+        self._adopt((result,))
+
+    def extend(self, results):
+        results = list(results)
+        super(ResultList, self).extend(results)
+        self._adopt(results)
+
+    def insert(self, index, result):
+        super(ResultList, self).insert(index, result)
+        self._adopt((result,))
+
+    def __setitem__(self, index, value):
+        super(ResultList, self).__setitem__(index, value)
+        if isinstance(index, slice):
+            self._adopt(self)
+        else:
+            self._adopt((value,))
+
+    def __setslice__(self, i, j, results):
+        results = list(results)
+        super(ResultList, self).__setslice__(i, j, results)
+        self._adopt(results)
+
+    def __iadd__(self, results):
+        self.extend(results)
+        return self
+
+    def __imul__(self, n):
+        super(ResultList, self).__imul__(n)
+        self._owner._invalidate()
+        return self
+
+def _invalidating(name):
+    method = getattr(list, name)
+    def wrapper(self, *args, **kwargs):
+        value = method(self, *args, **kwargs)
+        self._owner._invalidate()
+        return value
+    wrapper.__name__ = name
+    return wrapper
+
+for _name in ('remove', 'pop', 'sort', 'reverse',
+              '__delitem__', '__delslice__'):
+    setattr(ResultList, _name, _invalidating(_name))
+
 class DNSRecord(object):
-    """Abstract DNS Record"""
+    """
+    Abstract DNS Record
+
+    The serialized xml fragment of a record is cached, and is only rebuilt
+    once the host or one of the results changed.
+    """
+    # Zone notified when the record changes
+    _parent = None
+    _xml = None
+    _fingerprint = None
+
     def __init__(self, record=None):
-        self.results = []
-        self._etree = None
+        self._host = None
         self._record_type = 'dns'
+        self.results = []
+
+    @classmethod
+    def _create(cls, record_type, host, results):
+        record = cls.__new__(cls)
+        record._record_type = record_type
+        record._host = host
+        record._results = ResultList(record, results)
+        return record
+
+    @classmethod
+    def from_values(cls, record_type, host, values):
+        """Create a record from result tuples ordered like their _fields"""
+        from_values = cls.result_class.from_values
+        return cls._create(record_type, host,
+                           [from_values(result) for result in values])
+
+    @classmethod
+    def from_params(cls, record_type, host, params):
+        """Create a record from a list of result dicts or tuples"""
+        from_params = cls.result_class.from_params
+        return cls._create(record_type, host,
+                           [from_params(result) for result in params])
 
     def _get_host(self):
-        return self._etree.get("host")
+        return self._host
 
     def _set_host(self, host):
-        return self._etree.set("host", host)
+        if self._parent is not None and host != self._host:
+            # Moves the record to its new key in the zone, or raises
+            self._parent._record_renamed(self, host)
+        self._host = host
+        self._invalidate()
+
+    def _get_results(self):
+        return self._results
+
+    def _set_results(self, results):
+        self._results = ResultList(self, results)
+        self._invalidate()
+
+    def _invalidate(self):
+        self._xml = None
+        self._fingerprint = None
+        if self._parent is not None:
+            self._parent._record_changed(self)
+
+    def _get_etree(self):
+        record = etree.Element(self._record_type)
+        if self.host is not None:
+            record.set("host", self.host)
+        for result in self.results:
+            record.append(result._etree)
+        return record
+
+    def fingerprint(self):
+        """
+        Hash of the record content, the order of the results is ignored.
+        Records with the same type, host and results have the same
+        fingerprint.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = hash((self._record_type, self.host,
+                                      tuple(sorted(map(hash, self.results)))))
+        return self._fingerprint
+
+    def _serialize(self):
+        """The pretty printed record, indented for <resource_records>"""
+        if self._xml is None:
+            self._xml = indent_fragment(etree.tostring(
+                self._etree, encoding="utf-8", pretty_print=True))
+        return self._xml
 
     def _init_records(self, record=None, result_type=None, params=()):
         if record is not None:
             self.host = record.get("host")
             for r in record.getchildren():
                 result = self._append_results(result_type, r, params)
-                self._etree.append(result._etree)
                 self.results.append(result)
         else:
             self.host = ""
@@ -161,78 +429,150 @@ class DNSRecord(object):
         return func_ptr(**kwargs)
 
     host = property(_get_host, _set_host)
+    results = property(_get_results, _set_results)
+    _etree = property(_get_etree)
 
 class SOARecord(DNSRecord):
     """This always returns the default cotendo SOA Record"""
     def __init__(self, record=None):
-        self._etree = etree.Element("soa")
-        self._etree.append(
-            etree.Element("reference", domain_name="cotdns.net."))
+        self._host = None
         self.domain_name = "cotdns.net."
         self._record_type = 'soa'
 
+    def _get_etree(self):
+        record = etree.Element("soa")
+        record.append(
+            etree.Element("reference", domain_name=self.domain_name))
+        return record
+
+    _etree = property(_get_etree)
+
 class NSRecord(DNSRecord):
     """This always returns the default cotendo NS Record"""
     def __init__(self, record=None):
-        self._etree = etree.Element("ns", host="")
-        self._etree.append(
-            etree.Element("reference", domain_name="cotdns.net."))
         self.host = ""
         self.domain_name = "cotdns.net."
         self._record_type = 'ns'
 
+    def _get_etree(self):
+        record = etree.Element("ns", host=self.host)
+        record.append(
+            etree.Element("reference", domain_name=self.domain_name))
+        return record
+
+    _etree = property(_get_etree)
+
 class ARecord(DNSRecord):
     """A record listing"""
+    result_class = AResult
+
     def __init__(self, record=None):
         super(ARecord, self).__init__()
-        self._etree = etree.Element("a")
-        self._init_records(record, AResult, ("ip", "ttl"))
         self._record_type = 'a'
+        self._init_records(record, self.result_class, ("ip", "ttl"))
 
 class CNAMERecord(DNSRecord):
     """CNAME record listing"""
+    result_class = CNAMEResult
+
     def __init__(self, record=None):
         super(CNAMERecord, self).__init__()
-        self._etree = etree.Element("cname")
-        self._init_records(
-            record, CNAMEResult, ("domain", "ttl"))
         self._record_type = 'cname'
+        self._init_records(
+            record, self.result_class, ("domain", "ttl"))
 
 class MXRecord(DNSRecord):
     """MX record listing"""
+    result_class = MXResult
+
     def __init__(self, record=None):
         super(MXRecord, self).__init__()
-        self._etree = etree.Element("mx")
-        self._init_records(
-            record, MXResult, ("domain", "preference", "ttl"))
         self._record_type = 'mx'
+        self._init_records(
+            record, self.result_class, ("domain", "preference", "ttl"))
 
 class TXTRecord(DNSRecord):
     """TXT record listing"""
+    result_class = TXTResult
+
     def __init__(self, record=None):
         super(TXTRecord, self).__init__()
-        self._etree = etree.Element("txt")
-        self._init_records(
-            record, TXTResult, ("text", "ttl"))
         self._record_type = 'txt'
+        self._init_records(
+            record, self.result_class, ("text", "ttl"))
 
 class PTRRecord(DNSRecord):
     """PTR record listing"""
+    result_class = PTRResult
+
     def __init__(self, record=None):
         super(PTRRecord, self).__init__()
-        self._etree = etree.Element("ptr")
-        self._init_records(
-            record, PTRResult, ("domain", "ttl"))
         self._record_type = 'ptr'
+        self._init_records(
+            record, self.result_class, ("domain", "ttl"))
 
 class SRVRecord(DNSRecord):
     """SRV record lising"""
+    result_class = SRVResult
+
     def __init__(self, record=None):
         super(SRVRecord, self).__init__()
-        self._etree = etree.Element("srv")
-        self._init_records(
-            record, SRVResult, ("domain", "priority", "weight", "port", "target"))
         self._record_type = 'srv'
+        self._init_records(
+            record, self.result_class,
+            ("domain", "priority", "weight", "port", "target", "ttl"))
+
+class LazyRecord(object):
+    """
+    Record of a lazily loaded zone, kept as its parsed element until it is
+    accessed. It serializes and fingerprints like the record it stands for,
+    without building any result object.
+    """
+    __slots__ = ('_record_class', '_record_type', 'host', '_element',
+                 '_parent', '_xml', '_fingerprint')
+
+    def __init__(self, record_class, record_type, element):
+        self._record_class = record_class
+        self._record_type = record_type
+        self.host = element.get("host")
+        self._element = element
+        self._parent = None
+        self._xml = None
+        self._fingerprint = None
+
+    def materialize(self):
+        """Build the record object"""
+        return self._record_class(self._element)
+
+    def _result_values(self):
+        result_class = self._record_class.result_class
+        return [result_class._element_values(result)
+                for result in self._element]
+
+    def fingerprint(self):
+        if self._fingerprint is None:
+            result_type = self._record_class.result_class._result_type
+            self._fingerprint = hash((self._record_type, self.host, tuple(
+                sorted(hash((result_type,) + values)
+                       for values in self._result_values()))))
+        return self._fingerprint
+
+    def _get_etree(self):
+        result_class = self._record_class.result_class
+        record = etree.Element(self._record_type)
+        if self.host is not None:
+            record.set("host", self.host)
+        for values in self._result_values():
+            record.append(result_class._values_etree(values))
+        return record
+
+    def _serialize(self):
+        if self._xml is None:
+            self._xml = indent_fragment(etree.tostring(
+                self._etree, encoding="utf-8", pretty_print=True))
+        return self._xml
+
+    _etree = property(_get_etree)
 
 # CDN Records
 class CDNRecord(object):
@@ -0,0 +1,387 @@
+"""
+Pipelined staging to production rollouts of many configurations.
+
+Every change goes through three stages:
+
+* set
+    Fetch the staging token and dns_set_conf/cdn_set_conf the configuration
+    on staging (environment 0). A set rejected for its token is retried
+    with a fresh token.
+
+* verify
+    Read the staging configuration back and compare it with the one set
+
+* publish
+    dns_publish_conf/cdn_publish_conf the staging configuration
+
+Each stage has its own pool of threads, a change moves on to the next
+stage as soon as it is through one, so sets, reads and publishes of
+different changes overlap:
+
+    rollout = Rollout(c, concurrency={'set': 16, 'verify': 16, 'publish': 4},
+                      max_failures=5)
+    for domain, config in configs.items():
+        rollout.add('dns', domain, config)
+    rollout.add('dns', 'other.com', edit=lambda dns: dns.del_record('a', 'old'))
+    report = rollout.run()
+    print report.summary()
+"""
+import copy
+import threading
+import time
+
+from Queue import Queue
+
+from metrics import get_recorder, percentile
+from validate import validate_zone, ZoneError
+
+stages = ('set', 'verify', 'publish')
+
+default_concurrency = {'set': 8, 'verify': 8, 'publish': 4}
+
+# kind: (get_conf, set_conf, publish_conf, Cotendo method building the
+# configuration)
+operations = {
+    'dns': ('dns_get_conf', 'dns_set_conf', 'dns_publish_conf',
+            '_dns_config'),
+    'cdn': ('cdn_get_conf', 'cdn_set_conf', 'cdn_publish_conf',
+            '_cdn_config'),
+    }
+
+staging = 0
+
+class RolloutError(Exception):
+    pass
+
+def token_conflict(error):
+    """Whether an error looks like a set_conf rejecting a stale token"""
+    return 'token' in str(error).lower()
+
+class Change(object):
+    """
+    A configuration to roll out, and how far it went
+
+    * status
+        'pending', then the last stage it went through ('set', 'verify'
+        or 'publish'), 'failed' or 'halted' (not carried on after a halt)
+
+    * stage
+        The last stage the change entered, the one it failed in
+
+    * timings
+        Dict of stage to the seconds spent in it
+
+    * attempts
+        Number of set_conf calls made
+    """
+    def __init__(self, kind, name, config=None, edit=None):
+        self.kind = kind
+        self.name = name
+        self.config = config
+        self.edit = edit
+        self.status = 'pending'
+        self.stage = None
+        self.error = None
+        self.timings = {}
+        self.attempts = 0
+        # What verify compares the staging configuration with
+        self._expected = None
+
+    def __repr__(self):
+        return "<Change %s %s %s>" % (self.kind, self.name, self.status)
+
+class StageReport(object):
+    """
+    Timings of a stage
+
+    * wall
+        Seconds between the first change entering the stage and the last
+        one leaving it
+
+    * busy
+        Seconds spent in the stage, summed over the changes
+    """
+    def __init__(self, stage, durations, start, end):
+        self.stage = stage
+        self.durations = sorted(durations)
+        self.count = len(durations)
+        self.busy = sum(durations)
+        self.wall = start is not None and end - start or 0.0
+
+    def stats(self, percentiles=(50, 90, 99)):
+        stats = {'count': self.count, 'busy': self.busy, 'wall': self.wall,
+                 'max': self.durations and self.durations[-1] or None}
+        for p in percentiles:
+            stats['p%d' % p] = percentile(self.durations, p)
+        return stats
+
+class RolloutReport(object):
+    """Outcome of Rollout.run"""
+    def __init__(self, changes, stage_reports, wall, halted):
+        self.changes = changes
+        self.stages = stage_reports
+        self.wall = wall
+        self.halted = halted
+
+    def by_status(self, status):
+        return [change for change in self.changes if change.status == status]
+
+    @property
+    def failed(self):
+        return self.by_status('failed')
+
+    @property
+    def ok(self):
+        return not self.halted and not self.failed
+
+    @property
+    def errors(self):
+        """Dict of (kind, name) to the error of every failed change"""
+        return dict(((change.kind, change.name), change.error)
+                    for change in self.failed)
+
+    def summary(self):
+        """Text table of the stages and the outcome of the changes"""
+        lines = ["%-8s %6s %9s %9s %9s %9s %9s" % (
+            'stage', 'count', 'wall', 'busy', 'p50', 'p90', 'max')]
+        for report in self.stages:
+            stats = report.stats()
+            lines.append("%-8s %6d %8.2fs %8.2fs %8.3fs %8.3fs %8.3fs" % (
+                report.stage, report.count, report.wall, report.busy,
+                stats['p50'] or 0, stats['p90'] or 0, stats['max'] or 0))
+        busy = sum(report.busy for report in self.stages)
+        lines.append("%d changes in %.2fs (%.2fs if run one at a time)"
+                     % (len(self.changes), self.wall, busy))
+        counts = {}
+        for change in self.changes:
+            counts[change.status] = counts.get(change.status, 0) + 1
+        lines.append(", ".join("%s: %d" % item
+                               for item in sorted(counts.items())))
+        if self.halted:
+            lines.append("halted: %s" % self.halted)
+        return "\n".join(lines)
+
+class Rollout(object):
+    """
+    Rolls changes out to staging, checks them and publishes them, as a
+    pipeline of stages.
+
+    * concurrency
+        Dict of stage to its number of threads, see default_concurrency
+
+    * retries
+        Number of times a set rejected for its token (token_conflict by
+        default) is tried again with a fresh token. An edit is applied
+        again to the fresh configuration, a config replaces it as is.
+
+    * max_failures, max_failure_rate
+        Halt the rollout once this many changes, or this share of them,
+        have failed. Changes in a stage finish it, the others are left
+        'halted'.
+
+    * verify, publish
+        Set to False to skip the stage, publish=False only stages changes
+
+    * validate
+        Check DNS zones with validate_zone before setting them
+
+    Every stage gets its own clones of the suds client, like
+    fetch_configs. The stage times are also reported as rollout.<stage>.
+    """
+    def __init__(self, cotendo, concurrency=None, retries=3,
+                 max_failures=None, max_failure_rate=None, verify=True,
+                 publish=True, validate=True, is_conflict=token_conflict):
+        self.cotendo = cotendo
+        self.concurrency = dict(default_concurrency)
+        self.concurrency.update(concurrency or {})
+        self.retries = retries
+        self.max_failures = max_failures
+        self.max_failure_rate = max_failure_rate
+        self.validate = validate
+        self.is_conflict = is_conflict
+        self.stages = [stage for stage, enabled in (
+            ('set', True), ('verify', verify), ('publish', publish))
+            if enabled]
+        self.changes = []
+        self._keys = set()
+        self._local = threading.local()
+        self._lock = threading.Condition()
+
+    def add(self, kind, name, config=None, edit=None):
+        """
+        Add a change: the configuration xml to set, or edit, a callable
+        editing the staging CotendoDNS/CotendoCDN in place
+        """
+        if kind not in operations:
+            raise ValueError("Unknown configuration kind: %r" % (kind,))
+        if (config is None) == (edit is None):
+            raise ValueError("A change needs either a config or an edit")
+        if (kind, name) in self._keys:
+            raise ValueError("%s %s is already part of the rollout"
+                             % (kind, name))
+        self._keys.add((kind, name))
+        change = Change(kind, name, config, edit)
+        self.changes.append(change)
+        return change
+
+    def run(self):
+        """Run every change through the stages, returns a RolloutReport"""
+        self._failures = 0
+        self._finished = 0
+        self._halted = None
+        self._durations = dict((stage, []) for stage in self.stages)
+        self._spans = dict((stage, [None, None]) for stage in self.stages)
+        # Create the shared client (and load the WSDL) once, before cloning
+        self.cotendo.client
+
+        queues = [Queue() for stage in self.stages]
+        threads = []
+        for i, stage in enumerate(self.stages):
+            following = i + 1 < len(queues) and queues[i + 1] or None
+            for n in xrange(max(1, self.concurrency.get(stage, 1))):
+                thread = threading.Thread(target=self._work, args=(
+                    stage, queues[i], following))
+                thread.daemon = True
+                thread.start()
+                threads.append((queues[i], thread))
+
+        start = time.time()
+        for change in self.changes:
+            queues[0].put(change)
+        with self._lock:
+            while self._finished < len(self.changes):
+                self._lock.wait(1.0)
+        wall = time.time() - start
+        for queue, thread in threads:
+            queue.put(None)
+        for queue, thread in threads:
+            thread.join()
+
+        reports = [StageReport(stage, self._durations[stage],
+                               *self._spans[stage])
+                   for stage in self.stages]
+        return RolloutReport(list(self.changes), reports, wall, self._halted)
+
+    def _work(self, stage, queue, following):
+        run_stage = getattr(self, '_' + stage)
+        recorder = get_recorder()
+        while True:
+            change = queue.get()
+            if change is None:
+                return
+            if self._halted:
+                change.status = 'halted'
+                self._finish()
+                continue
+            change.stage = stage
+            start = time.time()
+            try:
+                run_stage(self._client(), change)
+            except Exception, e:
+                error = e
+            else:
+                error = None
+            end = time.time()
+            change.timings[stage] = end - start
+            if recorder.enabled:
+                recorder.timing('rollout.' + stage, end - start)
+            with self._lock:
+                self._durations[stage].append(end - start)
+                span = self._spans[stage]
+                if span[0] is None or start < span[0]:
+                    span[0] = start
+                if span[1] is None or end > span[1]:
+                    span[1] = end
+            if error is not None:
+                change.status = 'failed'
+                change.error = error
+                self._finish(failed=True)
+            else:
+                change.status = stage
+                if following is not None:
+                    following.put(change)
+                else:
+                    self._finish()
+
+    def _finish(self, failed=False):
+        with self._lock:
+            self._finished += 1
+            if failed:
+                self._failures += 1
+                if self._halted is None:
+                    self._halted = self._halt_reason()
+            self._lock.notify_all()
+
+    def _halt_reason(self):
+        failures = self._failures
+        if self.max_failures is not None and failures >= self.max_failures:
+            return "%d changes failed" % failures
+        if self.max_failure_rate is not None and \
+                failures >= self.max_failure_rate * len(self.changes):
+            return "%d of %d changes failed" % (failures, len(self.changes))
+
+    def _client(self):
+        """The Cotendo object of the current thread, on its own client"""
+        cotendo = getattr(self._local, 'cotendo', None)
+        if cotendo is None:
+            cotendo = copy.copy(self.cotendo)
+            cotendo._client = self.cotendo.client.clone()
+            self._local.cotendo = cotendo
+        return cotendo
+
+    def _set(self, cotendo, change):
+        get_conf, set_conf, publish_conf, wrapper = operations[change.kind]
+        config = change.config
+        if change.edit is None:
+            self._expect(change, getattr(cotendo, wrapper)((None, config)))
+        for attempt in xrange(self.retries + 1):
+            response = cotendo._get_conf(get_conf, change.name, staging)
+            if change.edit is None:
+                # Only the token is needed, the config isn't parsed
+                token = response[0]
+            else:
+                current = getattr(cotendo, wrapper)(response)
+                token = current.token
+                change.edit(current)
+                config = current.config
+                self._expect(change, current)
+            change.attempts += 1
+            try:
+                return _check_fault(getattr(cotendo, set_conf)(
+                    change.name, config, staging, token))
+            except Exception, e:
+                if attempt < self.retries and self.is_conflict(e):
+                    continue
+                raise
+
+    def _expect(self, change, config):
+        if change.kind == 'dns':
+            if self.validate:
+                problems = validate_zone(config)
+                if problems:
+                    raise ZoneError(problems)
+            change._expected = config.fingerprint()
+        else:
+            change._expected = config.config
+
+    def _verify(self, cotendo, change):
+        get_conf, set_conf, publish_conf, wrapper = operations[change.kind]
+        current = getattr(cotendo, wrapper)(
+            cotendo._get_conf(get_conf, change.name, staging))
+        if change.kind == 'dns':
+            found = current.fingerprint()
+        else:
+            found = current.config
+        if found != change._expected:
+            raise RolloutError("The staging configuration of %s differs "
+                               "from the one set" % change.name)
+
+    def _publish(self, cotendo, change):
+        get_conf, set_conf, publish_conf, wrapper = operations[change.kind]
+        _check_fault(getattr(cotendo, publish_conf)(change.name))
+
+def _check_fault(result):
+    # Clients created with faults=False return (500, fault)
+    if isinstance(result, tuple) and len(result) == 2 and result[0] == 500:
+        raise RolloutError(str(result[1]))
+    return result
@@ -0,0 +1,109 @@
+import marshal
+import os
+import tempfile
+import time
+import urllib
+
+from cotendohelper import CotendoDNS, paused_gc
+
+snapshot_version = 1
+
+def _plain(value):
+    """marshal only knows the exact str and unicode types"""
+    if isinstance(value, unicode) and type(value) is not unicode:
+        return unicode(value)
+    if isinstance(value, str) and type(value) is not str:
+        return str(value)
+    return value
+
+class SnapshotStore(object):
+    """
+    Directory of zone snapshots, one file per (domain, environment).
+
+    A snapshot keeps the token and the records of a zone as plain tuples
+    serialized with marshal, loading it builds the records directly
+    without parsing any xml:
+
+        (version, token, saved_at,
+         [(record_type, host, [result values, ...]), ...])
+    """
+    suffix = '.zone'
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _filename(self, domain, environment):
+        return os.path.join(self.path, '%s.%s%s' % (
+            urllib.quote(domain, safe=''), environment, self.suffix))
+
+    def save(self, domain, environment, dns):
+        """Write the snapshot of a CotendoDNS zone"""
+        records = [(record_type, _plain(host),
+                    [tuple(map(_plain, values)) for values in results])
+                   for record_type, host, results in dns.record_values()]
+        data = marshal.dumps(
+            (snapshot_version, _plain(dns.token), time.time(), records))
+        # Write to a temporary file first so readers never see half a file
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        os.rename(tmp, self._filename(domain, environment))
+
+    def _read(self, domain, environment):
+        try:
+            f = open(self._filename(domain, environment), 'rb')
+        except IOError:
+            return None
+        try:
+            with paused_gc():
+                snapshot = marshal.load(f)
+        except (EOFError, ValueError, TypeError):
+            return None
+        finally:
+            f.close()
+        if snapshot[0] != snapshot_version:
+            return None
+        return snapshot
+
+    def load(self, domain, environment):
+        """Return the CotendoDNS of a snapshot, None if there is none"""
+        snapshot = self._read(domain, environment)
+        if snapshot is None:
+            return None
+        version, token, saved_at, records = snapshot
+        with paused_gc():
+            return CotendoDNS.from_record_values(token, records)
+
+    def token(self, domain, environment):
+        """Token of a snapshot, None if there is none"""
+        snapshot = self._read(domain, environment)
+        if snapshot is not None:
+            return snapshot[1]
+
+    def age(self, domain, environment):
+        """Seconds since a snapshot was saved, None if there is none"""
+        try:
+            mtime = os.path.getmtime(self._filename(domain, environment))
+        except OSError:
+            return None
+        return time.time() - mtime
+
+    def remove(self, domain, environment):
+        try:
+            os.remove(self._filename(domain, environment))
+        except OSError:
+            pass
+
+    def zones(self):
+        """List of (domain, environment) having a snapshot"""
+        zones = []
+        for filename in os.listdir(self.path):
+            if filename.endswith(self.suffix):
+                name, sep, environment = \
+                    filename[:-len(self.suffix)].rpartition('.')
+                zones.append((urllib.unquote(name), environment))
+        return zones
@@ -0,0 +1,120 @@
+from bisect import bisect_left, insort
+
+# Output order of the record types in a zone configuration
+record_order = ('a', 'cname', 'mx', 'ptr', 'srv', 'txt')
+
+def merge_records(record, other):
+    """Append the results of other to record, lazy records are built"""
+    if hasattr(record, 'materialize'):
+        record = record.materialize()
+    if hasattr(other, 'materialize'):
+        other = other.materialize()
+    record.results.extend(other.results)
+    return record
+
+class RecordStore(object):
+    """
+    Keeps the DNS records of a zone keyed by (record_type, host).
+
+    Every record type keeps a sorted list of its hosts, so lookups are a
+    dict access and inserts/deletes only touch the hosts of a single type.
+    Iterating the store yields the records in configuration order.
+    """
+    def __init__(self, records=()):
+        self._records = {}
+        self._hosts = dict((t, []) for t in record_order)
+        self.load(records)
+
+    def load(self, records):
+        """
+        Replace the content of the store, sorting each type only once. The
+        results of records sharing a type and host are merged into one
+        record.
+        """
+        self._records = {}
+        self._hosts = dict((t, []) for t in record_order)
+        for record in records:
+            key = (record._record_type, record.host)
+            existing = self._records.get(key)
+            if existing is None:
+                self._hosts[record._record_type].append(record.host)
+                self._records[key] = record
+            elif existing is not record:
+                self._records[key] = merge_records(existing, record)
+        for hosts in self._hosts.itervalues():
+            hosts.sort()
+
+    def get(self, record_type, host):
+        """Fetch a record, returns None if it does not exist"""
+        return self._records.get((record_type, host))
+
+    def put(self, record):
+        """Add or replace a record"""
+        if record._record_type not in self._hosts:
+            raise KeyError("Unknown record type: %s" % record._record_type)
+        key = (record._record_type, record.host)
+        if key not in self._records:
+            insort(self._hosts[record._record_type], record.host)
+        self._records[key] = record
+
+    def remove(self, record_type, host):
+        """Remove a record, returns the removed record or None"""
+        record = self._records.pop((record_type, host), None)
+        if record is not None:
+            hosts = self._hosts[record_type]
+            del hosts[bisect_left(hosts, host)]
+        return record
+
+    def update(self, records=(), deletes=()):
+        """
+        Remove the (record_type, host) keys of deletes, then add or replace
+        records, sorting each type only once. Returns the records which
+        were removed or replaced.
+        """
+        for record in records:
+            if record._record_type not in self._hosts:
+                raise KeyError("Unknown record type: %s" % record._record_type)
+        current = dict(self._records)
+        dropped = []
+        for key in deletes:
+            record = current.pop(key, None)
+            if record is not None:
+                dropped.append(record)
+        for record in records:
+            key = (record._record_type, record.host)
+            previous = current.get(key)
+            if previous is not None and previous is not record:
+                dropped.append(previous)
+            current[key] = record
+        self.load(current.itervalues())
+        return dropped
+
+    def rename(self, record, host):
+        """
+        Move a stored record to a new host, raises ValueError if the host
+        already has a record of the same type
+        """
+        record_type = record._record_type
+        if (record_type, host) in self._records:
+            raise ValueError("Host %r already has a record of type %s"
+                             % (host, record_type.upper()))
+        if self._records.get((record_type, record.host)) is record:
+            self.remove(record_type, record.host)
+        self._records[(record_type, host)] = record
+        insort(self._hosts[record_type], host)
+
+    def sort(self):
+        """Re-sort the hosts of every type (needed after a host is renamed)"""
+        self.load(self._records.values())
+
+    def __contains__(self, key):
+        return key in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        records = self._records
+        for record_type in record_order:
+            for host in self._hosts[record_type]:
+                yield records[(record_type, host)]
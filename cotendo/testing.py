@@ -0,0 +1,239 @@
+"""
+Local stand-in for the Cotendo SOAP API.
+
+Serves the bundled WSDL and answers the API operations with canned or
+user supplied responses, so clients and transports can be exercised
+without network access:
+
+    server = StandInServer({'dns_get_conf': lambda name, env: (token, xml)})
+    server.start()
+    c = server.client(transport=PooledTransport())
+    ...
+    server.stop()
+"""
+import os
+import socket
+import sys
+import threading
+import time
+import zlib
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+wsdl_path = os.path.join(os.path.dirname(__file__), 'cws.wsdl')
+
+empty_dns_conf = '<xml><resource_records></resource_records></xml>'
+empty_cdn_conf = '<xml></xml>'
+
+# Return part names of the operations answering with a token and a config
+conf_parts = {
+    'cdn_get_conf': ('token', 'originConf'),
+    'dns_get_conf': ('token', 'domainConf'),
+    }
+
+def default_handlers():
+    return {
+        'cdn_get_conf': lambda cname, env: ('stand-in', empty_cdn_conf),
+        'dns_get_conf': lambda name, env: ('stand-in', empty_dns_conf),
+        }
+
+response_envelope = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<SOAP-ENV:Envelope'
+    ' xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/"'
+    ' xmlns:xsd="http://www.w3.org/2001/XMLSchema"'
+    ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+    ' SOAP-ENV:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+    '<SOAP-ENV:Body>%s</SOAP-ENV:Body></SOAP-ENV:Envelope>')
+
+fault_body = (
+    '<SOAP-ENV:Fault><faultcode>SOAP-ENV:Server</faultcode>'
+    '<faultstring>%s</faultstring></SOAP-ENV:Fault>')
+
+def compress(data, encoding):
+    """Compress a body for a gzip or deflate Content-Encoding"""
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    else:
+        compressor = zlib.compressobj(6)
+    return compressor.compress(data) + compressor.flush()
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server._connected(self.connection)
+
+    def finish(self):
+        BaseHTTPRequestHandler.finish(self)
+        self.server._disconnected(self.connection)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.endswith('?wsdl'):
+            self._respond(200, self.server.wsdl())
+        else:
+            self._respond(404, '')
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length', 0))
+        operation, params = self.server.parse(self.rfile.read(length))
+        self.server._received(operation, params, self.headers)
+        try:
+            body = self.server.answer(operation, params)
+        except Exception, e:
+            self._respond(500, response_envelope % (fault_body % escape(
+                str(e))))
+        else:
+            self._respond(200, response_envelope % body)
+
+    def _respond(self, code, body, content_type='text/xml; charset=utf-8'):
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        encoding = self.server.compress
+        accepted = self.headers.getheader('accept-encoding', '')
+        if encoding and encoding in accepted:
+            body = compress(body, encoding)
+        else:
+            encoding = None
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP/1.1 server standing in for api.cotendo.net
+
+    * handlers
+        Dict of operation name to a callable taking the request parameters
+        and returning the response, a (token, config) tuple for the get_conf
+        operations and a string for the others.
+
+    * requests
+        Every (operation, params, headers) received
+
+    * connections
+        Number of TCP connections accepted
+
+    * compress
+        'gzip' or 'deflate' to compress the responses of the clients
+        accepting it
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handlers=None, address=('127.0.0.1', 0),
+                 compress=None):
+        HTTPServer.__init__(self, address, StandInHandler)
+        self.compress = compress
+        self.handlers = default_handlers()
+        self.handlers.update(handlers or {})
+        self.requests = []
+        self.connections = 0
+        self._open = set()
+        self._lock = threading.Condition()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%s/cws' % self.server_address[:2]
+
+    @property
+    def wsdl_url(self):
+        return self.url + '?wsdl'
+
+    @property
+    def location(self):
+        return self.url + '?ver=1.0'
+
+    def client(self, username='user', password='pass', cls=None, **kwargs):
+        """Create a Cotendo client (or cls) talking to this server"""
+        if cls is None:
+            from cotendo import Cotendo as cls
+        return cls(username, password, wsdl=self.wsdl_url,
+                   location=self.location, **kwargs)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+        # End the handlers waiting on keep-alive connections
+        self._lock.acquire()
+        try:
+            for connection in self._open:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+            # Handlers still busy in a slow answer end before the server
+            deadline = time.time() + 5
+            while self._open and time.time() < deadline:
+                self._lock.wait(deadline - time.time())
+        finally:
+            self._lock.release()
+
+    def handle_error(self, request, client_address):
+        # Clients may close a connection before reading the whole reply
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+    def wsdl(self):
+        return open(wsdl_path).read()
+
+    def parse(self, message):
+        """Return the operation name and parameters of a SOAP request"""
+        # The marshalled envelope keeps a stale SOAP-ENV:encodingStyle
+        parser = etree.XMLParser(recover=True)
+        envelope = etree.fromstring(message, parser)
+        body = [e for e in envelope if etree.QName(e).localname == 'Body'][0]
+        method = body[0]
+        params = [param.text for param in method]
+        return etree.QName(method).localname, params
+
+    def answer(self, operation, params):
+        """Return the SOAP body answering an operation"""
+        handler = self.handlers.get(operation)
+        result = handler is not None and handler(*params) or ''
+        if operation in conf_parts:
+            parts = zip(conf_parts[operation], result)
+        else:
+            parts = [('return', result)]
+        values = ''.join(
+            '<%s xsi:type="xsd:string">%s</%s>' % (name, escape(value), name)
+            for name, value in parts)
+        return '<ns1:%sResponse xmlns:ns1="http://api.cotendo.net/cws">' \
+            '%s</ns1:%sResponse>' % (operation, values, operation)
+
+    def _connected(self, connection):
+        self._lock.acquire()
+        self.connections += 1
+        self._open.add(connection)
+        self._lock.release()
+
+    def _disconnected(self, connection):
+        self._lock.acquire()
+        self._open.discard(connection)
+        self._lock.notifyAll()
+        self._lock.release()
+
+    def _received(self, operation, params, headers):
+        self._lock.acquire()
+        self.requests.append((operation, params, headers))
+        self._lock.release()
@@ -0,0 +1,359 @@
+import base64
+import errno
+import httplib
+import socket
+import threading
+import urllib2
+import zlib
+
+from StringIO import StringIO
+from urlparse import urlparse
+
+from suds.properties import Unskin
+from suds.transport import Transport, TransportError, Reply
+
+# Content codings asked for when compress is on
+accepted_encodings = 'gzip, deflate'
+# Bytes read from the socket at a time by stream()
+read_size = 65536
+# Errors sending on a keep-alive connection the server has closed
+stale_errors = (errno.ECONNRESET, errno.EPIPE)
+
+class Decoder(object):
+    """
+    Incremental decoder of a gzip or deflate response body.
+
+    Some servers send deflate bodies without the zlib header, the format
+    is told from the first bytes.
+    """
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self._zlib = None
+        self._head = ''
+        if encoding == 'gzip':
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decode(self, data):
+        if self._zlib is None:
+            self._head += data
+            if len(self._head) < 2:
+                return ''
+            data, self._head = self._head, ''
+            self._zlib = zlib.decompressobj()
+            try:
+                return self._zlib.decompress(data)
+            except zlib.error:
+                self._zlib = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._zlib.decompress(data)
+
+    def flush(self):
+        if self._zlib is None:
+            # Less than two bytes, not a deflate body
+            raise zlib.error("Truncated deflate body")
+        return self._zlib.flush()
+
+def decoder(response):
+    """The Decoder of a response body, None if it isn't compressed"""
+    encoding = (response.getheader('content-encoding') or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return Decoder('gzip')
+    if encoding == 'deflate':
+        return Decoder('deflate')
+
+class ResponseBody(object):
+    """
+    Iterator over the decoded chunks of a response body, as they are read
+    from the connection.
+
+    The connection goes back to its pool once the body is read. It is
+    closed instead if the body is closed (or dropped) before its end.
+    """
+    def __init__(self, pool, connection, response):
+        self._pool = pool
+        self._connection = connection
+        self._response = response
+        self._decoder = decoder(response)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._response is None:
+            raise StopIteration
+        try:
+            while True:
+                data = self._response.read(read_size)
+                if not data:
+                    break
+                if self._decoder is None:
+                    return data
+                data = self._decoder.decode(data)
+                if data:
+                    return data
+            data = self._decoder and self._decoder.flush()
+        except (httplib.HTTPException, socket.error, zlib.error), e:
+            self.close()
+            raise TransportError(str(e), None)
+        self._release(not self._response.will_close)
+        if data:
+            return data
+        raise StopIteration
+
+    def close(self):
+        if self._response is not None:
+            self._release(False)
+
+    __del__ = close
+
+    def _release(self, reusable):
+        self._pool.release(self._connection, reusable)
+        self._pool = self._connection = self._response = None
+
+class ConnectionPool(object):
+    """
+    Keeps persistent connections to a single host.
+
+    At most size connections are open at the same time, callers wait up to
+    pool_timeout seconds for one to be released.
+    """
+    def __init__(self, scheme, host, port, size=4, timeout=90,
+                 pool_timeout=None):
+        if scheme == 'https':
+            self.connection_class = httplib.HTTPSConnection
+        else:
+            self.connection_class = httplib.HTTPConnection
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.pool_timeout = pool_timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._size = size
+        self._open = 0
+
+    def acquire(self):
+        """Return an idle connection, or a new one if the pool is not full"""
+        self._available.acquire()
+        try:
+            while not self._idle and self._open >= self._size:
+                self._available.wait(self.pool_timeout)
+                if self.pool_timeout is not None and not self._idle \
+                        and self._open >= self._size:
+                    raise TransportError(
+                        "No connection available to %s" % self.host, None)
+            if self._idle:
+                return self._idle.pop(), True
+            self._open += 1
+        finally:
+            self._available.release()
+        return self.connection_class(
+            self.host, self.port, timeout=self.timeout), False
+
+    def release(self, connection, reusable=True):
+        """Give a connection back, closing it if it can't be reused"""
+        if not reusable:
+            connection.close()
+        self._available.acquire()
+        try:
+            if reusable:
+                self._idle.append(connection)
+            else:
+                self._open -= 1
+            self._available.notify()
+        finally:
+            self._available.release()
+
+    def close(self):
+        """Close every idle connection"""
+        self._available.acquire()
+        try:
+            for connection in self._idle:
+                connection.close()
+            self._open -= len(self._idle)
+            self._idle = []
+            self._available.notify_all()
+        finally:
+            self._available.release()
+
+class PooledTransport(Transport):
+    """
+    Suds transport reusing persistent HTTP/1.1 connections.
+
+    One ConnectionPool is kept per (scheme, host, port) and shared between
+    every thread and every clone of the suds client. Credentials are sent
+    with basic authentication on every request, like suds' HttpAuthenticated.
+
+    * pool_size
+        Maximum number of connections open to a host at the same time
+
+    * timeout
+        Socket timeout in seconds
+
+    * pool_timeout
+        Seconds to wait for a free connection, None waits forever
+
+    * compress
+        Ask for gzip or deflate compressed responses, compressed responses
+        are always decoded
+
+    Request messages may be file-like objects, they are streamed to the
+    connection instead of being sent as a single string. Replies can be
+    read as they arrive with stream().
+    """
+    streaming = True
+
+    def __init__(self, pool_size=4, timeout=90, pool_timeout=None,
+                 compress=True, **kwargs):
+        Transport.__init__(self)
+        Unskin(self.options).update(kwargs)
+        self.options.timeout = timeout
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.compress = compress
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def open(self, request):
+        if request.url.startswith('file:'):
+            return urllib2.urlopen(request.url)
+        self.addcredentials(request)
+        reply = self._request('GET', request)
+        if reply.code >= 300:
+            raise TransportError(
+                "HTTP %s" % reply.code, reply.code, StringIO(reply.message))
+        return StringIO(reply.message)
+
+    def send(self, request):
+        self.addcredentials(request)
+        reply = self._request('POST', request)
+        if reply.code in (202, 204):
+            return None
+        if reply.code >= 300:
+            raise TransportError(
+                "HTTP %s" % reply.code, reply.code, StringIO(reply.message))
+        return reply
+
+    def stream(self, request):
+        """
+        Send a request like send(), but returns as soon as the response
+        headers are received. The message of the reply is a ResponseBody
+        iterating over the body as it is read.
+        """
+        self.addcredentials(request)
+        pool, connection, response = self._open('POST', request)
+        if response.status in (202, 204) or response.status >= 300:
+            body = self._read(pool, connection, response)
+            if response.status in (202, 204):
+                return None
+            raise TransportError(
+                "HTTP %s" % response.status, response.status, StringIO(body))
+        return Reply(response.status, dict(response.getheaders()),
+                     ResponseBody(pool, connection, response))
+
+    def addcredentials(self, request):
+        credentials = (self.options.username, self.options.password)
+        if not (None in credentials):
+            encoded = base64.b64encode(':'.join(credentials))
+            request.headers['Authorization'] = 'Basic %s' % encoded
+
+    def close(self):
+        """Close every idle connection"""
+        for pool in self._pools.values():
+            pool.close()
+
+    def pool(self, url):
+        """The connection pool used for a given url"""
+        url = urlparse(url)
+        port = url.port or (url.scheme == 'https' and 443 or 80)
+        key = (url.scheme, url.hostname, port)
+        pool = self._pools.get(key)
+        if pool is None:
+            self._lock.acquire()
+            try:
+                pool = self._pools.get(key)
+                if pool is None:
+                    pool = ConnectionPool(
+                        url.scheme, url.hostname, port, self.pool_size,
+                        self.options.timeout, self.pool_timeout)
+                    self._pools[key] = pool
+            finally:
+                self._lock.release()
+        return pool
+
+    def _request(self, method, request):
+        pool, connection, response = self._open(method, request)
+        body = self._read(pool, connection, response)
+        return Reply(response.status, dict(response.getheaders()), body)
+
+    def _open(self, method, request):
+        """Send a request, returns the pool, connection and response"""
+        pool = self.pool(request.url)
+        url = urlparse(request.url)
+        path = url.path or '/'
+        if url.query:
+            path = '%s?%s' % (path, url.query)
+        headers = request.headers
+        if self.compress:
+            headers = dict(headers)
+            headers.setdefault('Accept-Encoding', accepted_encodings)
+
+        retried = False
+        while True:
+            if hasattr(request.message, 'seek'):
+                request.message.seek(0)
+            connection, reused = pool.acquire()
+            stale = False
+            try:
+                try:
+                    connection.request(method, path, request.message, headers)
+                except socket.error, e:
+                    stale = e.errno in stale_errors
+                    raise
+                try:
+                    return pool, connection, connection.getresponse()
+                except httplib.BadStatusLine:
+                    # Closed without a byte of response
+                    stale = True
+                    raise
+            except (httplib.HTTPException, socket.error), e:
+                pool.release(connection, False)
+                # The server may have dropped an idle keep-alive connection
+                # before reading the request, the only case where it is
+                # certain the request wasn't handled. The other idle
+                # connections are likely dropped too, it is sent again once
+                # on a new one.
+                if reused and stale and not retried:
+                    retried = True
+                    pool.close()
+                    continue
+                raise TransportError(str(e), None)
+            except:
+                pool.release(connection, False)
+                raise
+
+    def _read(self, pool, connection, response):
+        """The decoded body of a response, gives the connection back"""
+        try:
+            body = response.read()
+            body_decoder = decoder(response)
+            if body_decoder is not None:
+                body = body_decoder.decode(body) + body_decoder.flush()
+        except (httplib.HTTPException, socket.error, zlib.error), e:
+            pool.release(connection, False)
+            raise TransportError(str(e), None)
+        except:
+            pool.release(connection, False)
+            raise
+        pool.release(connection, not response.will_close)
+        return body
+
+    def __deepcopy__(self, memo={}):
+        # Client clones get their own options but share the connections
+        clone = self.__class__(
+            self.pool_size, self.options.timeout, self.pool_timeout,
+            self.compress)
+        Unskin(clone.options).update(Unskin(self.options))
+        clone._pools = self._pools
+        clone._lock = self._lock
+        return clone
@@ -0,0 +1,143 @@
+import re
+
+from records import LazyRecord
+
+max_ttl = 2147483647
+max_name = 255
+max_label = 63
+
+ipv4_re = re.compile(r'^(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})$')
+label_re = re.compile(r'^[A-Za-z0-9_*]([A-Za-z0-9_-]*[A-Za-z0-9_])?$')
+
+class ZoneError(Exception):
+    """
+    Raised when a zone fails validation, problems is the list of
+    (record_type, host, message) found.
+    """
+    def __init__(self, problems):
+        self.problems = problems
+        lines = ["%s %r: %s" % problem for problem in problems[:10]]
+        if len(problems) > 10:
+            lines.append("... %d more" % (len(problems) - 10))
+        Exception.__init__(self, "%d problems in the zone\n%s"
+                           % (len(problems), "\n".join(lines)))
+
+def _number(value, low, high):
+    if not isinstance(value, (int, long)) or isinstance(value, bool):
+        return "is not a number"
+    if not low <= value <= high:
+        return "is out of range (%d-%d)" % (low, high)
+
+def check_ttl(value):
+    return _number(value, 0, max_ttl)
+
+def check_short(value):
+    return _number(value, 0, 65535)
+
+def check_ip(value):
+    match = isinstance(value, basestring) and ipv4_re.match(value)
+    if not match or [n for n in match.groups() if int(n) > 255]:
+        return "is not an IPv4 address"
+
+def check_name(value):
+    if not isinstance(value, basestring) or not value:
+        return "is not a domain name"
+    if len(value) > max_name:
+        return "is longer than %d characters" % max_name
+    for label in value.rstrip('.').split('.'):
+        if len(label) > max_label:
+            return "has a label longer than %d characters" % max_label
+        if not label_re.match(label):
+            return "is not a valid domain name"
+
+def check_text(value):
+    if not isinstance(value, basestring) or not value:
+        return "is empty"
+
+# Checks of the result attributes, they return the problem or None
+field_checks = {
+    'ttl': check_ttl,
+    'ip': check_ip,
+    'domain': check_name,
+    'preference': check_short,
+    'priority': check_short,
+    'weight': check_short,
+    'port': check_short,
+    'target': check_name,
+    'text': check_text,
+    }
+
+# Attributes which may be left out, the server uses its default
+optional_fields = ('ttl', 'preference', 'priority', 'weight', 'port')
+# Optional attributes of some record types only
+optional_type_fields = {'srv': ('domain',)}
+
+def _check_host(host):
+    if host is None:
+        return "record without host"
+    if host == '':
+        return None
+    problem = check_name(host)
+    if problem:
+        return "host %s" % problem
+
+def _record_values(record):
+    """Result class and result value tuples of a record"""
+    if isinstance(record, LazyRecord):
+        return record._record_class.result_class, record._result_values()
+    result_class = type(record).result_class
+    return result_class, [result._values() for result in record.results]
+
+def validate_zone(dns):
+    """
+    Check every record of a CotendoDNS zone in one pass, returns the list
+    of (record_type, host, message) problems found:
+
+    * invalid host names
+    * records without results, duplicate results
+    * ip, domain names, ttl, preference, priority, weight and port values
+    * CNAME records sharing their host with other records, or having
+      more than one result
+    """
+    problems = []
+    # host -> record types, for the CNAME conflicts
+    types = {}
+    for record in dns._store:
+        record_type = record._record_type
+        host = record.host
+        problem = _check_host(host)
+        if problem:
+            problems.append((record_type, host, problem))
+        types.setdefault(host, []).append(record_type)
+
+        result_class, results = _record_values(record)
+        if not results:
+            problems.append((record_type, host, "record without results"))
+        elif record_type == 'cname' and len(results) > 1:
+            problems.append((record_type, host,
+                             "CNAME record with %d results" % len(results)))
+        optional = optional_type_fields.get(record_type, ())
+        seen = set()
+        for values in results:
+            if values in seen:
+                problems.append((record_type, host,
+                                 "duplicate result %r" % (values,)))
+                continue
+            seen.add(values)
+            for (xml_name, name), value in zip(result_class._fields, values):
+                if value is None and name in optional_fields or \
+                        not value and name in optional:
+                    continue
+                check = field_checks.get(name)
+                problem = check and check(value)
+                if problem:
+                    problems.append((record_type, host, "%s %r %s"
+                                     % (xml_name, value, problem)))
+
+    for host, record_types in types.iteritems():
+        if 'cname' in record_types and len(record_types) > 1:
+            problems.append(('cname', host, "CNAME and %s records on the "
+                             "same host" % ", ".join(sorted(
+                                 t.upper() for t in record_types
+                                 if t != 'cname'))))
+    return problems
@@ -0,0 +1,197 @@
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from xml.sax.saxutils import quoteattr
+
+log = logging.getLogger('cotendo.variables')
+
+def variables_xml(variables):
+    """The <variables> payload of dns_set_variables"""
+    lines = ['<variables>']
+    for name, value in variables.iteritems():
+        if not isinstance(value, basestring):
+            value = str(value)
+        lines.append('   <variable name=%s value=%s/>'
+                     % (quoteattr(name), quoteattr(value)))
+    lines.append('</variables>')
+    return '\n'.join(lines)
+
+class VariableUpdater(object):
+    """
+    Coalesces variable updates into as few dns_set_variables calls as
+    possible.
+
+    Updates are kept per variable name, the last value set wins. Pending
+    updates are sent together once window seconds have passed since the
+    first of them, by poll() or by the background thread of start().
+
+    * max_pending
+        Number of distinct pending variables, set() blocks while it is
+        reached (backpressure). Without a background thread, set() sends
+        the pending updates itself instead.
+
+    * max_in_flight
+        Number of dns_set_variables calls running at the same time
+
+        updater = VariableUpdater(c, window=1.0)
+        updater.start()
+        updater.set('ny_weight', 10)
+        updater.set('ny_weight', 0)     # replaces the pending 10
+        updater.stop()                  # sends what is still pending
+    """
+    def __init__(self, cotendo, window=1.0, max_pending=1000,
+                 max_in_flight=1, clock=time.time):
+        self.cotendo = cotendo
+        self.window = window
+        self.max_pending = max_pending
+        self.max_in_flight = max_in_flight
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()
+        # Time of the oldest pending update
+        self._first = None
+        self._in_flight = 0
+        self._thread = None
+        self._stopping = False
+        self.updates = 0
+        self.coalesced = 0
+        self.calls = 0
+        self.last_error = None
+
+    @property
+    def pending(self):
+        """Number of distinct variables waiting to be sent"""
+        return len(self._pending)
+
+    @property
+    def in_flight(self):
+        """Number of dns_set_variables calls running"""
+        return self._in_flight
+
+    def set(self, name, value, timeout=None):
+        """
+        Queue a variable value. Returns False if the queue stayed full for
+        timeout seconds, None waits as long as needed. When no background
+        thread is running, a full queue is flushed by the caller, and the
+        errors of dns_set_variables are raised.
+        """
+        if timeout is not None:
+            deadline = self._clock() + timeout
+        while True:
+            with self._cond:
+                if name in self._pending or not self.max_pending or \
+                        len(self._pending) < self.max_pending:
+                    if name in self._pending:
+                        self.coalesced += 1
+                    self._pending[name] = value
+                    self.updates += 1
+                    if self._first is None:
+                        self._first = self._clock()
+                        self._cond.notify_all()
+                    return True
+                if self._thread is not None:
+                    if timeout is None:
+                        self._cond.wait()
+                        continue
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                    continue
+            # Nothing else would send the pending updates
+            self.flush()
+
+    def update(self, variables, timeout=None):
+        """Queue a dict of variable values"""
+        for name, value in variables.iteritems():
+            if not self.set(name, value, timeout):
+                return False
+        return True
+
+    def due(self):
+        """Whether the window of the pending updates has passed"""
+        with self._cond:
+            return self._first is not None and \
+                self._clock() - self._first >= self.window
+
+    def poll(self):
+        """Send the pending updates if their window has passed"""
+        if self.due():
+            return self.flush()
+
+    def flush(self):
+        """
+        Send every pending update now, waiting for a call slot if needed.
+        Returns the result of dns_set_variables, None if nothing was sent.
+        """
+        with self._cond:
+            while self._in_flight >= self.max_in_flight:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            variables = self._pending
+            self._pending = OrderedDict()
+            self._first = None
+            self._in_flight += 1
+            self._cond.notify_all()
+        try:
+            result = self.cotendo.dns_set_variables(variables_xml(variables))
+        except Exception, e:
+            with self._cond:
+                self.last_error = e
+                # Put the values back, unless newer ones were set since
+                for name, value in variables.iteritems():
+                    if name not in self._pending:
+                        self._pending[name] = value
+                if self._first is None:
+                    self._first = self._clock()
+            raise
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+        self.calls += 1
+        return result
+
+    def start(self):
+        """Send the updates from a background thread"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, flush=True):
+        """Stop the background thread, sending what is pending if flush"""
+        with self._cond:
+            thread = self._thread
+            self._thread = None
+            self._stopping = True
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+        if flush:
+            self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if self._first is None:
+                        self._cond.wait()
+                        continue
+                    remaining = self.window - (self._clock() - self._first)
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # The variables are pending again, retried after a window
+                log.exception("dns_set_variables failed")
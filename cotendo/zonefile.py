@@ -0,0 +1,388 @@
+"""
+BIND master file import and export of the A, CNAME, MX, PTR, SRV and TXT
+records.
+
+Both directions stream: read_zone yields the resource records as the
+lines are read, write_zone yields the lines as the records are written.
+
+    dns = load_zone(open('mysite.com.zone'), 'mysite.com.', token)
+
+    out = open('mysite.com.zone', 'w')
+    for line in write_zone(dns, 'mysite.com.'):
+        out.write((line + '\\n').encode('utf-8'))
+
+Files are UTF-8: byte string lines are decoded, and the lines written are
+unicode. Hosts are relative to the origin of the zone ('' for the apex),
+the names found in the records data are made absolute on import and
+written absolute. The SOA and NS records are skipped, cotendo serves its
+own.
+
+The domain_name of an SRV result is the owner name of its record when
+imported. One that differs is written in a comment of the line, read back
+on import:
+
+    www  300  IN  SRV  1 10 5060 sip.mysite.com.  ; domain_name=_sip._tcp.
+"""
+import re
+
+from cotendohelper import CotendoDNS, dns_tag_lookup, paused_gc
+from records import AResult, CNAMEResult, MXResult, PTRResult, \
+    SRVResult, TXTResult, LazyRecord
+
+# Records types read and written, SOA/NS are always skipped
+zone_types = ('a', 'cname', 'mx', 'ptr', 'srv', 'txt')
+skipped_types = ('soa', 'ns')
+classes = ('in', 'ch', 'hs')
+
+ttl_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+# A number of seconds, or numbers with units, without nested repeats
+# which backtrack on long invalid tokens
+ttl_re = re.compile(r'^(?:\d+|(?:\d+[smhdw])+)$', re.I)
+ttl_part_re = re.compile(r'(\d+)([smhdw]?)', re.I)
+
+class Quoted(unicode):
+    """Token which was a quoted string"""
+
+class Annotation(unicode):
+    """
+    domain_name of an SRV result, written in a comment of its line when it
+    isn't the owner name of the record
+    """
+
+annotation_re = re.compile(r'^\s*domain_name=(\S*)\s*$')
+
+def _annotation(comment):
+    match = annotation_re.match(comment)
+    if match is not None:
+        return [Annotation(match.group(1))]
+    return []
+
+def _split_annotation(tokens):
+    """The tokens without their annotation, and the annotation or None"""
+    domain = None
+    for token in tokens:
+        if isinstance(token, Annotation):
+            domain = token
+    if domain is None:
+        return tokens, None
+    return [token for token in tokens
+            if not isinstance(token, Annotation)], domain
+
+def parse_ttl(value):
+    """Seconds of a TTL, with or without units (1h30m)"""
+    return sum(int(n) * ttl_units[unit.lower() or 's']
+               for n, unit in ttl_part_re.findall(value))
+
+def _tokenize(line):
+    if isinstance(line, str):
+        line = line.decode('utf-8')
+    if '"' not in line:
+        annotation = []
+        if ';' in line:
+            annotation = _annotation(line[line.index(';') + 1:])
+            line = line[:line.index(';')]
+        if '(' in line or ')' in line:
+            line = line.replace('(', ' ( ').replace(')', ' ) ')
+        return line.split() + annotation
+    tokens = []
+    i = 0
+    n = len(line)
+    while i < n:
+        c = line[i]
+        if c in ' \t\r\n':
+            i += 1
+        elif c == ';':
+            tokens.extend(_annotation(line[i + 1:]))
+            break
+        elif c in '()':
+            tokens.append(c)
+            i += 1
+        elif c == '"':
+            # \DDD escapes are octets, the string is built as UTF-8
+            octets = []
+            i += 1
+            while i < n and line[i] != '"':
+                if line[i] == '\\' and i + 1 < n:
+                    digits = line[i + 1:i + 4]
+                    if len(digits) == 3 and digits.isdigit():
+                        octets.append(chr(int(digits)))
+                        i += 4
+                    else:
+                        octets.append(line[i + 1].encode('utf-8'))
+                        i += 2
+                else:
+                    octets.append(line[i].encode('utf-8'))
+                    i += 1
+            if i >= n:
+                raise ValueError("Unterminated quoted string")
+            tokens.append(Quoted(''.join(octets).decode('utf-8')))
+            i += 1
+        else:
+            start = i
+            while i < n and line[i] not in ' \t\r\n;()"':
+                i += 1
+            tokens.append(line[start:i])
+    return tokens
+
+def _entries(lines):
+    """Yields (line number, owner given, tokens) of every entry"""
+    tokens = []
+    depth = 0
+    for number, line in enumerate(lines, 1):
+        try:
+            line_tokens = _tokenize(line)
+        except ValueError, e:
+            raise ValueError("Line %d: %s" % (number, e))
+        if depth == 0:
+            if not line_tokens:
+                continue
+            start = number
+            owner = line[:1] not in (' ', '\t')
+        for token in line_tokens:
+            if token == '(' and not isinstance(token, Quoted):
+                depth += 1
+            elif token == ')' and not isinstance(token, Quoted):
+                depth -= 1
+                if depth < 0:
+                    raise ValueError("Line %d: unbalanced )" % number)
+            else:
+                tokens.append(token)
+        if depth == 0 and tokens:
+            yield start, owner, tokens
+            tokens = []
+    if depth:
+        raise ValueError("Line %d: unbalanced (" % start)
+
+def _absolute(name, origin):
+    if name == '@':
+        if origin is None:
+            raise ValueError("@ needs an origin")
+        return origin
+    if name.endswith('.') or origin is None:
+        return name
+    return "%s.%s" % (name, origin)
+
+def _relative(name, origin):
+    """Host of an absolute name in the zone of origin"""
+    if origin is None:
+        if name.endswith('.'):
+            raise ValueError("Absolute name %s needs an origin" % name)
+        return name
+    lower = name.lower()
+    if lower == origin.lower():
+        return ''
+    if lower.endswith('.' + origin.lower()):
+        return name[:-len(origin) - 1]
+    raise ValueError("%s is not in the zone %s" % (name, origin))
+
+def _owner_name(host, origin):
+    """Absolute name of a host, the host itself without an origin"""
+    if origin is None:
+        return host
+    return _absolute(host or '@', origin)
+
+# Number of data fields of the record types
+rdata_fields = {'a': 1, 'cname': 1, 'ptr': 1, 'mx': 2, 'srv': 4}
+
+def _result(record_type, rdata, origin, ttl, owner=None, domain=None):
+    expected = rdata_fields.get(record_type)
+    if expected is not None and len(rdata) != expected:
+        raise ValueError("%s record with %d data fields instead of %d"
+                         % (record_type.upper(), len(rdata), expected))
+    kwargs = {}
+    if ttl is not None:
+        kwargs['ttl'] = ttl
+    if record_type == 'a':
+        ip, = rdata
+        return AResult(ip, **kwargs)
+    if record_type == 'cname':
+        name, = rdata
+        return CNAMEResult(_absolute(name, origin), **kwargs)
+    if record_type == 'ptr':
+        name, = rdata
+        return PTRResult(_absolute(name, origin), **kwargs)
+    if record_type == 'mx':
+        preference, name = rdata
+        return MXResult(_absolute(name, origin), int(preference), **kwargs)
+    if record_type == 'srv':
+        priority, weight, port, target = rdata
+        if target == '.':
+            target = ''
+        else:
+            target = _absolute(target, origin)
+        if domain is None:
+            domain = owner
+        return SRVResult(domain, int(priority), int(weight), int(port),
+                         target, **kwargs)
+    if not rdata:
+        raise ValueError("TXT record without text")
+    return TXTResult(''.join(rdata), **kwargs)
+
+def read_zone(lines, origin=None, ttl=None, skip_unsupported=False):
+    """
+    Parse a master file, yields (record_type, host, result) for every
+    resource record.
+
+    * origin
+        Origin of the zone, taken from the first $ORIGIN by default
+
+    * ttl
+        TTL of the records without one when the file has no $TTL, the
+        result default is used if it is None
+
+    * skip_unsupported
+        Skip the records of other types instead of raising ValueError
+    """
+    zone_origin = origin
+    current_origin = origin
+    default_ttl = ttl
+    last_owner = None
+    for number, has_owner, tokens in _entries(lines):
+        try:
+            directive = tokens[0].upper()
+            if directive == '$ORIGIN':
+                current_origin = _absolute(tokens[1], current_origin)
+                if zone_origin is None:
+                    zone_origin = current_origin
+                continue
+            if directive == '$TTL':
+                default_ttl = parse_ttl(tokens[1])
+                continue
+            if directive.startswith('$'):
+                raise ValueError("Unsupported directive %s" % tokens[0])
+
+            if has_owner:
+                last_owner = _absolute(tokens[0], current_origin)
+                tokens = tokens[1:]
+            elif last_owner is None:
+                raise ValueError("Record without owner")
+            record_ttl = default_ttl
+            while tokens:
+                if ttl_re.match(tokens[0]):
+                    record_ttl = parse_ttl(tokens[0])
+                elif tokens[0].lower() not in classes:
+                    break
+                tokens = tokens[1:]
+            if not tokens:
+                raise ValueError("Record without type")
+            tokens, domain = _split_annotation(tokens)
+            record_type = tokens[0].lower()
+            if record_type in skipped_types:
+                continue
+            if record_type not in zone_types:
+                if skip_unsupported:
+                    continue
+                raise ValueError("Unsupported record type %s" % tokens[0])
+            result = _result(record_type, tokens[1:], current_origin,
+                             record_ttl, last_owner, domain)
+            yield record_type, _relative(last_owner, zone_origin), result
+        except ValueError, e:
+            raise ValueError("Line %d: %s" % (number, e))
+
+def load_zone(lines, origin=None, token=None, **kwargs):
+    """
+    Read a master file into a CotendoDNS, the results of a host and type
+    are grouped into one record
+    """
+    results = {}
+    with paused_gc():
+        for record_type, host, result in read_zone(lines, origin, **kwargs):
+            results.setdefault((record_type, host), []).append(result)
+        return CotendoDNS.from_records(token, [
+            dns_tag_lookup[record_type]._create(record_type, host, values)
+            for (record_type, host), values in results.iteritems()])
+
+def parse_record(record_type, host, rdata, origin=None, ttl=None):
+    """
+    Build a record from the master file data of its results, one string
+    per result ('10 mail' for an MX). '@' is the apex host.
+    """
+    record_type = record_type.lower()
+    if record_type not in zone_types:
+        raise ValueError("Unsupported record type %s" % record_type)
+    if host == '@':
+        host = ''
+    owner = _owner_name(host, origin)
+    results = []
+    for data in rdata:
+        tokens, domain = _split_annotation(_tokenize(data))
+        results.append(_result(record_type, tokens, origin, ttl, owner,
+                               domain))
+    return dns_tag_lookup[record_type]._create(record_type, host, results)
+
+def _quote(text):
+    """
+    The quoted character strings of a text. They are limited to 255
+    octets, a string is never split inside a UTF-8 character.
+    """
+    if isinstance(text, str):
+        text = text.decode('utf-8')
+    strings = []
+    parts = []
+    size = 0
+    for c in text:
+        if c in '\\"':
+            part, octets = '\\' + c, 1
+        elif c < ' ' or c == '\x7f':
+            part, octets = '\\%03d' % ord(c), 1
+        else:
+            part, octets = c, len(c.encode('utf-8'))
+        if size + octets > 255:
+            strings.append(u''.join(parts))
+            parts = []
+            size = 0
+        parts.append(part)
+        size += octets
+    strings.append(u''.join(parts))
+    return u' '.join(u'"%s"' % string for string in strings)
+
+def _fqdn(name):
+    """
+    Absolute form of a name of the records data, cotendo takes the names
+    without a trailing dot as absolute too
+    """
+    if name.endswith('.'):
+        return name
+    return name + '.'
+
+def _rdata(record_type, result):
+    if record_type == 'a':
+        return result.ip
+    if record_type in ('cname', 'ptr'):
+        return _fqdn(result.domain)
+    if record_type == 'mx':
+        return "%s %s" % (result.preference, _fqdn(result.domain))
+    if record_type == 'srv':
+        return "%s %s %s %s" % (result.priority, result.weight, result.port,
+                                _fqdn(result.target or ''))
+    return _quote(result.text)
+
+def write_zone(dns, origin=None):
+    """
+    Yields the lines of the master file of a CotendoDNS zone, records of
+    lazy zones are read without being kept.
+    """
+    if origin is not None:
+        yield "$ORIGIN %s" % origin
+    for record in dns._store:
+        for line in record_lines(record, origin):
+            yield line
+
+def record_lines(record, origin=None):
+    """The master file lines of a record, one per result"""
+    if isinstance(record, LazyRecord):
+        record = record.materialize()
+    owner = record.host or '@'
+    record_type = record._record_type.upper()
+    for result in record.results:
+        if result.ttl is None:
+            line = "%s\tIN\t%s\t%s" % (
+                owner, record_type, _rdata(record._record_type, result))
+        else:
+            line = "%s\t%s\tIN\t%s\t%s" % (
+                owner, result.ttl, record_type,
+                _rdata(record._record_type, result))
+        if record._record_type == 'srv' and \
+                result.domain != _owner_name(record.host, origin):
+            line = "%s\t; domain_name=%s" % (line, result.domain or '')
+        yield line
@@ -16,6 +16,7 @@ setup(name='cotendo',
       license='MIT',
       packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
       include_package_data=True,
+      package_data={'cotendo': ['cws.wsdl']},
       zip_safe=False,
       install_requires=[
           "lxml>=2.3beta1",
@@ -24,5 +25,7 @@ setup(name='cotendo',
       ],
       entry_points="""
       # -*- Entry points: -*-
+      [console_scripts]
+      cotendo = cotendo.cli:main
       """,
       )
@@ -0,0 +1,92 @@
+"""
+AsyncCotendo against the local stand-in server
+
+    python -m unittest discover tests
+"""
+import logging
+import socket
+import threading
+import unittest
+import warnings
+
+warnings.filterwarnings('ignore', module='BeautifulSoup')
+
+from suds.transport import TransportError
+
+from cotendo import ConfigCache, bundled_wsdl, metrics
+from cotendo.asyncclient import AsyncCotendo
+from cotendo.cotendohelper import config_header, config_footer
+from cotendo.testing import StandInServer
+
+config = config_header + ''.join(
+    '    <a host="www%d">\n'
+    '      <result ttl="300" ip="10.0.0.%d"/>\n'
+    '    </a>\n' % (i, i % 250) for i in xrange(2000)) + config_footer
+
+class AsyncCotendoTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.server = StandInServer({
+            'dns_get_conf': lambda name, env: ('tok', config),
+            'dns_set_conf': lambda *args: 'ok'}).start()
+        self.recorder = metrics.MemoryRecorder()
+        self.previous = metrics.set_recorder(self.recorder)
+
+    def tearDown(self):
+        metrics.set_recorder(self.previous)
+        self.server.stop()
+        logging.disable(logging.NOTSET)
+
+    def test_calls_return_the_blocking_configs(self):
+        c = self.server.client(cls=AsyncCotendo)
+        calls = [c.dns_get_conf('x%d.com' % i, 1) for i in xrange(4)]
+        c.run()
+        blocking = self.server.client().dns_get_conf('x.com', 1)
+        for call in calls:
+            self.assertEqual(call.result().config, blocking.config)
+        self.assertEqual(
+            self.recorder.stats('cotendo.dns_get_conf')['count'], 5)
+
+    def test_config_cache(self):
+        cache = ConfigCache()
+        c = self.server.client(cls=AsyncCotendo, config_cache=cache)
+        c.dns_get_conf('x.com', 1)
+        c.run()
+        call = c.dns_get_conf('x.com', 1)
+        self.assertTrue(call.done)
+        self.assertEqual(cache.stats['hits'], 1)
+        c.dns_set_conf('x.com', config, 1, 'tok')
+        c.run()
+        self.assertFalse(c.dns_get_conf('x.com', 1).done)
+
+class TruncatedReplyTest(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.thread = threading.Thread(target=self.reply)
+        self.thread.start()
+
+    def tearDown(self):
+        self.thread.join()
+        self.listener.close()
+
+    def reply(self):
+        connection, address = self.listener.accept()
+        connection.recv(65536)
+        connection.sendall('HTTP/1.0 200 OK\r\n'
+                           'Content-Type: text/xml\r\n'
+                           'Content-Length: 1000\r\n\r\n<?xml')
+        connection.close()
+
+    def test_truncated_reply_fails(self):
+        c = AsyncCotendo('user', 'pass', wsdl=bundled_wsdl,
+                         location='http://127.0.0.1:%d/' %
+                         self.listener.getsockname()[1])
+        call = c.dns_get_conf('x.com', 1)
+        c.run()
+        self.assertTrue(isinstance(call.exception(), TransportError))
+        self.assertTrue('5 of 1000 bytes' in str(call.exception()))
+
+if __name__ == '__main__':
+    unittest.main()
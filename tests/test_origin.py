@@ -0,0 +1,45 @@
+"""
+Object model of the origin configurations (cotendo.origin)
+
+    python -m unittest discover tests
+"""
+import unittest
+
+from lxml import etree
+
+from cotendo.origin import OriginConfig, Origin, Rule, Header
+
+config = '''<xml>
+  <origin name="o">
+    <rule path="/images/*" ttl="300"/>
+    <header name="X-Origin" value="1"/>
+  </origin>
+</xml>'''
+
+class TypedElementTest(unittest.TestCase):
+    def setUp(self):
+        self.root = etree.fromstring(config)
+        self.origin = OriginConfig(self.root)
+
+    def test_documented_tags_are_typed(self):
+        origin = self.origin.find('origin')
+        self.assertTrue(isinstance(origin, Origin))
+        rule, = origin.rules()
+        self.assertTrue(isinstance(rule, Rule))
+        self.assertEqual((rule.path, rule.ttl), ('/images/*', 300))
+        header, = origin.headers()
+        self.assertTrue(isinstance(header, Header))
+        self.assertEqual((header.name, header.value), ('X-Origin', '1'))
+
+    def test_typed_edits_serialize(self):
+        origin = self.origin.find('origin')
+        origin.rules()[0].ttl = 60
+        origin.add_rule('/css/*')
+        origin.add_header('X-Cache', 'off').value = 'on'
+        self.assertEqual(self.origin.serialize(), etree.tostring(self.root))
+        self.assertEqual([rule.ttl for rule in origin.rules()], [60, None])
+        self.assertEqual(self.origin.find('header', name='X-Cache').value,
+                         'on')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+PooledTransport, streamed get_conf replies and envelope templates, checked
+against the local stand-in server.
+
+    python -m unittest discover tests
+"""
+import logging
+import time
+import unittest
+import warnings
+
+warnings.filterwarnings('ignore', module='BeautifulSoup')
+
+from lxml import etree
+from suds.client import SoapClient
+from suds.transport import TransportError
+
+from cotendo import CotendoHelper, ConfigCache
+from cotendo.cotendohelper import config_header, config_footer
+from cotendo.envelope import EnvelopeTemplate, StreamedConf, marshal
+from cotendo.testing import StandInServer, response_envelope
+from cotendo.transport import PooledTransport, read_size
+
+def zone_config(size):
+    """A zone large enough to arrive in many chunks"""
+    records = []
+    for i in xrange(size):
+        records.append(
+            '    <a host="www%d">\n'
+            '      <result ttl="300" ip="10.0.%d.%d"/>\n'
+            '    </a>\n' % (i, i // 250, i % 250))
+    records.append(
+        '    <txt host="t">\n'
+        '      <result ttl="60" text="caf\xc3\xa9 &amp; &lt;b&gt;"/>\n'
+        '    </txt>\n')
+    return (config_header + ''.join(records) + config_footer).decode('utf-8')
+
+config = zone_config(4000)
+
+cdn_config = u'''<xml>
+  <origin name="o">
+    <param name="a">caf\xe9 &amp; &lt;b&gt;</param>
+    <p><table><tr><td>cell</td></tr></table></p>
+    <script>if (a &lt; b) { c = "&amp;"; }</script>
+    <style>a &gt; b { color: red; }</style>
+    <rule path="/images/*" ttl="300"/>
+  </origin>
+</xml>
+'''
+
+def stripped(tree):
+    """Copy of a tree without the indentation of its text"""
+    tree = etree.fromstring(etree.tostring(tree))
+    for element in tree.iter():
+        element.text = (element.text or '').strip() or None
+        element.tail = (element.tail or '').strip() or None
+    return etree.tostring(tree)
+
+class StandInTestCase(unittest.TestCase):
+    compress = None
+    handlers = {}
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        handlers = {'dns_get_conf': lambda name, env: ('tok', config),
+                    'dns_set_conf': lambda *args: 'ok'}
+        handlers.update(self.handlers)
+        self.server = StandInServer(handlers, compress=self.compress).start()
+
+    def tearDown(self):
+        self.server.stop()
+        logging.disable(logging.NOTSET)
+
+    def client(self, **kwargs):
+        kwargs.setdefault('transport', PooledTransport())
+        return self.server.client(**kwargs)
+
+    def operations(self, operation):
+        return [params for name, params, headers in self.server.requests
+                if name == operation]
+
+class StreamedConfTest(StandInTestCase):
+    def test_config_spans_many_reads(self):
+        self.assertTrue(len(config) > 4 * read_size)
+
+    def test_streamed_config_is_buffered_config(self):
+        buffered = self.client().dns_get_conf('x.com', 0)
+        streamed = self.client(stream=True).dns_get_conf('x.com', 0)
+        self.assertEqual(streamed.token, buffered.token)
+        self.assertEqual(streamed.config, buffered.config)
+        self.assertEqual(streamed.fingerprint(), buffered.fingerprint())
+        self.assertEqual(
+            streamed.get_record('txt', 't').results[0].text,
+            u'caf\xe9 & <b>')
+
+    def test_byte_string_config(self):
+        # Configurations read from files, as ImportDNS gets them
+        imported = self.client(stream=True)._dns_config(
+            ('tok', config.encode('utf-8')))
+        streamed = self.client(stream=True).dns_get_conf('x.com', 0)
+        self.assertEqual(imported.config, streamed.config)
+
+    def test_streamed_lazy_config(self):
+        buffered = self.client().dns_get_conf('x.com', 0)
+        lazy = self.client(stream=True, lazy=True).dns_get_conf('x.com', 0)
+        self.assertEqual(lazy.config, buffered.config)
+
+class StreamedCDNConfTest(StandInTestCase):
+    handlers = {'cdn_get_conf': lambda name, env: ('tok', cdn_config)}
+
+    def test_streamed_config_is_buffered_config(self):
+        buffered = self.client().cdn_get_conf('cdn.x.com', 0)
+        streamed = self.client(stream=True).cdn_get_conf('cdn.x.com', 0)
+        self.assertEqual(stripped(streamed._data), stripped(buffered._data))
+        self.assertEqual(streamed.origin.find('param').text.strip(),
+                         u'caf\xe9 & <b>')
+        self.assertEqual(streamed.origin.find('script').text,
+                         u'if (a < b) { c = "&"; }')
+
+def part(name, value):
+    return '<%s xsi:type="xsd:string">%s</%s>' % (name, value, name)
+
+def conf_reply(*parts, **kwargs):
+    reply = response_envelope % (
+        '<ns1:dns_get_confResponse xmlns:ns1="http://api.cotendo.net/cws">'
+        '%s</ns1:dns_get_confResponse>' % ''.join(parts))
+    if kwargs.get('header'):
+        reply = reply.replace(
+            '<SOAP-ENV:Body>', '<SOAP-ENV:Header><a><b><c>x</c></b></a>'
+            '</SOAP-ENV:Header><SOAP-ENV:Body>')
+    return reply
+
+class ConfReplyTest(StandInTestCase):
+    def streamed(self, reply):
+        client = self.client().client
+        soap = SoapClient(client, client.service.dns_get_conf.method)
+        chunks = [reply[i:i + 64] for i in xrange(0, len(reply), 64)]
+        response = StreamedConf(chunks, soap)
+        return response[0], u''.join(response[1])
+
+    def test_sound_reply(self):
+        self.assertEqual(
+            self.streamed(conf_reply(part('token', 'tok'),
+                                     part('domainConf', '&lt;xml/&gt;'))),
+            ('tok', '<xml/>'))
+
+    def test_unexpected_replies_are_unmarshalled_by_suds(self):
+        for reply in (
+                conf_reply(part('domainConf', '&lt;xml/&gt;'),
+                           part('token', 'tok')),
+                conf_reply(part('token', 'tok'),
+                           part('domainConf', '&lt;xml/&gt;'), header=True)):
+            self.assertEqual(self.streamed(reply), ('tok', '<xml/>'))
+
+    def test_missing_part(self):
+        self.assertRaises(TransportError, self.streamed,
+                          conf_reply(part('token', 'tok')))
+
+    def test_extra_part_after_the_config(self):
+        self.assertRaises(TransportError, self.streamed, conf_reply(
+            part('token', 'tok'), part('domainConf', '&lt;xml/&gt;'),
+            part('extra', 'x')))
+
+class GzipStreamedConfTest(StreamedConfTest):
+    compress = 'gzip'
+
+    def test_reply_is_compressed(self):
+        self.client(stream=True).dns_get_conf('x.com', 0)
+        headers = self.server.requests[-1][2]
+        self.assertEqual(headers.getheader('accept-encoding'),
+                         'gzip, deflate')
+
+class DeflateStreamedConfTest(StreamedConfTest):
+    compress = 'deflate'
+
+class UncompressedStreamedConfTest(StreamedConfTest):
+    def client(self, **kwargs):
+        kwargs['transport'] = PooledTransport(compress=False)
+        return super(UncompressedStreamedConfTest, self).client(**kwargs)
+
+class PooledTransportTest(StandInTestCase):
+    compress = 'gzip'
+    handlers = {'doFlush': lambda *args: time.sleep(1.5) or 'flushed'}
+
+    def test_connections_are_reused(self):
+        for stream in (False, True):
+            c = self.client(stream=stream)
+            for i in xrange(5):
+                c.dns_get_conf('x.com', 0)
+                c.dns_set_conf('x.com', config, 0, 'tok')
+        self.assertEqual(len(self.server.requests), 20)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_unread_streamed_reply_closes_its_connection(self):
+        c = self.client(stream=True)
+        self.assertEqual(c._get_conf('dns_get_conf', 'x.com', 0)[0], 'tok')
+        self.assertEqual(c.dns_get_conf('x.com', 0).token, 'tok')
+        self.assertEqual(self.server.connections, 2)
+
+    def test_timeout_is_not_sent_again(self):
+        c = self.client(transport=PooledTransport(timeout=1))
+        c.dns_get_conf('x.com', 0)
+        self.assertRaises(Exception, c.doFlush, 'cdn.x.com', '/b', 'hard')
+        time.sleep(1)
+        self.assertEqual(len(self.operations('doFlush')), 1)
+
+class BulkFetchTest(StandInTestCase):
+    handlers = {'dns_get_conf': lambda name, env: (
+        'tok%s' % env, config_header + config_footer)}
+
+    def test_configs_are_keyed_by_environment(self):
+        c = self.client(cls=CotendoHelper, stream=True)
+        result = c.GrabManyDNS(['x.com', ('x.com', 0), 'y.com'])
+        self.assertTrue(result.ok)
+        self.assertEqual(sorted(result.configs),
+                         [('x.com', 0), ('x.com', 1), ('y.com', 1)])
+        self.assertEqual(result['x.com', 0].token, 'tok0')
+        self.assertEqual(result['x.com', 1].token, 'tok1')
+
+    def test_fetches_go_through_the_config_cache(self):
+        c = self.client(cls=CotendoHelper, config_cache=ConfigCache())
+        c.GrabManyDNS(['x.com', 'y.com'])
+        result = c.GrabManyDNS(['x.com', 'y.com'])
+        self.assertEqual(len(result), 2)
+        self.assertEqual(len(self.operations('dns_get_conf')), 2)
+
+class EnvelopeTemplateTest(StandInTestCase):
+    calls = [
+        ('dns_set_conf', ('x.com', config, 0, 'tok')),
+        ('dns_set_conf', (u'\xe9.com', u'<xml>\xe9 & ]]></xml>', 1L, u'tok')),
+        ('dns_get_conf', ('x.com', 1)),
+        ('cdn_set_conf', ('cdn.x.com', '<xml/>', 0, 'tok')),
+        ('doFlush', ('cdn.x.com', '/a/*\n/b/*', 'hard')),
+        ('dns_set_variables', ('<variables/>',)),
+        ]
+
+    def test_render_is_suds_marshal(self):
+        client = self.client().client
+        for operation, args in self.calls:
+            soap = SoapClient(client, getattr(client.service, operation).method)
+            template = EnvelopeTemplate.compile(soap)
+            self.assertEqual(template.render(args), marshal(soap, args))
+
+    def test_precompiled_calls_send_suds_envelopes(self):
+        c = self.client()
+        precompiled = self.client(precompile=True)
+        for operation, args in self.calls:
+            getattr(c, operation)(*args)
+            getattr(precompiled, operation)(*args)
+            (first, first_params, h1), (second, second_params, h2) = \
+                self.server.requests[-2:]
+            self.assertEqual((first, first_params),
+                             (second, second_params))
+            self.assertEqual(h1.getheader('content-length'),
+                             h2.getheader('content-length'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+Coalescing variable updates (cotendo.variables)
+
+    python -m unittest discover tests
+"""
+import threading
+import unittest
+
+from cotendo.variables import VariableUpdater
+
+class Recording(object):
+    """Keeps the dns_set_variables payloads, fails while failing is set"""
+    def __init__(self):
+        self.payloads = []
+        self.failing = False
+
+    def dns_set_variables(self, variables):
+        if self.failing:
+            raise IOError("unavailable")
+        self.payloads.append(variables)
+        return 'ok'
+
+class PollModeTest(unittest.TestCase):
+    def setUp(self):
+        self.cotendo = Recording()
+        self.updater = VariableUpdater(self.cotendo, window=60,
+                                       max_pending=2)
+
+    def set_in_thread(self, name, value):
+        thread = threading.Thread(target=self.updater.set,
+                                  args=(name, value))
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        return not thread.is_alive()
+
+    def test_full_queue_is_flushed_by_set(self):
+        self.updater.set('a', 1)
+        self.updater.set('b', 2)
+        self.assertTrue(self.set_in_thread('c', 3))
+        self.assertEqual(len(self.cotendo.payloads), 1)
+        self.assertTrue('name="b"' in self.cotendo.payloads[0])
+        self.assertEqual(self.updater.pending, 1)
+
+    def test_pending_name_is_replaced_without_flushing(self):
+        self.updater.set('a', 1)
+        self.updater.set('b', 2)
+        self.updater.set('b', 3)
+        self.assertEqual(self.cotendo.payloads, [])
+        self.assertEqual(self.updater.coalesced, 1)
+
+    def test_failed_flush_is_raised(self):
+        self.updater.set('a', 1)
+        self.updater.set('b', 2)
+        self.cotendo.failing = True
+        self.assertRaises(IOError, self.updater.set, 'c', 3)
+        self.assertEqual(self.updater.pending, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+Edits of a CotendoDNS zone (cotendo.cotendohelper)
+
+    python -m unittest discover tests
+"""
+import gc
+import threading
+import unittest
+import warnings
+
+warnings.filterwarnings('ignore', module='BeautifulSoup')
+
+from cotendo.cotendohelper import CotendoDNS, paused_gc
+from cotendo.records import AResult, DNSRecord
+
+class ApplyChangesTest(unittest.TestCase):
+    def setUp(self):
+        self.dns = CotendoDNS.from_records('tok', [DNSRecord._create(
+            'a', 'www', [AResult('10.0.0.1')])])
+
+    def test_last_duplicate_upsert_wins(self):
+        self.dns.apply_changes(upserts=[('a', 'web', [('10.0.0.2',)]),
+                                        ('a', 'web', [('10.0.0.3',)])])
+        record = self.dns.get_record('a', 'web')
+        self.assertEqual([r.ip for r in record.results], ['10.0.0.3'])
+        self.assertEqual(self.dns.find_records(ip='10.0.0.2'), [])
+        self.assertEqual(self.dns.find_records(ip='10.0.0.3'),
+                         [('a', 'web')])
+
+    def test_dropped_duplicate_is_not_part_of_the_zone(self):
+        first = DNSRecord._create('a', 'web', [AResult('10.0.0.2')])
+        last = DNSRecord._create('a', 'web', [AResult('10.0.0.3')])
+        self.dns.apply_changes(upserts=[first, last])
+        first.host = 'other'
+        self.assertFalse(self.dns.get_record('a', 'other'))
+        self.assertEqual(self.dns.get_record('a', 'web'), last)
+        last.host = 'renamed'
+        self.assertEqual(self.dns.find_records(ip='10.0.0.3'),
+                         [('a', 'renamed')])
+
+    def test_upsert_of_a_stored_record(self):
+        record = self.dns.get_record('a', 'www')
+        self.dns.apply_changes(upserts=[record])
+        self.assertEqual(self.dns.find_records(ip='10.0.0.1'),
+                         [('a', 'www')])
+
+    def test_malformed_delete(self):
+        for delete in (None, 1, ('a',), ('a', 'www', 'x')):
+            self.assertRaises(ValueError, self.dns.apply_changes,
+                              deletes=[delete])
+        self.assertEqual(len(self.dns.find_records(ip='10.0.0.1')), 1)
+
+class PausedGcTest(unittest.TestCase):
+    def setUp(self):
+        self.enabled = gc.isenabled()
+        gc.enable()
+
+    def tearDown(self):
+        if not self.enabled:
+            gc.disable()
+
+    def test_overlapping_pauses_across_threads(self):
+        started = threading.Event()
+        done = threading.Event()
+        def load():
+            with paused_gc():
+                started.set()
+                done.wait()
+        thread = threading.Thread(target=load)
+        thread.start()
+        started.wait()
+        with paused_gc():
+            pass
+        # The other load is still running
+        self.assertFalse(gc.isenabled())
+        done.set()
+        thread.join()
+        self.assertTrue(gc.isenabled())
+
+    def test_disabled_collector_stays_disabled(self):
+        gc.disable()
+        with paused_gc():
+            pass
+        self.assertFalse(gc.isenabled())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+BIND master file import and export (cotendo.zonefile)
+
+    python -m unittest discover tests
+"""
+import time
+import unittest
+import warnings
+from StringIO import StringIO
+
+warnings.filterwarnings('ignore', module='BeautifulSoup')
+
+from cotendo import CotendoHelper
+from cotendo.cotendohelper import CotendoDNS, config_header, config_footer
+from cotendo.zonefile import load_zone, read_zone, write_zone, parse_ttl, \
+    ttl_re
+
+class ReadZoneTest(unittest.TestCase):
+    def records(self, lines, origin='x.com.'):
+        return list(read_zone(lines, origin))
+
+    def test_ttl_units(self):
+        self.assertEqual(parse_ttl('1h30m'), 5400)
+        self.assertEqual(parse_ttl('300'), 300)
+        for token in ('1h30m', '300', '2W', '1d2h3m4s'):
+            self.assertTrue(ttl_re.match(token), token)
+        for token in ('h', '1h30', '1x', ''):
+            self.assertFalse(ttl_re.match(token), token)
+
+    def test_long_invalid_token_is_rejected_quickly(self):
+        start = time.time()
+        self.assertFalse(ttl_re.match('1' * 5000 + 'x'))
+        self.assertRaises(ValueError, self.records,
+                          ['www ' + '1' * 40 + 'x IN A 10.0.0.1'])
+        self.assertTrue(time.time() - start < 0.5)
+
+    def test_ttl_and_class(self):
+        record_type, host, result = self.records(
+            ['www 1h IN A 10.0.0.1'])[0]
+        self.assertEqual((record_type, host, result.ip, result.ttl),
+                         ('a', 'www', '10.0.0.1', 3600))
+
+class UnicodeZoneTest(unittest.TestCase):
+    lines = ['$ORIGIN x.com.\n',
+             't 60 IN TXT "caf\xc3\xa9 \\"q\\"" "\\195\\169\\009"\n']
+
+    def test_utf8_lines_are_decoded(self):
+        record_type, host, result = list(read_zone(self.lines))[0]
+        self.assertEqual(result.text, u'caf\xe9 "q"\xe9\t')
+        self.assertTrue(isinstance(host, unicode))
+        self.assertTrue('text="caf\xc3\xa9 &quot;q&quot;\xc3\xa9' in
+                        load_zone(self.lines, token='tok').config)
+
+    def test_invalid_utf8_is_rejected(self):
+        self.assertRaises(ValueError, list, read_zone(['t IN TXT "\\233"']))
+
+    def test_export_round_trip(self):
+        helper = CotendoHelper('user', 'password')
+        helper.ImportZoneFile(self.lines, 'x.com.', 'tok')
+        out = StringIO()
+        helper.ExportZoneFile(out, 'x.com.')
+        dns = load_zone(out.getvalue().splitlines(True), 'x.com.', 'tok')
+        self.assertEqual(dns.config, helper.dns.config)
+
+    def test_long_text_splits_on_characters(self):
+        dns = load_zone(['t IN TXT "%s"' % ('\xc3\xa9' * 200)], 'x.com.')
+        line = list(write_zone(dns, 'x.com.'))[-1]
+        strings = line.split('\t')[-1].split(' ')
+        self.assertEqual([len(s.encode('utf-8')) for s in strings],
+                         [256, 148])
+        self.assertEqual(list(read_zone([line], 'x.com.'))[0][2].text,
+                         u'\xe9' * 200)
+
+zone_records = '''\
+    <a host="">
+      <result ttl="300" ip="10.0.0.1"/>
+    </a>
+    <cname host="www">
+      <result ttl="300" domain_name="x.com."/>
+    </cname>
+    <mx host="">
+      <result ttl="300" domain_name="mail.x.com." preference="10"/>
+    </mx>
+    <ptr host="1">
+      <result ttl="300" domain_name="host.x.com."/>
+    </ptr>
+    <srv host="_sip._tcp">
+      <result ttl="300" domain_name="_sip._tcp.x.com." priority="1" weight="10" port="5060" target="sip.y.com."/>
+      <result ttl="300" domain_name="_sip._udp." priority="2" weight="0" port="5060" target=""/>
+    </srv>
+    <txt host="t">
+      <result ttl="60" text="caf\xc3\xa9 &quot;q&quot;"/>
+    </txt>
+'''
+
+class RoundTripTest(unittest.TestCase):
+    def round_trip(self, dns):
+        lines = [(line + '\n').encode('utf-8')
+                 for line in write_zone(dns, 'x.com.')]
+        return load_zone(lines, 'x.com.', 'tok')
+
+    def test_zone_round_trips(self):
+        dns = CotendoDNS(('tok', config_header + zone_records + config_footer))
+        copy = self.round_trip(dns)
+        diff = dns.diff(copy)
+        self.assertEqual((diff.added, diff.removed, diff.changed),
+                         ([], [], []))
+        self.assertEqual(copy.config, dns.config)
+
+    def test_names_are_written_absolute(self):
+        dns = load_zone(['www IN CNAME web1.x.com.'], 'x.com.')
+        dns.get_record('cname', 'www').results[0].domain = 'web1.x.com'
+        self.assertEqual(list(write_zone(dns, 'x.com.'))[-1],
+                         'www\t1800\tIN\tCNAME\tweb1.x.com.')
+        copy = self.round_trip(dns)
+        self.assertEqual(copy.get_record('cname', 'www').results[0].domain,
+                         'web1.x.com.')
+        self.assertEqual(list(write_zone(self.round_trip(copy))),
+                         list(write_zone(copy)))
+
+if __name__ == '__main__':
+    unittest.main()